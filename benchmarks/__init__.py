@@ -0,0 +1,4 @@
+"""Benchmarks and load generators for the typing game server.
+
+Run them from the repository root, e.g. ``python -m benchmarks.loadgen``.
+"""
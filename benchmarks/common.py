@@ -0,0 +1,47 @@
+# benchmarks/common.py
+"""Helpers shared by the benchmark scripts."""
+import json
+import math
+import platform
+import sys
+import time
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(samples, scale=1.0, digits=3):
+    """Returns count, mean and p50/p95/p99/max for a list of samples, multiplied by scale."""
+    values = sorted(v * scale for v in samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), digits),
+        "p50": round(percentile(values, 0.50), digits),
+        "p95": round(percentile(values, 0.95), digits),
+        "p99": round(percentile(values, 0.99), digits),
+        "max": round(values[-1], digits),
+    }
+
+def environment():
+    """Describes the machine a result was produced on, for comparing runs."""
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+def write_report(report, path=None):
+    """Writes a report as JSON to path, or to stdout when path is None or '-'."""
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path in (None, "-"):
+        print(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        print(f"[INFO] Report written to {path}")
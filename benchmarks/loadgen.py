@@ -0,0 +1,335 @@
+# benchmarks/loadgen.py
+"""Headless load generator for server.py.
+
+Bots speak the same protocol as client.py: single-player challenges
+(preceded by a leaderboard rank query), create/join room pairs that both
+submit results, and quick_match players who wait in the matchmaking queue.
+Round-trip latency is measured from the request that triggers a reply to the
+moment the reply is decoded; queue_wait runs from quick_match to
+match_found. The run is summarized as JSON so results can be compared
+between releases.
+
+    python server.py --engine asyncio --max-wpm 0 &
+    python -m benchmarks.loadgen --concurrency 200 --sessions 5000 --output run.json
+"""
+import argparse
+import asyncio
+import copy
+import multiprocessing
+import random
+import string
+import time
+
+from benchmarks.common import environment, summarize, write_report
+from protocol import MessageDecoder, WIRE_FORMATS, encode_message, decode_frame, fill_sentence
+
+# --- Configuration ---
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 65432
+READ_SIZE = 4096
+REPLY_TIMEOUT = 30.0 # Seconds to wait for any single reply before counting an error
+
+class BotError(Exception):
+    """A bot session failed (timeout, unexpected reply or lost connection)."""
+
+class Stats:
+    """Counters and latency samples collected across every bot."""
+
+    def __init__(self):
+        self.connections = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.sessions = {"single": 0, "multi": 0, "quick": 0, "unmatched": 0}
+        self.errors = {}
+        self.latency = {} # {label: [seconds, ...]}
+
+    def record(self, label, seconds):
+        self.latency.setdefault(label, []).append(seconds)
+
+    def error(self, reason):
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def merge(self, other):
+        """Folds another process's stats into this one."""
+        self.connections += other.connections
+        self.messages_sent += other.messages_sent
+        self.messages_received += other.messages_received
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        for key, value in other.sessions.items():
+            self.sessions[key] = self.sessions.get(key, 0) + value
+        for key, value in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + value
+        for label, samples in other.latency.items():
+            self.latency.setdefault(label, []).extend(samples)
+
+class Bot:
+    """One scripted client connection."""
+
+    def __init__(self, stats, host, port, wire="json"):
+        self.stats = stats
+        self.host = host
+        self.port = port
+        self.wire = wire
+        self.binary = False
+        self.reader = None
+        self.writer = None
+        self.decoder = MessageDecoder()
+        self.pending = []
+        self.sentences = {} # Sentence ID -> text, for binary frames that leave it out
+
+    async def connect(self):
+        started = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.stats.record("connect", time.perf_counter() - started)
+        self.stats.connections += 1
+        if self.wire != "json":
+            sent_at = await self.send("hello", {"formats": [self.wire]})
+            message, received_at = await self.expect("hello")
+            self.stats.record("hello", received_at - sent_at)
+            self.binary = message.get("format") == self.wire
+
+    async def send(self, message_type, payload):
+        """Sends one message and returns the time it was written."""
+        data = encode_message({"type": message_type, "payload": payload}, self.binary)
+        self.writer.write(data)
+        self.stats.messages_sent += 1
+        self.stats.bytes_sent += len(data)
+        sent_at = time.perf_counter()
+        await self.writer.drain()
+        return sent_at
+
+    async def expect(self, *message_types):
+        """Waits for the next message of one of the given types. Returns (message, receive time)."""
+        while True:
+            while self.pending:
+                message = self.pending.pop(0)
+                if message.get("type") in message_types:
+                    return message, time.perf_counter()
+                if message.get("type") in ("error", "opponent_left"):
+                    raise BotError(message.get("type"))
+            data = await asyncio.wait_for(self.reader.read(READ_SIZE), REPLY_TIMEOUT)
+            if not data:
+                raise BotError("disconnected")
+            self.stats.bytes_received += len(data)
+            for frame in self.decoder.feed(data):
+                self.pending.append(fill_sentence(decode_frame(frame), self.sentences))
+                self.stats.messages_received += 1
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+# --- Typing Model ---
+def type_sentence(sentence, error_rate, rng):
+    """Returns the sentence with roughly error_rate of its characters replaced by typos."""
+    if error_rate <= 0:
+        return sentence
+    return "".join(rng.choice(string.ascii_lowercase) if rng.random() < error_rate else ch for ch in sentence)
+
+def typing_time(sentence, wpm):
+    """Seconds a typist at the given speed needs for the sentence (5 characters per word)."""
+    if wpm <= 0:
+        return 0.0
+    return (len(sentence) / 5) / wpm * 60
+
+# --- Scenarios ---
+def bot_name(args, rng):
+    """A leaderboard name from a fixed pool, so bots keep improving the same entries."""
+    return f"bot{rng.randrange(args.players)}"
+
+async def run_single(args, stats, rng):
+    bot = Bot(stats, args.host, args.port, args.wire)
+    try:
+        await bot.connect()
+        name = bot_name(args, rng)
+        sent_at = await bot.send("rank", {"player": name})
+        _, received_at = await bot.expect("rank")
+        stats.record("rank", received_at - sent_at)
+        sent_at = await bot.send("choose_mode", {"mode": "single", "name": name})
+        message, received_at = await bot.expect("challenge")
+        stats.record("challenge", received_at - sent_at)
+
+        sentence = message["sentence"]
+        duration = typing_time(sentence, args.wpm)
+        await asyncio.sleep(duration)
+        sent_at = await bot.send("submit_result", {"text": type_sentence(sentence, args.error_rate, rng),
+                                                   "sentence_id": message.get("sentence_id")})
+        _, received_at = await bot.expect("game_result")
+        stats.record("game_result", received_at - sent_at)
+        stats.sessions["single"] += 1
+    finally:
+        await bot.close()
+
+async def play_room_member(bot, args, rng, sentence):
+    duration = typing_time(sentence, args.wpm)
+    await asyncio.sleep(duration)
+    sent_at = await bot.send("submit_result", {"text": type_sentence(sentence, args.error_rate, rng)})
+    _, received_at = await bot.expect("game_over")
+    return sent_at, received_at
+
+async def run_pair(args, stats, rng):
+    host_bot = Bot(stats, args.host, args.port, args.wire)
+    guest_bot = Bot(stats, args.host, args.port, args.wire)
+    try:
+        await host_bot.connect()
+        await host_bot.send("choose_mode", {"mode": "multiplayer", "name": bot_name(args, rng)})
+        sent_at = await host_bot.send("multiplayer_action", {"action": "create"})
+        message, received_at = await host_bot.expect("room_created")
+        stats.record("room_created", received_at - sent_at)
+
+        await guest_bot.connect()
+        await guest_bot.send("choose_mode", {"mode": "multiplayer", "name": bot_name(args, rng)})
+        join_at = await guest_bot.send("multiplayer_action", {"action": "join", "room_id": message["room_id"]})
+        (start, guest_start_at), (_, host_start_at) = await asyncio.gather(
+            guest_bot.expect("game_start"), host_bot.expect("game_start"))
+        stats.record("game_start", guest_start_at - join_at)
+        stats.record("game_start", host_start_at - join_at)
+
+        sentence = start["sentence"]
+        outcomes = await asyncio.gather(play_room_member(host_bot, args, rng, sentence),
+                                        play_room_member(guest_bot, args, rng, sentence))
+        # game_over can only be sent once the last result is in, so time it from there.
+        last_submit = max(sent for sent, _ in outcomes)
+        for _, received_at in outcomes:
+            stats.record("game_over", received_at - last_submit)
+        stats.sessions["multi"] += 1
+    finally:
+        await asyncio.gather(host_bot.close(), guest_bot.close())
+
+async def run_quick(args, stats, rng):
+    bot = Bot(stats, args.host, args.port, args.wire)
+    try:
+        await bot.connect()
+        await bot.send("choose_mode", {"mode": "multiplayer", "name": bot_name(args, rng)})
+        sent_at = await bot.send("multiplayer_action", {"action": "quick_match", "size": args.match_size})
+        await bot.expect("queued")
+        try:
+            _, received_at = await asyncio.wait_for(bot.expect("match_found"), args.queue_timeout)
+        except asyncio.TimeoutError:
+            stats.sessions["unmatched"] += 1 # Nobody else was queued; not a server error
+            return
+        stats.record("queue_wait", received_at - sent_at)
+        start, _ = await bot.expect("game_start")
+        await play_room_member(bot, args, rng, start["sentence"])
+        stats.sessions["quick"] += 1
+    finally:
+        await bot.close()
+
+def pick_scenario(args, rng):
+    roll = rng.random()
+    if roll < args.quick_match_ratio:
+        return run_quick
+    if roll < args.quick_match_ratio + args.multiplayer_ratio:
+        return run_pair
+    return run_single
+
+async def worker(args, stats, deadline, budget, rng):
+    while budget[0] > 0 and time.perf_counter() < deadline:
+        budget[0] -= 1
+        scenario = pick_scenario(args, rng)
+        try:
+            await scenario(args, stats, rng)
+        except BotError as e:
+            stats.error(str(e))
+        except asyncio.TimeoutError:
+            stats.error("timeout")
+        except (ConnectionError, OSError) as e:
+            stats.error(type(e).__name__)
+
+async def run(args, seed=None):
+    stats = Stats()
+    rng = random.Random(seed)
+    budget = [args.sessions]
+    started = time.perf_counter()
+    deadline = started + args.duration if args.duration else float("inf")
+    await asyncio.gather(*(worker(args, stats, deadline, budget, random.Random(rng.random()))
+                           for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    return stats, elapsed
+
+def run_process(args, index):
+    """Entry point for one generator process; runs its share of the sessions and concurrency."""
+    share = copy.copy(args)
+    share.sessions = args.sessions // args.processes + (index < args.sessions % args.processes)
+    share.concurrency = max(1, args.concurrency // args.processes)
+    seed = None if args.seed is None else args.seed + index
+    return asyncio.run(run(share, seed))
+
+def run_all(args):
+    """Runs the generator in args.processes processes, so the bots aren't limited to one core."""
+    if args.processes <= 1:
+        return asyncio.run(run(args, args.seed))
+    with multiprocessing.Pool(args.processes) as pool:
+        outcomes = pool.starmap(run_process, [(args, i) for i in range(args.processes)])
+    stats = Stats()
+    for part, _ in outcomes:
+        stats.merge(part)
+    return stats, max(elapsed for _, elapsed in outcomes)
+
+def build_report(args, stats, elapsed):
+    messages = stats.messages_sent + stats.messages_received
+    return {
+        "benchmark": "loadgen",
+        "environment": environment(),
+        "config": {
+            "host": args.host, "port": args.port, "concurrency": args.concurrency, "processes": args.processes,
+            "sessions": args.sessions, "duration": args.duration, "wpm": args.wpm,
+            "error_rate": args.error_rate, "multiplayer_ratio": args.multiplayer_ratio, "seed": args.seed,
+            "players": args.players, "wire": args.wire, "quick_match_ratio": args.quick_match_ratio,
+            "match_size": args.match_size,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "sessions": stats.sessions,
+        "errors": stats.errors,
+        "connections": stats.connections,
+        "connections_per_sec": round(stats.connections / elapsed, 1) if elapsed else 0,
+        "messages": messages,
+        "messages_per_sec": round(messages / elapsed, 1) if elapsed else 0,
+        "bytes_sent": stats.bytes_sent,
+        "bytes_received": stats.bytes_received,
+        "bytes_per_message_sent": round(stats.bytes_sent / stats.messages_sent, 1) if stats.messages_sent else 0,
+        "bytes_per_message_received": round(stats.bytes_received / stats.messages_received, 1) if stats.messages_received else 0,
+        "queue_wait_ms": summarize(stats.latency.get("queue_wait", []), scale=1000),
+        "latency_ms": {label: summarize(samples, scale=1000) for label, samples in sorted(stats.latency.items())},
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive a running server with scripted bot clients.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--concurrency", type=int, default=50, help="Scenarios running at once (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Generator processes; use several when measuring a multi-worker server (default: %(default)s)")
+    parser.add_argument("--sessions", type=int, default=1000, help="Total scenarios to run (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0: no limit)")
+    parser.add_argument("--wpm", type=float, default=0, help="Bot typing speed; 0 submits immediately (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Fraction of characters mistyped (default: %(default)s)")
+    parser.add_argument("--multiplayer-ratio", type=float, default=0.5,
+                        help="Fraction of scenarios that are create/join room pairs (default: %(default)s)")
+    parser.add_argument("--quick-match-ratio", type=float, default=0,
+                        help="Fraction of scenarios that are single bots using quick_match (default: %(default)s)")
+    parser.add_argument("--match-size", type=int, default=2, help="Group size quick_match bots ask for (default: %(default)s)")
+    parser.add_argument("--queue-timeout", type=float, default=REPLY_TIMEOUT,
+                        help="Seconds a quick_match bot waits for a match before giving up (default: %(default)s)")
+    parser.add_argument("--players", type=int, default=1000,
+                        help="Distinct leaderboard names the bots play under (default: %(default)s)")
+    parser.add_argument("--wire", choices=WIRE_FORMATS, default="json",
+                        help="Wire format the bots ask for in a hello handshake (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible typing errors and scenario mix")
+    parser.add_argument("--output", default="-", help="Write the JSON report here (default: stdout)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    stats, elapsed = run_all(args)
+    write_report(build_report(args, stats, elapsed), args.output)
+
+if __name__ == "__main__":
+    main()
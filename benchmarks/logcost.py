@@ -0,0 +1,56 @@
+# benchmarks/logcost.py
+"""Measures what logging one received message costs the handler that receives it.
+
+    python -m benchmarks.logcost --events 200000
+
+Compares the print() call the server used to make for every message with
+serverlog at the default level (RECV filtered out), at debug with sampling,
+and at debug logging everything through the queue. Output goes to
+os.devnull, so the numbers are the handler-side cost only; with print() a
+slow terminal or pipe would add its write time on top.
+"""
+import argparse
+import contextlib
+import os
+import time
+
+from benchmarks.common import environment, write_report
+import serverlog
+from serverlog import log
+
+MESSAGE = {"type": "progress", "payload": {"del": 0, "add": "the quick "}}
+ADDR = ("127.0.0.1", 50000)
+
+def per_event_us(fn, events):
+    started = time.perf_counter()
+    for _ in range(events):
+        fn()
+    return round((time.perf_counter() - started) / events * 1e6, 3)
+
+def measure(events, sample):
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            results["print_us"] = per_event_us(lambda: print(f"[RECV] From {ADDR}: {MESSAGE}"), events)
+
+        for name, level, every in (("info_us", "info", 1), (f"debug_sample_{sample}_us", "debug", sample), ("debug_all_us", "debug", 1)):
+            serverlog.setup(level, "text", every, stream=devnull)
+            results[name] = per_event_us(lambda: log("RECV", "From %s: %s", ADDR, MESSAGE), events)
+            serverlog.stop()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--sample", type=int, default=100)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+    write_report({
+        "benchmark": "logcost",
+        "environment": environment(),
+        "events": args.events,
+        "results": measure(args.events, args.sample),
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/memory.py
+"""Resident memory of idle sessions: per-connection dicts keyed by socket vs Session objects.
+
+Each measurement runs in a fresh process that registers N idle connections,
+each with its idle timer, and reports how much the resident set grew.
+"dict" is the old layout, a dict of fields per connection in a table keyed
+by the connection object; "slots" is the current ClientRegistry of Sessions
+keyed by session ID. The connection objects themselves are the same tiny
+stand-in in both, since sockets and send queues don't depend on the layout.
+
+Two kinds of idle session are measured: "connected" has only just been
+accepted, and "menu" has said hello with RTT pings on and is sitting named
+in the multiplayer menu. The old dicts grew a key for every field set, so
+they cost most in the second case.
+
+    python -m benchmarks.memory --sessions 10000 100000
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from benchmarks.common import environment, write_report
+from rooms import ClientRegistry, DEFAULT_SHARDS
+from rtt import RttEstimator
+from session import State
+from timers import TimerWheel
+
+LAYOUTS = ("dict", "slots")
+KINDS = ("connected", "menu")
+
+class _Conn:
+    """Stand-in for a QueuedConnection or StreamConnection."""
+
+    __slots__ = ("session",)
+
+    def __init__(self):
+        self.session = None
+
+def resident_bytes():
+    """Current resident set size, or the peak where the current one can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def _dict_sessions(count, kind, wheel, idle_timeout):
+    """The old layout: {conn: {"addr", "name", "room_id", "state", ...}} in shards keyed by id(conn)."""
+    shards = [{} for _ in range(DEFAULT_SHARDS)]
+    for i in range(count):
+        conn = _Conn()
+        info = {"addr": ("127.0.0.1", 1024 + i % 60000), "name": None, "room_id": None, "state": "connected"}
+        info["last_seen"] = time.monotonic()
+        info["idle_timer"] = wheel.schedule(idle_timeout, print, conn)
+        if kind == "menu":
+            info["binary"] = True
+            info["rtt"] = RttEstimator()
+            info["ping_id"] = 1
+            info["ping_sent"] = (1, time.monotonic())
+            info["ping_timer"] = wheel.schedule(2.0, print, conn)
+            info["name"] = f"player{i}"
+            info["state"] = "multiplayer_menu"
+        shards[(id(conn) >> 4) % DEFAULT_SHARDS][conn] = info
+    return shards
+
+def _slot_sessions(count, kind, wheel, idle_timeout):
+    clients = ClientRegistry()
+    for i in range(count):
+        session = clients.add(_Conn(), ("127.0.0.1", 1024 + i % 60000))
+        session.last_seen = time.monotonic()
+        session.idle_timer = wheel.schedule(idle_timeout, print, session.id)
+        if kind == "menu":
+            session.binary = True
+            session.rtt = RttEstimator()
+            session.ping_id = 1
+            session.ping_sent = (1, time.monotonic())
+            session.ping_timer = wheel.schedule(2.0, print, session.id)
+            session.name = f"player{i}"
+            session.state = State.MULTIPLAYER_MENU
+    return clients
+
+def measure(layout, count, kind, idle_timeout=300.0):
+    """Runs in a child process. Returns resident bytes added by `count` idle sessions."""
+    wheel = TimerWheel()
+    build = _dict_sessions if layout == "dict" else _slot_sessions
+    gc.collect()
+    before = resident_bytes()
+    table = build(count, kind, wheel, idle_timeout)
+    gc.collect()
+    grown = resident_bytes() - before
+    del table
+    return grown
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+    results = []
+    context = multiprocessing.get_context("spawn") # A clean heap for every measurement
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for count in args.sessions:
+            for kind in KINDS:
+                row = {"sessions": count, "kind": kind}
+                for layout in LAYOUTS:
+                    grown = pool.apply(measure, (layout, count, kind))
+                    row[f"{layout}_mb"] = round(grown / 2 ** 20, 1)
+                    row[f"{layout}_bytes_per_session"] = round(grown / count)
+                row["saved_pct"] = round(100 * (1 - row["slots_mb"] / row["dict_mb"]), 1) if row["dict_mb"] else None
+                results.append(row)
+    write_report({
+        "benchmark": "memory",
+        "environment": environment(),
+        "results": results,
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
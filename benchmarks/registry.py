@@ -0,0 +1,55 @@
+# benchmarks/registry.py
+"""Times room creation and lookup in RoomRegistry as the number of live rooms grows.
+
+    python -m benchmarks.registry --rooms 1000 10000 100000
+"""
+import argparse
+import time
+
+from benchmarks.common import environment, write_report
+from rooms import RoomRegistry
+
+def measure(room_count, probes):
+    digits = max(4, len(str(room_count)) + 1)
+    registry = RoomRegistry(10 ** (digits - 1), 10 ** digits - 1, seed=0)
+    owner = 1 # Session ID of the host
+
+    started = time.perf_counter()
+    room_ids = [registry.create(owner) for _ in range(room_count)]
+    create_s = time.perf_counter() - started
+
+    lookups = [room_ids[(i * 7919) % room_count] for i in range(probes)]
+    started = time.perf_counter()
+    for room_id in lookups:
+        registry.get(room_id)
+    lookup_s = time.perf_counter() - started
+
+    # Churn: free and reallocate, which exercises the free list.
+    started = time.perf_counter()
+    for room_id in room_ids[:probes]:
+        registry.remove(room_id)
+        registry.create(owner)
+    churn_s = time.perf_counter() - started
+    churned = min(probes, room_count)
+
+    return {
+        "rooms": room_count,
+        "create_ns": round(create_s / room_count * 1e9),
+        "lookup_ns": round(lookup_s / probes * 1e9),
+        "remove_create_ns": round(churn_s / churned * 1e9),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--probes", type=int, default=100000)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+    write_report({
+        "benchmark": "registry",
+        "environment": environment(),
+        "results": [measure(count, args.probes) for count in args.rooms],
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# benchmarks/replay.py
+"""Replays sessions recorded with `server.py --record` against a server and checks the results.
+
+Every recorded connection becomes one client, and they all run concurrently
+on one event loop. Each inbound frame is sent at its recorded time divided by
+--speed (0: as fast as the replies allow), and never before the server has
+sent as many replies as it had at that point in the recording, so a submit
+never overtakes its challenge. The pause between that last reply and the
+frame is kept too, scaled by the speed, so the server times attempts the way
+it did when they were recorded. Replies are read with the streaming decoder.
+
+Three things are rewritten on the way, since they can't be replayed verbatim:
+room IDs in joins are mapped to the IDs the server hands out this time; the
+recorded sentence is pinned with a "sentence_id" option (the server must run
+with --pin-sentences, or results will differ); and the server's pings are
+answered live instead of with the recorded pongs, so RTT is measured on the
+replay's own network.
+
+Every game_result and game_over is compared with the recorded one. Accuracy
+and errors must match exactly. WPM depends on timing, so it is compared only
+at a finite speed, scaled by the speed, within --wpm-tolerance. Rankings,
+winners and ratings follow from WPM and rating history and are not compared.
+Quick matches can pair players differently on replay, so for those only the
+session's own result and the number of players are compared.
+
+    python server.py --pin-sentences --msg-rate 0 --max-wpm 0 --port 65500 &
+    python -m benchmarks.replay traffic.rec --port 65500 --speed 1 --output replay.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.common import environment, write_report
+from protocol import BINARY_MAGIC, DELIMITER, MalformedFrame, MessageDecoder, decode_frame, encode_message
+from recorder import CLOSE, IN, OPEN, OUT, read_records, recording_files
+from server import clean_name
+
+# --- Configuration ---
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 65432
+READ_SIZE = 4096
+REPLY_TIMEOUT = 10.0 # Seconds to wait for a reply the recording says should have come before going on
+ASYNC_TYPES = ("ping", "pong", "progress_update") # Sent on timers; their counts say nothing about ordering
+RESULT_TYPES = ("game_result", "game_over")
+SHOW_MISMATCHES = 20 # Mismatches listed in the report
+
+class Step:
+    """One recorded inbound frame."""
+
+    __slots__ = ("at", "pause", "frame", "message", "replies_before", "pin", "room")
+
+    def __init__(self, at, pause, frame, message, replies_before):
+        self.at = at
+        self.pause = pause     # Seconds between the last reply before this frame and the frame
+        self.frame = frame
+        self.message = message # Decoded JSON message, or None for binary and unreadable frames
+        self.replies_before = replies_before
+        self.pin = None        # Recorded sentence_id to ask for
+        self.room = None       # (session key, index) of the room_created a join refers to
+
+class Session:
+    """One recorded connection and what became of it in the replay."""
+
+    def __init__(self, key, addr, opened):
+        self.key = key
+        self.addr = addr
+        self.opened = opened
+        self.steps = []
+        self.recorded_results = []
+        self.quick_results = set() # Indexes into recorded_results of games found by quick_match
+        self.matched = False       # The last room this session was in came from match_found
+        self.name = None           # Leaderboard name from choose_mode, as the server cleaned it
+        self.recorded_rooms = [] # (time, room_id) from room_created, in order
+        self.sentences = []      # (reply index, type, sentence_id) from challenge and game_start
+        self.replies = 0         # Recorded replies so far, while loading
+        self.last_reply = None   # ...and when the last of them was sent
+        self.decoder = MessageDecoder()
+        # Replay state
+        self.results = []
+        self.received = 0
+        self.arrivals = [] # When each reply arrived
+        self.rooms_seen = 0
+        self.changed = None
+        self.writer = None
+        self.error = None
+        self.stalls = 0
+
+    def add_output(self, at, data):
+        for frame in self.decoder.feed(data):
+            try:
+                message = decode_frame(frame)
+            except (ValueError, MalformedFrame):
+                continue
+            msg_type = message.get("type")
+            if msg_type in ASYNC_TYPES:
+                continue
+            if msg_type in RESULT_TYPES:
+                if msg_type == "game_over" and self.matched:
+                    self.quick_results.add(len(self.recorded_results))
+                self.recorded_results.append(message)
+            elif msg_type == "match_found":
+                self.matched = True
+            elif msg_type == "room_created":
+                self.matched = False
+                self.recorded_rooms.append((at, message.get("room_id")))
+            elif msg_type == "room_update":
+                self.matched = False
+            elif msg_type in ("challenge", "game_start"):
+                self.sentences.append((self.replies, msg_type, message.get("sentence_id")))
+            self.replies += 1
+            self.last_reply = at
+
+    def add_input(self, at, frame):
+        message = None
+        if frame[:1] != bytes([BINARY_MAGIC]):
+            try:
+                message = decode_frame(frame)
+            except ValueError:
+                pass # Replayed as recorded
+            if isinstance(message, dict) and message.get("type") == "pong":
+                return # The replay answers the server's own pings
+            if isinstance(message, dict) and message.get("type") == "choose_mode" and isinstance(message.get("payload"), dict):
+                self.name = clean_name(message["payload"].get("name"))
+        pause = at - self.last_reply if self.last_reply is not None else 0.0
+        self.steps.append(Step(at, pause, frame, message if isinstance(message, dict) else None, self.replies))
+
+    def pin_sentences(self):
+        """Gives each step that starts a game the sentence the recording got for it."""
+        for step in self.steps:
+            message = step.message
+            if message is None:
+                continue
+            payload = message.get("payload") or {}
+            if message.get("type") == "choose_mode" and payload.get("mode") == "single":
+                wanted = "challenge"
+            elif message.get("type") == "multiplayer_action" and payload.get("action") in ("create", "quick_match"):
+                wanted = "game_start"
+            else:
+                continue
+            step.pin = next((sentence_id for index, msg_type, sentence_id in self.sentences
+                             if index >= step.replies_before and msg_type == wanted), None)
+
+# --- Loading ---
+def load_sessions(paths):
+    """Reads recordings into Sessions, ordered by when they connected. Returns (sessions, partial count)."""
+    sessions = {}
+    partial = set()
+    for path in paths:
+        files = recording_files(path)
+        if not files:
+            raise FileNotFoundError(f"No recording at {path}")
+        for name in files:
+            for run, kind, conn_id, at, payload in read_records(name):
+                key = (path, run, conn_id)
+                if kind == OPEN:
+                    sessions[key] = Session(key, payload.decode('utf-8'), at)
+                    continue
+                session = sessions.get(key)
+                if session is None:
+                    partial.add(key) # Opened in a file that has since rotated away
+                elif kind == IN:
+                    session.add_input(at, payload)
+                elif kind == OUT:
+                    session.add_output(at, payload)
+                elif kind == CLOSE:
+                    pass # The replay closes once the recorded results are in, or the server hangs up
+    ordered = sorted(sessions.values(), key=lambda session: session.opened)
+    for session in ordered:
+        session.pin_sentences()
+    link_joins(ordered)
+    return ordered, len(partial)
+
+def link_joins(sessions):
+    """Points every join at the room it joined: the last one created with that ID before it.
+
+    Room IDs are reused once a room is gone, so the ID alone is not enough.
+    """
+    created = {} # {room_id: [(time, (session key, index))], oldest first}
+    for session in sessions:
+        for index, (at, room_id) in enumerate(session.recorded_rooms):
+            created.setdefault(str(room_id), []).append((at, (session.key, index)))
+    for rooms in created.values():
+        rooms.sort(key=lambda room: room[0])
+    for session in sessions:
+        for step in session.steps:
+            message = step.message or {}
+            payload = message.get("payload")
+            if message.get("type") == "multiplayer_action" and isinstance(payload, dict) and payload.get("action") == "join":
+                earlier = [token for at, token in created.get(str(payload.get("room_id")), []) if at <= step.at]
+                step.room = earlier[-1] if earlier else None
+
+# --- Replay ---
+class Replay:
+    def __init__(self, args, sessions):
+        self.args = args
+        self.sessions = sessions
+        self.rooms = {} # {(session key, index): Future of the replayed room_id}
+        self.aliases = {} # {recorded address: replayed address}, for players without a name
+        self.origin = sessions[0].opened if sessions else 0.0
+        self.started = None
+        self.errors = {}
+
+    def due(self, at):
+        if not self.args.speed:
+            return 0.0
+        return self.started + (at - self.origin) / self.args.speed
+
+    async def sleep_until(self, at):
+        delay = self.due(at) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def room_future(self, token):
+        """The replayed ID of a recorded room, once its creator gets room_created."""
+        future = self.rooms.get(token)
+        if future is None:
+            future = self.rooms[token] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def wait_for(self, session, condition):
+        """Waits until condition() holds or REPLY_TIMEOUT passes. Returns False on timeout."""
+        deadline = time.monotonic() + self.args.reply_timeout
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or session.writer is None:
+                return False
+            session.changed.clear()
+            try:
+                await asyncio.wait_for(session.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return condition()
+        return True
+
+    async def read_replies(self, session, reader):
+        decoder = MessageDecoder()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    self.on_reply(session, decode_frame(frame))
+                session.changed.set()
+        except (ConnectionError, OSError, ValueError, MalformedFrame) as e:
+            session.error = session.error or type(e).__name__
+        finally:
+            session.writer = None # Nothing more will come
+            session.changed.set()
+
+    def on_reply(self, session, message):
+        msg_type = message.get("type")
+        if msg_type == "ping":
+            session.writer.write(encode_message({"type": "pong", "payload": {"id": message.get("id")}}))
+            return
+        if msg_type in ASYNC_TYPES:
+            return
+        session.received += 1
+        session.arrivals.append(time.monotonic())
+        if msg_type in RESULT_TYPES:
+            session.results.append(message)
+        elif msg_type == "room_created" and session.rooms_seen < len(session.recorded_rooms):
+            future = self.room_future((session.key, session.rooms_seen))
+            session.rooms_seen += 1
+            if not future.done():
+                future.set_result(message.get("room_id"))
+
+    async def outgoing(self, session, step):
+        """The bytes to send for a step, with its room ID mapped and its sentence pinned."""
+        message = step.message
+        if message is None:
+            return step.frame if step.frame[:1] == bytes([BINARY_MAGIC]) else step.frame + DELIMITER
+        payload = message.get("payload")
+        if step.pin is not None and isinstance(payload, dict):
+            message = dict(message, payload=dict(payload, sentence_id=step.pin))
+        elif step.room is not None:
+            future = self.room_future(step.room)
+            try:
+                room_id = await asyncio.wait_for(asyncio.shield(future), self.args.reply_timeout)
+                message = dict(message, payload=dict(payload, room_id=room_id))
+            except asyncio.TimeoutError:
+                session.stalls += 1 # Join the recorded ID; the server will most likely refuse
+        return json.dumps(message, separators=(",", ":")).encode('utf-8') + DELIMITER
+
+    async def run_session(self, session, limit):
+        await self.sleep_until(session.opened)
+        async with limit:
+            try:
+                reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+            except OSError as e:
+                self.error(type(e).__name__)
+                return
+            session.writer = writer
+            session.changed = asyncio.Event()
+            self.aliases[session.addr] = str(writer.get_extra_info("sockname"))
+            replies = asyncio.ensure_future(self.read_replies(session, reader))
+            try:
+                for step in session.steps:
+                    await self.sleep_until(step.at)
+                    if not await self.wait_for(session, lambda: session.received >= step.replies_before):
+                        if session.writer is None:
+                            break # The server hung up early
+                        session.stalls += 1 # Replay diverged; carry on with the recording
+                    elif step.replies_before and self.args.speed:
+                        # Keep the client's think time after the reply, scaled like everything else
+                        delay = session.arrivals[step.replies_before - 1] + step.pause / self.args.speed - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    data = await self.outgoing(session, step)
+                    if session.writer is None:
+                        break
+                    writer.write(data)
+                    await writer.drain()
+                await self.wait_for(session, lambda: len(session.results) >= len(session.recorded_results))
+            except (ConnectionError, OSError) as e:
+                session.error = session.error or type(e).__name__
+            finally:
+                writer.close()
+                await replies
+                if session.error:
+                    self.error(session.error)
+
+    def error(self, reason):
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    async def run(self):
+        self.started = time.monotonic()
+        limit = asyncio.Semaphore(self.args.concurrency)
+        await asyncio.gather(*(self.run_session(session, limit) for session in self.sessions))
+        return time.monotonic() - self.started
+
+# --- Checking ---
+def compare_scores(label, recorded, replayed, args, differences):
+    """Appends what differs between two results dicts ({"wpm", "accuracy", "errors"})."""
+    if not isinstance(recorded, dict) or not isinstance(replayed, dict):
+        differences.append(f"{label}: recorded {recorded!r}, replayed {replayed!r}")
+        return
+    for field in ("accuracy", "errors"):
+        if recorded.get(field) != replayed.get(field):
+            differences.append(f"{label} {field}: recorded {recorded.get(field)!r}, replayed {replayed.get(field)!r}")
+    if args.speed:
+        expected = recorded.get("wpm", 0) * args.speed
+        if abs(replayed.get("wpm", 0) - expected) > max(1.0, args.wpm_tolerance * expected):
+            differences.append(f"{label} wpm: expected {expected:g}, replayed {replayed.get('wpm')!r}")
+
+def compare(recorded, replayed, aliases, args, own=None):
+    """Returns the differences between a recorded and a replayed game_result or game_over.
+
+    own is the session's player in a quick match's game_over: only that
+    player's result and the player count are compared.
+    """
+    differences = []
+    if recorded.get("type") != replayed.get("type"):
+        return [f"type: recorded {recorded.get('type')}, replayed {replayed.get('type')}"]
+    if recorded["type"] == "game_result":
+        compare_scores("results", recorded.get("results"), replayed.get("results"), args, differences)
+        return differences
+    results = replayed.get("results", {})
+    recorded_out = [aliases.get(player, player) for player in recorded.get("timed_out", [])]
+    replayed_out = replayed.get("timed_out", [])
+    if own is not None:
+        # The other players are whoever the queue paired this time
+        mine = aliases.get(own, own)
+        if own in recorded.get("results", {}):
+            compare_scores(f"results[{mine}]", recorded["results"][own], results.get(mine), args, differences)
+        if (mine in recorded_out) != (mine in replayed_out):
+            differences.append(f"timed_out[{mine}]: recorded {mine in recorded_out}, replayed {mine in replayed_out}")
+        recorded_players = len(recorded.get("results", {})) + len(recorded_out)
+        if len(results) + len(replayed_out) != recorded_players:
+            differences.append(f"players: recorded {recorded_players}, replayed {len(results) + len(replayed_out)}")
+        return differences
+    for player, score in recorded.get("results", {}).items():
+        player = aliases.get(player, player)
+        compare_scores(f"results[{player}]", score, results.get(player), args, differences)
+    if len(results) != len(recorded.get("results", {})):
+        differences.append(f"players ranked: recorded {len(recorded.get('results', {}))}, replayed {len(results)}")
+    if sorted(recorded_out) != sorted(replayed_out):
+        differences.append(f"timed_out: recorded {sorted(recorded_out)}, replayed {sorted(replayed_out)}")
+    return differences
+
+def check(sessions, aliases, args):
+    """Compares every session's results. Returns (counts, mismatch details)."""
+    counts = {"matched": 0, "mismatched": 0, "missing": 0, "unexpected": 0}
+    mismatches = []
+    for session in sessions:
+        for index, recorded in enumerate(session.recorded_results):
+            if index >= len(session.results):
+                counts["missing"] += 1
+                continue
+            own = (session.name or session.addr) if index in session.quick_results else None
+            differences = compare(recorded, session.results[index], aliases, args, own)
+            if differences:
+                counts["mismatched"] += 1
+                mismatches.append({"session": f"{session.key[0]}#{session.key[2]}", "addr": session.addr,
+                                   "type": recorded.get("type"), "differences": differences})
+            else:
+                counts["matched"] += 1
+        counts["unexpected"] += max(0, len(session.results) - len(session.recorded_results))
+    return counts, mismatches
+
+def build_report(args, sessions, partial, replay, elapsed):
+    counts, mismatches = check(sessions, replay.aliases, args)
+    span = sessions[-1].opened - sessions[0].opened if sessions else 0.0
+    return {
+        "benchmark": "replay",
+        "environment": environment(),
+        "config": {"recordings": args.recordings, "host": args.host, "port": args.port, "speed": args.speed,
+                   "concurrency": args.concurrency, "wpm_tolerance": args.wpm_tolerance},
+        "sessions": len(sessions),
+        "sessions_partial": partial,
+        "recorded_span_s": round(span, 3),
+        "elapsed_s": round(elapsed, 3),
+        "frames_sent": sum(len(session.steps) for session in sessions),
+        "results": counts,
+        "stalls": sum(session.stalls for session in sessions),
+        "errors": replay.errors,
+        "mismatches": mismatches[:SHOW_MISMATCHES],
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded sessions against a server and check the results.")
+    parser.add_argument("recordings", nargs="+",
+                        help="Recording paths given to --record (one per worker for a cluster); rotated files are included")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed: 1 is real time, N is N times faster, 0 is as fast as possible (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=1000, help="Sessions connected at once, at most (default: %(default)s)")
+    parser.add_argument("--reply-timeout", type=float, default=REPLY_TIMEOUT,
+                        help="Seconds to wait for a reply the recording had before sending on (default: %(default)s)")
+    parser.add_argument("--wpm-tolerance", type=float, default=0.1,
+                        help="Relative WPM difference accepted, after scaling by --speed (default: %(default)s)")
+    parser.add_argument("--output", default="-", help="Write the JSON report here (default: stdout)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sessions, partial = load_sessions(args.recordings)
+    replay = Replay(args, sessions)
+    elapsed = asyncio.run(replay.run())
+    report = build_report(args, sessions, partial, replay, elapsed)
+    write_report(report, args.output)
+    return 1 if report["results"]["mismatched"] or report["results"]["missing"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
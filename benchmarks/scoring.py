@@ -0,0 +1,90 @@
+# benchmarks/scoring.py
+"""Compares the alignment-based scorer with the original positional comparison.
+
+    python -m benchmarks.scoring --lengths 50 500 2000 --submissions 200
+"""
+import argparse
+import random
+import string
+import time
+
+from benchmarks.common import environment, write_report
+import scoring
+
+def positional_accuracy(original_sentence, typed_text):
+    """The accuracy loop calculate_results used before scoring.py, kept for comparison."""
+    correct_chars = 0
+    min_len = min(len(original_sentence), len(typed_text))
+    for i in range(min_len):
+        if original_sentence[i] == typed_text[i]:
+            correct_chars += 1
+    return (correct_chars / len(original_sentence)) * 100 if len(original_sentence) > 0 else 0.0
+
+def make_passage(length, rng):
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9))))
+    return " ".join(words)[:length]
+
+def mistype(text, error_rate, rng):
+    """Applies random substitutions, dropped and doubled characters."""
+    out = []
+    for ch in text:
+        roll = rng.random()
+        if roll < error_rate / 3:
+            out.append(rng.choice(string.ascii_lowercase))
+        elif roll < 2 * error_rate / 3:
+            continue
+        elif roll < error_rate:
+            out.append(ch + ch)
+        else:
+            out.append(ch)
+    return "".join(out)
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+def measure(length, submissions, error_rate, rng):
+    original = make_passage(length, rng)
+    typed = [mistype(original, error_rate, rng) for _ in range(submissions)]
+    pairs = [(original, t) for t in typed]
+    repeat = 3
+
+    legacy_s, legacy = timed(lambda: [positional_accuracy(original, t) for t in typed], repeat)
+    distance_s, batch = timed(lambda: scoring.score_batch(pairs), repeat)
+    details_s, _ = timed(lambda: scoring.score_batch(pairs, details=True), 1)
+
+    # One dropped character near the start: the positional metric collapses.
+    dropped = original[:3] + original[4:]
+    return {
+        "length": length,
+        "submissions": submissions,
+        "legacy_us_per_submission": round(legacy_s / submissions * 1e6, 2),
+        "distance_us_per_submission": round(distance_s / submissions * 1e6, 2),
+        "details_us_per_submission": round(details_s / submissions * 1e6, 2),
+        "mean_accuracy_legacy": round(sum(legacy) / len(legacy), 2),
+        "mean_accuracy_alignment": round(sum(r["accuracy"] for r in batch) / len(batch), 2),
+        "one_dropped_char_legacy": round(positional_accuracy(original, dropped), 2),
+        "one_dropped_char_alignment": scoring.score(original, dropped)["accuracy"],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[50, 500, 2000])
+    parser.add_argument("--submissions", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.03)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+    write_report({
+        "benchmark": "scoring",
+        "environment": environment(),
+        "results": [measure(length, args.submissions, args.error_rate, rng) for length in args.lengths],
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
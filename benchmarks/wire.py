@@ -0,0 +1,59 @@
+# benchmarks/wire.py
+"""Bytes per message and encode/decode cost of the JSON and binary wire formats.
+
+    python -m benchmarks.wire --repeat 20000
+"""
+import argparse
+import time
+
+from benchmarks.common import environment, write_report
+from protocol import MessageDecoder, encode_message, decode_frame
+
+SENTENCE = "The quick brown fox jumps over the lazy dog while the cat watches from the fence."
+
+def progress_update(players):
+    return {"type": "progress_update", "players": {
+        f"('10.0.0.{i}', {50000 + i})": {"position": 40 + i, "length": len(SENTENCE), "wpm": 70 + i,
+                                          "accuracy": 97.5, "done": False} for i in range(players)}}
+
+MESSAGES = {
+    "progress": {"type": "progress", "payload": {"del": 1, "add": "fox "}},
+    "submit_result": {"type": "submit_result", "payload": {"text": SENTENCE, "sentence_id": 42}},
+    "challenge": {"type": "challenge", "sentence": SENTENCE, "sentence_id": 42},
+    "challenge_known": {"type": "challenge", "sentence_id": 42}, # Binary repeat of a sentence the connection has had
+    "game_result": {"type": "game_result", "results": {"wpm": 74, "accuracy": 97.53,
+                                                       "errors": {"insertions": 1, "deletions": 0, "substitutions": 1}}},
+    "progress_update_2": progress_update(2),
+    "progress_update_20": progress_update(20),
+}
+
+def per_call_us(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - started) / repeat * 1e6, 3)
+
+def measure(name, message, repeat):
+    row = {"message": name}
+    for fmt, binary in (("json", False), ("binary", True)):
+        frame = encode_message(message, binary)
+        body = MessageDecoder().feed(frame)[0]
+        assert decode_frame(body)["type"] == message["type"]
+        row[f"{fmt}_bytes"] = len(frame)
+        row[f"{fmt}_encode_us"] = per_call_us(lambda: encode_message(message, binary), repeat)
+        row[f"{fmt}_decode_us"] = per_call_us(lambda: decode_frame(body), repeat)
+    return row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+    write_report({
+        "benchmark": "wire",
+        "environment": environment(),
+        "results": [measure(name, message, args.repeat) for name, message in MESSAGES.items()],
+    }, args.output)
+
+if __name__ == "__main__":
+    main()
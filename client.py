@@ -1,215 +1,535 @@
-# client.py 
-import socket
-import time
-import json
-import threading
-import sys
-
-# --- Configuration ---
-SERVER_HOST = 'localhost' # Change if server is on another machine
-SERVER_PORT = 65432
-BUFFER_SIZE = 1024
-
-# --- Global State ---
-client_socket = None
-stop_thread = threading.Event() # Signal to stop listener thread
-
-# --- Helper Functions ---
-def send_message(sock, message_type, payload={}):
-    """Sends a JSON message to the server."""
-    if stop_thread.is_set(): # Don't send if we are stopping
-        return
-    try:
-        message = json.dumps({"type": message_type, "payload": payload})
-        sock.sendall(message.encode('utf-8'))
-    except socket.error as e:
-        print(f"\n[Error] Connection error while sending: {e}")
-        stop_thread.set() # Signal stop on send error
-
-def perform_typing_test(sentence):
-    """Handles the typing input and timing. Returns typed text and time."""
-    print("\n" + "="*30)
-    print("Sentence to type:")
-    print(f"\"{sentence}\"")
-    print("="*30)
-    #  Start timing immediately after printing
-    print("Start typing now:")
-    start_time = time.time()
-
-    try:
-        typed_text = input("> ")
-    except EOFError: # Handle cases where input might be unexpectedly closed
-        print("\n[Error] Input stream closed unexpectedly.")
-        typed_text = "" # Assume no text typed if input fails
-
-    end_time = time.time()
-    time_taken = end_time - start_time
-
-    print(f"\nTime taken: {time_taken:.2f} seconds. Submitting...")
-    return typed_text, time_taken
-
-# --- Server Listener Thread ---
-def listen_to_server(sock):
-    """Listens for messages from the server."""
-    while not stop_thread.is_set():
-        try:
-            sock.settimeout(1.0) # Timeout to allow checking stop_thread
-            data = sock.recv(BUFFER_SIZE)
-            sock.settimeout(None)
-
-            if not data:
-                print("\n[Info] Server disconnected.")
-                stop_thread.set()
-                break
-
-            try:
-                message = json.loads(data.decode('utf-8'))
-                msg_type = message.get("type")
-
-                if msg_type == "challenge" or msg_type == "game_start":
-                    sentence = message.get("sentence")
-                    if sentence:
-                        typed_text, time_taken = perform_typing_test(sentence)
-                        # Send results back (include original sentence for server calc)
-                        send_message(sock, "submit_result", {"text": typed_text, "time": time_taken, "original": sentence})
-                    else:
-                        print("\n[Error] Received game start/challenge without sentence.")
-
-                elif msg_type == "game_result": # Single player result
-                    results = message.get("results")
-                    print("\n--- Single Player Results ---")
-                    print(f"WPM: {results.get('wpm', 'N/A')}")
-                    print(f"Accuracy: {results.get('accuracy', 'N/A')}%")
-                    print("-----------------------------")
-                    stop_thread.set() # End client after single player
-
-                elif msg_type == "room_created":
-                    room_id = message.get("room_id")
-                    print(f"\n[Info] Room created! ID: {room_id}. Waiting for opponent...")
-
-                elif msg_type == "game_over": # Multiplayer result
-                    results_data = message.get("results")
-                    winner = message.get("winner")
-                    print("\n--- Multiplayer Game Over ---")
-                    if results_data:
-                        for player_addr, res in results_data.items():
-                            print(f"Player {player_addr}: WPM={res.get('wpm', 'N/A')}, Acc={res.get('accuracy', 'N/A')}%")
-                    print("-----------------------------")
-                    print(f"Winner: {winner}")
-                    print("-----------------------------")
-                    stop_thread.set() # End client after multiplayer
-
-                elif msg_type == "opponent_left":
-                     print("\n[Info] Your opponent disconnected. Game over.")
-                     stop_thread.set() # End client
-
-                elif msg_type == "error":
-                    error_message = message.get("message")
-                    print(f"\n[ErrorFromServer] {error_message}")
-                    # Decide if client should stop? For join errors, maybe not.
-
-
-            except json.JSONDecodeError:
-                print(f"\n[Warning] Received non-JSON data: {data.decode('utf-8', errors='ignore')}")
-            except Exception as e:
-                 print(f"\n[Error] Error processing server message: {e}")
-
-        except socket.timeout:
-            continue # Normal timeout, check stop_thread and loop
-        except socket.error as e:
-            if not stop_thread.is_set():
-                 print(f"\n[Error] Connection error: {e}")
-            stop_thread.set() # Stop on socket error
-            break
-        except Exception as e:
-            print(f"\n[Error] Unexpected error in listener: {e}")
-            stop_thread.set()
-            break
-
-    print("[Info] Listener stopped.")
-    # Ensure socket is closed if thread stops unexpectedly
-    global client_socket
-    if client_socket:
-        try:
-            client_socket.close()
-        except socket.error:
-            pass
-
-
-# --- Main Client Logic ---
-def main():
-    global client_socket
-    try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        print(f"Connecting to {SERVER_HOST}:{SERVER_PORT}...")
-        client_socket.connect((SERVER_HOST, SERVER_PORT))
-        print("Connected!")
-
-        listener_thread = threading.Thread(target=listen_to_server, args=(client_socket,), daemon=True)
-        listener_thread.start()
-
-        # --- Mode Selection ---
-        mode_selected = False
-        while not stop_thread.is_set() and not mode_selected:
-            print("\nChoose mode:")
-            print("1. Single Player")
-            print("2. Multiplayer")
-            choice = input("Enter choice: ")
-
-            if choice == '1':
-                send_message(client_socket, "choose_mode", {"mode": "single"})
-                mode_selected = True # Wait for server challenge
-            elif choice == '2':
-                send_message(client_socket, "choose_mode", {"mode": "multiplayer"})
-                # --- Multiplayer Action ---
-                action_selected = False
-                while not stop_thread.is_set() and not action_selected:
-                    print("\nMultiplayer:")
-                    print("1. Create Room")
-                    print("2. Join Room")
-                    mp_choice = input("Enter choice: ")
-                    if mp_choice == '1':
-                        send_message(client_socket, "multiplayer_action", {"action": "create"})
-                        action_selected = True
-                        mode_selected = True # Now wait for opponent or game start
-                    elif mp_choice == '2':
-                        room_id = input("Enter Room ID: ")
-                        # Basic validation: check if it's not empty
-                        if room_id:
-                             send_message(client_socket, "multiplayer_action", {"action": "join", "room_id": room_id})
-                             action_selected = True
-                             mode_selected = True # Now wait for game start or error
-                        else:
-                             print("Invalid Room ID.")
-                    else:
-                         print("Invalid choice.")
-            else:
-                print("Invalid choice.")
-
-        # Keep main thread alive while listener is running
-        while not stop_thread.is_set():
-            try:
-                time.sleep(1) # Just wait
-            except KeyboardInterrupt:
-                 print("\n[Info] Ctrl+C detected. Closing...")
-                 stop_thread.set()
-                 break
-
-    except socket.error as e:
-        print(f"[Error] Cannot connect to server: {e}")
-    except Exception as e:
-        print(f"[Error] An unexpected error occurred: {e}")
-    finally:
-        stop_thread.set() # Signal listener to stop
-        if client_socket:
-            try:
-                client_socket.close()
-            except socket.error:
-                pass # Ignore errors during cleanup
-        print("Client finished.")
-        # Wait briefly for listener thread to potentially exit
-        time.sleep(0.5)
-
-
-if __name__ == "__main__":
-    main()
+# client.py
+"""Terminal client for the typing game.
+
+Everything runs on one thread around a selector. The server socket, the
+keyboard and the client's timers (pings, progress deltas) are all events,
+so nothing polls or sleeps. Menus read whole lines. While typing in a
+terminal, stdin is switched to cbreak mode and each keystroke is an event;
+the client streams keystrokes to the server as progress deltas.
+
+Timing is the server's: it stamps when it sends the challenge and when the
+submission arrives, and it subtracts the network round trip it measured by
+pinging this client. The client answers those pings. It also pings the
+server itself, to show the RTT while typing.
+"""
+import socket
+import time
+import json
+import threading
+import selectors
+import sys
+import os
+import shutil
+
+try:
+    import termios
+    import tty
+except ImportError: # Not available on Windows; typing falls back to whole lines without live progress
+    termios = tty = None
+
+from protocol import MessageDecoder, FrameTooLarge, MalformedFrame, WIRE_FORMATS, encode_message, decode_frame, fill_sentence
+from rtt import RttEstimator
+
+# --- Configuration ---
+SERVER_HOST = 'localhost' # Change if server is on another machine
+SERVER_PORT = 65432
+BUFFER_SIZE = 1024
+PROGRESS_SEND_INTERVAL = 0.1 # Seconds between keystroke deltas sent while typing
+PING_INTERVAL = 2.0 # Seconds between the client's own RTT pings
+BACKSPACE_KEYS = ("\x7f", "\b")
+
+# --- Helper Functions ---
+def format_race(message):
+    """One-line summary of a progress_update: percent done and WPM per player."""
+    parts = []
+    for stats in message.get("players", {}).values():
+        percent = int(stats["position"] / stats["length"] * 100) if stats.get("length") else 0
+        parts.append(f"{'done' if stats.get('done') else str(percent) + '%'} {stats.get('wpm', 0)}wpm")
+    return "Race: " + " | ".join(parts) if parts else ""
+
+def prompt(text):
+    """Shows a prompt without a newline; the answer arrives later as a stdin event."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+class TypingTest:
+    """One attempt at a sentence.
+
+    In a terminal, keystrokes arrive one at a time and go to the server as
+    progress deltas every PROGRESS_SEND_INTERVAL. Otherwise the next line
+    read is the whole attempt.
+    """
+
+    def __init__(self, client, sentence, sentence_id, streaming):
+        self.client = client
+        self.sentence = sentence
+        self.sentence_id = sentence_id
+        self.streaming = streaming
+        self.typed, self.pending_add, self.pending_del = [], [], 0
+        self.race = ""
+        self.started = time.monotonic() # Only for the local display; the server's clock decides
+        self.last_sent = self.started
+
+    def keys(self, text):
+        for ch in text:
+            if ch in ("\r", "\n"):
+                self.submit()
+                return
+            if ch in BACKSPACE_KEYS:
+                if self.typed:
+                    self.typed.pop()
+                    if self.pending_add:
+                        self.pending_add.pop()
+                    else:
+                        self.pending_del += 1
+            elif ch.isprintable():
+                self.typed.append(ch)
+                self.pending_add.append(ch)
+        self.render()
+
+    def line(self, text):
+        self.typed = list(text)
+        self.submit()
+
+    def flush_due(self):
+        """When the pending delta should be sent, or None if there is nothing to send."""
+        if self.pending_add or self.pending_del:
+            return self.last_sent + PROGRESS_SEND_INTERVAL
+        return None
+
+    def flush(self):
+        if self.pending_add or self.pending_del:
+            self.client.send("progress", {"del": self.pending_del, "add": "".join(self.pending_add)})
+            self.pending_add, self.pending_del = [], 0
+            self.last_sent = time.monotonic()
+
+    def render(self):
+        """Redraws the input line, keeping the end of the typed text in view."""
+        if not self.streaming:
+            return
+        status = " | ".join(part for part in (self.race, self.client.rtt_text()) if part)
+        prefix = f"[{status}] > " if status else "> "
+        room = max(10, shutil.get_terminal_size().columns - len(prefix) - 1)
+        sys.stdout.write("\r\033[K" + prefix + "".join(self.typed)[-room:])
+        sys.stdout.flush()
+
+    def submit(self):
+        self.flush()
+        self.client.end_typing()
+        time_taken = time.monotonic() - self.started
+        print(f"\n\nTime taken: {time_taken:.2f} seconds. Submitting...")
+        submission = {"text": "".join(self.typed)} # The server times the attempt itself
+        if self.client.binary and self.sentence_id is not None:
+            submission["sentence_id"] = self.sentence_id # The server knows the sentence by ID
+        else:
+            submission["original"] = self.sentence
+        self.client.send("submit_result", submission)
+
+class Client:
+    """The event loop, plus the menu and game state of one connection."""
+
+    def __init__(self, sock):
+        self.sock = sock # Stays blocking: it is only read after the selector reports data
+        self.selector = selectors.DefaultSelector()
+        self.decoder = MessageDecoder()
+        self.running = True
+        self.binary = False # Set once the server accepts binary frames in the hello handshake
+        self.sentences = {}  # Sentence ID -> text, for binary frames that leave it out
+        self.name = ""
+        self.on_line = None  # Handler for the next line typed at a menu
+        self.retry = None    # Menu to show again if the server refuses the last request
+        self.typing = None   # TypingTest while a sentence is being typed
+        self.tty_mode = None # Saved terminal attributes while stdin is in cbreak mode
+        self.line_buffer = ""
+        self.awaiting = 0    # Leaderboard replies still to come before the main menu returns
+        self.rtt = RttEstimator()
+        self.ping_id = 0
+        self.ping_sent = None # (id, send time) of the outstanding ping
+        self.next_ping = time.monotonic()
+        self.selector.register(sock, selectors.EVENT_READ, self.on_socket)
+        self.stdin = self._register_stdin()
+
+    def _register_stdin(self):
+        """Watches stdin directly where the selector can, or through a thread and a socket pair."""
+        try:
+            fd = sys.stdin.fileno()
+            self.selector.register(fd, selectors.EVENT_READ, self.on_stdin)
+            return fd
+        except (ValueError, OSError): # Windows selectors only take sockets
+            reader, writer = socket.socketpair()
+            def pump():
+                for line in sys.stdin:
+                    writer.sendall(line.encode('utf-8'))
+                writer.close()
+            threading.Thread(target=pump, daemon=True).start()
+            self.selector.register(reader, selectors.EVENT_READ, self.on_stdin)
+            return reader
+
+    def send(self, message_type, payload={}):
+        """Sends a message to the server in the agreed wire format."""
+        if not self.running: # Don't send if we are stopping
+            return
+        try:
+            self.sock.sendall(encode_message({"type": message_type, "payload": payload}, self.binary))
+        except socket.error as e:
+            print(f"\n[Error] Connection error while sending: {e}")
+            self.stop()
+
+    def rtt_text(self):
+        return f"rtt {self.rtt.srtt * 1000:.0f}ms" if self.rtt.srtt is not None else ""
+
+    # --- Event Loop ---
+    def run(self):
+        self.send("hello", {"formats": list(WIRE_FORMATS), "ping": True})
+        prompt("Your name for the leaderboard (Enter to skip): ")
+        self.on_line = self.got_name
+        while self.running:
+            for key, _ in self.selector.select(self.next_timeout()):
+                key.data()
+                if not self.running:
+                    break
+            self.on_timers()
+
+    def next_timeout(self):
+        """Seconds until the next timer is due; the selector sleeps at most this long."""
+        due = self.next_ping
+        if self.typing is not None and self.typing.flush_due() is not None:
+            due = min(due, self.typing.flush_due())
+        return max(0.0, due - time.monotonic())
+
+    def on_timers(self):
+        now = time.monotonic()
+        if now >= self.next_ping:
+            self.ping_id += 1
+            self.ping_sent = (self.ping_id, now) # An unanswered ping is simply replaced
+            self.send("ping", {"id": self.ping_id})
+            self.next_ping = now + PING_INTERVAL
+        if self.typing is not None and self.typing.flush_due() is not None and now >= self.typing.flush_due():
+            self.typing.flush()
+
+    def on_socket(self):
+        try:
+            data = self.sock.recv(BUFFER_SIZE)
+        except socket.error as e:
+            print(f"\n[Error] Connection error: {e}")
+            self.stop()
+            return
+        if not data:
+            print("\n[Info] Server disconnected.")
+            self.stop()
+            return
+        try:
+            frames = self.decoder.feed(data)
+        except FrameTooLarge as e:
+            print(f"\n[Error] {e}")
+            self.stop()
+            return
+        for frame in frames:
+            try:
+                self.handle_server_message(fill_sentence(decode_frame(frame), self.sentences))
+            except (json.JSONDecodeError, UnicodeDecodeError, MalformedFrame):
+                print(f"\n[Warning] Received an unreadable message: {frame[:80]!r}")
+            if not self.running:
+                return
+
+    def on_stdin(self):
+        if isinstance(self.stdin, socket.socket):
+            data = self.stdin.recv(BUFFER_SIZE)
+        else:
+            data = os.read(self.stdin, BUFFER_SIZE)
+        if not data: # Input closed
+            if self.typing is not None:
+                self.typing.submit() # Send what was typed so far
+            else:
+                self.stop()
+            return
+        text = data.decode('utf-8', errors='ignore')
+        if self.typing is not None and self.typing.streaming:
+            self.typing.keys(text)
+            return
+        self.line_buffer += text
+        while "\n" in self.line_buffer and self.running:
+            line, self.line_buffer = self.line_buffer.split("\n", 1)
+            line = line.rstrip("\r")
+            if self.typing is not None:
+                self.typing.line(line)
+            elif self.on_line is not None:
+                handler, self.on_line = self.on_line, None
+                handler(line)
+
+    def start_typing(self, sentence, sentence_id):
+        print("\n" + "="*30)
+        print("Sentence to type:")
+        print(f"\"{sentence}\"")
+        print("="*30)
+        print("Start typing now:")
+        self.on_line = None
+        self.line_buffer = ""
+        streaming = termios is not None and sys.stdin.isatty()
+        if streaming:
+            fd = sys.stdin.fileno()
+            self.tty_mode = termios.tcgetattr(fd)
+            tty.setcbreak(fd) # No line buffering or echo; the typing line is drawn by hand
+        else:
+            prompt("> ")
+        self.typing = TypingTest(self, sentence, sentence_id, streaming)
+        self.typing.render()
+
+    def end_typing(self):
+        """Stops the attempt and puts the terminal back in line mode."""
+        self.typing = None
+        if self.tty_mode is not None:
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, self.tty_mode)
+            self.tty_mode = None
+
+    def stop(self):
+        self.running = False
+        self.end_typing()
+
+    # --- Menus ---
+    def got_name(self, line):
+        self.name = line.strip()
+        self.show_main_menu()
+
+    def show_main_menu(self):
+        print("\nChoose mode:")
+        print("1. Single Player")
+        print("2. Multiplayer")
+        print("3. Leaderboard")
+        prompt("Enter choice: ")
+        self.on_line = self.main_choice
+
+    def main_choice(self, choice):
+        if choice == '1':
+            self.send("choose_mode", {"mode": "single", "name": self.name})
+            self.retry = self.show_main_menu # Wait for the server's challenge
+        elif choice == '2':
+            self.send("choose_mode", {"mode": "multiplayer", "name": self.name})
+            self.show_multiplayer_menu()
+        elif choice == '3':
+            self.send("leaderboard", {"limit": 10})
+            self.awaiting = 1
+            if self.name:
+                self.send("rank", {"player": self.name})
+                self.awaiting += 1
+        else:
+            print("Invalid choice.")
+            self.show_main_menu()
+
+    def show_multiplayer_menu(self):
+        print("\nMultiplayer:")
+        print("1. Create Room")
+        print("2. Join Room")
+        print("3. Quick Match")
+        prompt("Enter choice: ")
+        self.on_line = self.multiplayer_choice
+
+    def multiplayer_choice(self, choice):
+        if choice == '1':
+            prompt("Number of players (2): ")
+            self.on_line = self.create_room
+        elif choice == '2':
+            prompt("Enter Room ID: ")
+            self.on_line = self.join_room
+        elif choice == '3':
+            prompt("Number of players (2): ")
+            self.on_line = self.quick_match
+        else:
+            print("Invalid choice.")
+            self.show_multiplayer_menu()
+
+    def read_size(self, line):
+        """A group size from the prompt (Enter means 2), or None after sending the player back to the menu."""
+        size = line.strip() or "2"
+        if not size.isdigit():
+            print("Invalid number.")
+            self.show_multiplayer_menu()
+            return None
+        return int(size)
+
+    def create_room(self, line):
+        size = self.read_size(line)
+        if size is not None:
+            self.send("multiplayer_action", {"action": "create", "size": size})
+            self.retry = self.show_multiplayer_menu # Wait for an opponent or game start
+
+    def start_early(self, line):
+        self.send("multiplayer_action", {"action": "start"})
+        self.retry = self.wait_to_start # Not enough players yet; Enter can be pressed again
+
+    def wait_to_start(self):
+        self.on_line = self.start_early
+
+    def join_room(self, line):
+        room_id = line.strip()
+        if room_id:
+            self.send("multiplayer_action", {"action": "join", "room_id": room_id})
+            self.retry = self.show_multiplayer_menu # Wait for game start or error
+        else:
+            print("Invalid Room ID.")
+            self.show_multiplayer_menu()
+
+    def quick_match(self, line):
+        size = self.read_size(line)
+        if size is not None:
+            self.send("multiplayer_action", {"action": "quick_match", "size": size})
+            self.retry = self.show_multiplayer_menu # Wait in the queue for a match
+
+    def leaderboard_reply(self):
+        self.awaiting -= 1
+        if self.awaiting == 0:
+            self.show_main_menu()
+
+    # --- Server Messages ---
+    def handle_server_message(self, message):
+        """Reacts to one decoded message from the server."""
+        msg_type = message.get("type")
+
+        if msg_type == "ping":
+            self.send("pong", {"id": message.get("id")}) # Answered at once: the server times our games with these
+
+        elif msg_type == "pong":
+            if self.ping_sent is not None and message.get("id") == self.ping_sent[0]:
+                self.rtt.update(time.monotonic() - self.ping_sent[1])
+                self.ping_sent = None
+
+        elif msg_type == "hello":
+            self.binary = message.get("format") == "binary1"
+
+        elif msg_type == "progress_update":
+            if self.typing is not None:
+                self.typing.race = format_race(message)
+                self.typing.render()
+
+        elif self.typing is not None and msg_type not in ("game_over", "opponent_left"):
+            print() # Show it above the typing line, then carry on typing
+            self.show(message)
+            self.typing.render()
+
+        else:
+            self.end_typing() # A game_over mid-attempt means the round's deadline passed
+            self.show(message)
+
+    def show(self, message):
+        msg_type = message.get("type")
+        if msg_type != "error":
+            self.retry = None # Whatever we asked for went through
+
+        if msg_type == "challenge" or msg_type == "game_start":
+            sentence = message.get("sentence")
+            if sentence:
+                self.start_typing(sentence, message.get("sentence_id"))
+            else:
+                print("\n[Error] Received game start/challenge without sentence.")
+
+        elif msg_type == "game_result": # Single player result
+            results = message.get("results")
+            print("\n--- Single Player Results ---")
+            print(f"WPM: {results.get('wpm', 'N/A')}")
+            print(f"Accuracy: {results.get('accuracy', 'N/A')}%")
+            errors = results.get("errors")
+            if errors:
+                print(f"Errors: {errors.get('substitutions', 0)} wrong, {errors.get('deletions', 0)} missed, "
+                      f"{errors.get('insertions', 0)} extra")
+            print("-----------------------------")
+            self.stop() # End client after single player
+
+        elif msg_type == "room_created":
+            room_id = message.get("room_id")
+            print(f"\n[Info] Room created! ID: {room_id}. Waiting for {message.get('size', 2) - 1} more player(s)...")
+            if message.get("size", 2) > 2:
+                print("[Info] Press Enter to start early once someone has joined.")
+                self.on_line = self.start_early
+
+        elif msg_type == "room_update":
+            print(f"\n[Info] Room {message.get('room_id')}: {message.get('players')}/{message.get('size')} players.")
+
+        elif msg_type == "queued":
+            print(f"\n[Info] Looking for {message.get('size', 2) - 1} opponent(s) near rating {message.get('rating')}...")
+
+        elif msg_type == "match_found":
+            print(f"\n[Info] Match found in room {message.get('room_id')}: {', '.join(message.get('players', []))}")
+
+        elif msg_type == "player_left":
+            print(f"\n[Info] {message.get('player')} left. {message.get('players')} player(s) remain.")
+
+        elif msg_type == "game_over": # Multiplayer result
+            results_data = message.get("results")
+            winner = message.get("winner")
+            print("\n--- Multiplayer Game Over ---")
+            ranking = message.get("ranking")
+            if ranking:
+                for entry in ranking:
+                    print(f"#{entry['rank']} Player {entry['player']}: WPM={entry['wpm']}, Acc={entry['accuracy']}%")
+            elif results_data:
+                for player_addr, res in results_data.items():
+                    print(f"Player {player_addr}: WPM={res.get('wpm', 'N/A')}, Acc={res.get('accuracy', 'N/A')}%")
+            if message.get("ratings"):
+                print("Ratings: " + ", ".join(f"{player} {rating}" for player, rating in message["ratings"].items()))
+            if message.get("timed_out"):
+                print(f"Out of time: {', '.join(message['timed_out'])}")
+            print("-----------------------------")
+            print(f"Winner: {winner}")
+            print("-----------------------------")
+            self.stop() # End client after multiplayer
+
+        elif msg_type == "room_expired":
+            print(f"\n[Info] Room {message.get('room_id')} expired before the game started.")
+            self.show_multiplayer_menu() # The server put us back in the multiplayer menu
+
+        elif msg_type == "opponent_left":
+            print("\n[Info] Your opponent disconnected. Game over.")
+            self.stop() # End client
+
+        elif msg_type == "leaderboard":
+            print(f"\n--- Leaderboard ({message.get('players', 0)} players) ---")
+            for entry in message.get("top", []):
+                print(f"#{entry['rank']} {entry['player']}: WPM={entry['wpm']}, Acc={entry['accuracy']}%")
+            print("-----------------------------")
+            self.leaderboard_reply()
+
+        elif msg_type == "rank":
+            if message.get("rank") is None:
+                print(f"\n[Info] {message.get('player')} has no ranked results yet.")
+            else:
+                print(f"\n[Info] {message.get('player')} is #{message['rank']} of {message.get('players')} "
+                      f"(best WPM={message.get('wpm')}, Acc={message.get('accuracy')}%)")
+            self.leaderboard_reply()
+
+        elif msg_type == "error":
+            print(f"\n[ErrorFromServer] {message.get('message')}")
+            retry, self.retry = self.retry, None
+            if retry is not None:
+                retry()
+
+# --- Main Client Logic ---
+def main():
+    client_socket = None
+    client = None
+    try:
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        print(f"Connecting to {SERVER_HOST}:{SERVER_PORT}...")
+        client_socket.connect((SERVER_HOST, SERVER_PORT))
+        print("Connected!")
+        client = Client(client_socket)
+        client.run()
+
+    except KeyboardInterrupt:
+        print("\n[Info] Ctrl+C detected. Closing...")
+    except socket.error as e:
+        print(f"[Error] Cannot connect to server: {e}")
+    except Exception as e:
+        print(f"[Error] An unexpected error occurred: {e}")
+    finally:
+        if client is not None:
+            client.stop() # Restores the terminal if we were typing
+        if client_socket:
+            try:
+                client_socket.close()
+            except socket.error:
+                pass # Ignore errors during cleanup
+        print("Client finished.")
+
+
+if __name__ == "__main__":
+    main()
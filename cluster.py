@@ -0,0 +1,647 @@
+# cluster.py
+"""Multi-process server mode.
+
+N worker processes listen on the same port with SO_REUSEPORT and the kernel
+spreads incoming connections across them. Each worker handles its own
+clients end to end, games included, and hosts the rooms whose IDs fall in its
+slice of the ID space, so the worker that hosts a room follows from its ID.
+
+A player who joins a room on another worker is relayed there: their worker
+passes the session's frames on, undecoded, over a Unix socket to the host,
+which runs the session against a stand-in connection whose sendall() sends
+bytes back through the player's worker. After the game the host hands the
+session back along with the first frame it gets from the multiplayer menu.
+Frames that crossed the hand-back bounce, and the player's worker holds new
+ones until the host confirms none are left, so nothing is reordered.
+
+Quick matches need one queue, so workers queue their players with a broker
+process. It runs the normal matchmaker and, when a group forms, tells each
+player's worker which worker hosts the game; the others relay their players
+there. The broker also owns the leaderboard, which workers send results and
+queries to, and passes each game's new Elo ratings on to every worker. It
+never sees game traffic.
+
+Link frames are a fixed header (op, connection ID, payload length) followed by
+the payload, so relayed frames are never re-encoded along the way.
+"""
+import asyncio
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import struct
+import tempfile
+import time
+
+import server
+import serverlog
+from rooms import RoomRegistry
+from serverlog import log
+from session import State
+
+# --- Link Protocol ---
+LINK_HEADER = struct.Struct("!BII") # op, conn_id, payload length
+OP_OPEN = 1     # worker -> host: a session moves in; JSON (see Worker.relay), a newline, then the frame that sent it
+OP_DATA = 2     # worker -> host: one client frame; host or broker -> worker: bytes to write to the client
+OP_CLOSE = 3    # either way: the session is over; a host echoes it for a session it handed back
+OP_RESULT = 4   # worker -> broker: a result for the leaderboard (JSON, conn_id 0)
+OP_QUERY = 5    # worker -> broker: a leaderboard or rank query, answered with OP_DATA
+OP_RETURN = 6   # host -> worker: the session is back in the menu; JSON, a newline, then the frame that ended it
+OP_BOUNCE = 7   # host -> worker: a frame that arrived after OP_RETURN, for the worker to handle
+OP_HELLO = 8    # worker -> broker, first frame: conn_id is the worker's index
+OP_QUEUE = 9    # worker -> broker: a quick match ticket, JSON {"addr", "size", "options", "rating", "queued_at"}
+OP_MATCHED = 10 # broker -> worker: a queued player's group formed, JSON {"match", "host", "size", "options", "ticket"}
+OP_RATINGS = 11 # worker -> broker -> other workers: {name: rating} after a game (conn_id 0)
+BROKER_START_TIMEOUT = 10.0
+SHUTDOWN_TIMEOUT = 5.0 # Seconds each process gets to clean up before it is killed
+
+def pack_link_frame(op, conn_id, payload=b""):
+    return LINK_HEADER.pack(op, conn_id, len(payload)) + payload
+
+async def read_link_frame(reader):
+    """Returns (op, conn_id, payload). Raises asyncio.IncompleteReadError when the link closes."""
+    op, conn_id, length = LINK_HEADER.unpack(await reader.readexactly(LINK_HEADER.size))
+    payload = await reader.readexactly(length) if length else b""
+    return op, conn_id, payload
+
+def room_id_slices(low, high, count):
+    """Splits the room IDs [low, high] into count contiguous (low, high) slices, one per worker."""
+    width = (high - low + 1) // count
+    if width < 1:
+        raise ValueError(f"{count} workers need at least {count} room IDs; raise --room-id-digits.")
+    return [(low + i * width, high if i == count - 1 else low + (i + 1) * width - 1) for i in range(count)]
+
+def peer_path(broker_path, index):
+    """The Unix socket worker index listens on for sessions relayed by the other workers."""
+    return f"{broker_path}.{index}"
+
+def drop_session(session):
+    """Forgets a stand-in whose session goes on elsewhere. Unlike cleanup_client, the client stays connected."""
+    for timer in (session.idle_timer, session.ping_timer, session.match_timer):
+        if timer is not None:
+            timer.cancel()
+    server.clients.remove(session.id)
+
+class RelayedConnection:
+    """Stand-in for a client socket that lives in another process; link is the way back to it."""
+
+    __slots__ = ("link", "conn_id", "addr", "closed", "session")
+
+    def __init__(self, link, conn_id, addr):
+        self.link = link
+        self.conn_id = conn_id # The client's worker's session ID, which names it on the link
+        self.addr = addr
+        self.closed = False
+        self.session = None
+
+    def sendall(self, data):
+        if not self.closed:
+            self.link.writer.write(pack_link_frame(OP_DATA, self.conn_id, data))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.link.writer.write(pack_link_frame(OP_CLOSE, self.conn_id))
+
+# --- Worker Side ---
+class Worker:
+    """A worker's links to the broker and to the other workers. Installed as server.room_broker.
+
+    The worker's session IDs double as link connection IDs.
+    """
+
+    def __init__(self, index, room_ids, broker_writer):
+        self.index = index
+        self.room_ids = room_ids   # [(low, high)] room IDs hosted by each worker
+        self.broker = broker_writer
+        self.peers = {}            # {worker index: writer} to the other workers, as hosts
+        self._conns = {}           # {session ID: conn} expecting output from the broker or a host
+        self._hosts = {}           # {session ID: index of the worker hosting it} while relayed
+        self._held = {}            # {session ID: (host, frames)} while frames that crossed an OP_RETURN come back
+        self._matches = {}         # {match ID: [(session or None, ticket)]} arriving for games hosted here
+
+    # --- Routing ---
+    def host_of(self, room_id):
+        """The index of the worker hosting room_id if that is another worker, else None."""
+        try:
+            number = int(room_id)
+        except (TypeError, ValueError):
+            return None
+        for index, (low, high) in enumerate(self.room_ids):
+            if low <= number <= high:
+                return index if index != self.index else None
+        return None
+
+    def relay(self, conn, host, frame=b"", **extra):
+        """Moves a session to the worker hosting its game; frame is the message that takes it there."""
+        session = conn.session
+        for timer in (session.idle_timer, session.ping_timer):
+            if timer is not None:
+                timer.cancel() # The host times the session out and pings it while it is there
+        info = {"addr": str(session.addr), "name": session.name, "binary": session.binary,
+                "sentences": sorted(session.sentences_sent or ()), "rating": server.player_rating(session),
+                "last_seen": session.last_seen,
+                "rtt": session.rtt.min_rtt if session.rtt is not None else False, # False: the client doesn't answer pings
+                "ping_id": session.ping_id, **extra}
+        session.state = State.RELAYED
+        self._conns[session.id] = conn
+        self._hosts[session.id] = host
+        self.peers[host].write(pack_link_frame(OP_OPEN, session.id, json.dumps(info).encode('utf-8') + b"\n" + frame))
+
+    def route(self, conn, frame):
+        """Takes a client frame that isn't this worker's to handle: relays it to the session's host,
+        or holds it while a hand-back completes. Returns False if the worker should handle it."""
+        session_id = conn.session.id
+        held = self._held.get(session_id)
+        if held is not None:
+            held[1].append(frame)
+            return True
+        host = self._hosts.get(session_id)
+        if host is None:
+            return False
+        self.peers[host].write(pack_link_frame(OP_DATA, session_id, frame))
+        return True
+
+    def dispatch(self, conn, frame):
+        """Handles a frame that came back from a host as if it had just arrived from the client."""
+        if not self.route(conn, frame) and not server.process_frame(conn, conn.session.addr, frame):
+            conn.close()
+
+    def come_home(self, conn, host, payload):
+        """Takes back a session its host has finished with (OP_RETURN)."""
+        info, _, frame = payload.partition(b"\n")
+        info = json.loads(info)
+        session = conn.session
+        del self._hosts[session.id]
+        # The frame waits, with any that bounce and any the client sends meanwhile, until the host answers this
+        self._held[session.id] = (host, [frame] if frame else [])
+        self.peers[host].write(pack_link_frame(OP_CLOSE, session.id))
+        session.state = State.MULTIPLAYER_MENU
+        session.rating = info["rating"]
+        session.binary = info["binary"]
+        session.sentences_sent = set(info["sentences"]) or None
+        session.last_seen = info["last_seen"] # Monotonic time is shared by every process on the machine
+        session.ping_id = info["ping_id"]
+        session.ping_sent = None
+        if session.rtt is not None:
+            server.send_ping(session.id)
+        elif info["rtt"] is not False:
+            server.start_pinging(session, info["rtt"])
+        if server.IDLE_TIMEOUT > 0:
+            server.check_idle(session.id)
+        if "requeue" in info:
+            self.queue(session, *info["requeue"])
+
+    def deliver(self, conn, data):
+        conn.sendall(data)
+        if server.recorder is not None:
+            server.recorder.outbound(conn.session.id, data) # Relayed output skips server.send_bytes
+
+    async def drain(self):
+        """Waits while any link is over its high-water mark, so a backed-up link slows the clients feeding it."""
+        await self.broker.drain()
+        for writer in self.peers.values():
+            await writer.drain()
+
+    def close(self, conn):
+        session = conn.session
+        self._conns.pop(session.id, None)
+        self._held.pop(session.id, None)
+        host = self._hosts.pop(session.id, None)
+        if host is not None:
+            self.peers[host].write(pack_link_frame(OP_CLOSE, session.id))
+        if session.state is State.MATCHMAKING:
+            self.unqueue(session)
+
+    def forget(self, session):
+        """Drops a stand-in whose session has gone back to its own worker."""
+        self._conns.pop(session.id, None)
+        drop_session(session)
+
+    # --- Broker ---
+    def record(self, player, sentence_id, wpm, accuracy):
+        entry = {"player": player, "sentence": sentence_id, "wpm": wpm, "accuracy": accuracy}
+        self.broker.write(pack_link_frame(OP_RESULT, 0, json.dumps(entry).encode('utf-8')))
+
+    def query(self, conn, message):
+        message = dict(message, payload=dict(message.get("payload", {})))
+        message["payload"].setdefault("player", conn.session.name) # The broker doesn't know who is asking
+        self._conns[conn.session.id] = conn
+        self.broker.write(pack_link_frame(OP_QUERY, conn.session.id, json.dumps(message).encode('utf-8')))
+
+    def share_ratings(self, ratings):
+        self.broker.write(pack_link_frame(OP_RATINGS, 0, json.dumps(ratings).encode('utf-8')))
+
+    def queue(self, session, size, options, queued_at=None):
+        """Queues a player with the broker's matchmaker; queued_at keeps their place when they go back in line."""
+        session.state = State.MATCHMAKING
+        session.match_options = options
+        ticket = {"addr": str(session.addr), "size": size, "options": options,
+                  "rating": server.player_rating(session), "queued_at": queued_at}
+        self.broker.write(pack_link_frame(OP_QUEUE, session.id, json.dumps(ticket).encode('utf-8')))
+
+    def unqueue(self, session):
+        self.broker.write(pack_link_frame(OP_CLOSE, session.id))
+
+    def matched(self, session_id, match):
+        """Sends a queued player to the worker the broker picked to host their game (OP_MATCHED)."""
+        session = server.clients.get(session_id)
+        host = match["host"]
+        if session is None or session.state is not State.MATCHMAKING:
+            # Gone or cancelled; the host still counts the answer
+            if host == self.index:
+                self.arrive(match["match"], match["size"], match["options"], None, None)
+            else:
+                declined = dict(match, declined=True)
+                self.peers[host].write(pack_link_frame(OP_OPEN, session_id, json.dumps(declined).encode('utf-8') + b"\n"))
+        elif host == self.index:
+            self.arrive(match["match"], match["size"], match["options"], session, match["ticket"])
+        else:
+            self.relay(session.conn, host, match=match["match"], size=match["size"], options=match["options"],
+                       ticket=match["ticket"])
+
+    def arrive(self, match_id, size, options, session, ticket):
+        """Collects the players of a quick match hosted here and starts it once every one has answered."""
+        arrivals = self._matches.setdefault(match_id, [])
+        arrivals.append((session, ticket))
+        if len(arrivals) < size:
+            return
+        del self._matches[match_id]
+        live = [(session, ticket) for session, ticket in arrivals
+                if session is not None and server.clients.get(session.id) is session and session.state is State.MATCHMAKING]
+        if len(live) >= server.MIN_PLAYERS:
+            server.open_match([session for session, _ in live], options)
+            return
+        for session, ticket in live: # Back in line, keeping their place
+            requeue = [ticket["size"], options, ticket["queued_at"]]
+            if isinstance(session.conn, RelayedConnection):
+                session.conn.link.hand_back(session.conn, requeue=requeue)
+            else:
+                self.queue(session, *requeue)
+
+    # --- Link Readers ---
+    async def run_broker_link(self, reader):
+        """Handles what the broker sends until it goes away."""
+        while True:
+            op, conn_id, payload = await read_link_frame(reader)
+            if op == OP_MATCHED:
+                self.matched(conn_id, json.loads(payload))
+            elif op == OP_RATINGS:
+                for name, rating in json.loads(payload).items():
+                    server.ratings.set(name, rating)
+            elif op == OP_DATA:
+                conn = self._conns.get(conn_id)
+                if conn is not None:
+                    self.deliver(conn, payload)
+
+    async def run_peer_link(self, host, reader):
+        """Handles what a host sends back for the sessions relayed to it until it goes away."""
+        while True:
+            op, conn_id, payload = await read_link_frame(reader)
+            conn = self._conns.get(conn_id)
+            if conn is None:
+                continue # Client already gone
+            if op == OP_DATA:
+                self.deliver(conn, payload)
+            elif op == OP_RETURN:
+                self.come_home(conn, host, payload)
+            elif op == OP_BOUNCE:
+                self.dispatch(conn, payload)
+            elif op == OP_CLOSE:
+                held = self._held.get(conn_id)
+                if held is not None and held[0] == host:
+                    del self._held[conn_id] # Everything that crossed the OP_RETURN is back
+                    for frame in held[1]:
+                        self.dispatch(conn, frame)
+                elif self._hosts.get(conn_id) == host:
+                    conn.close()
+
+class PeerLink:
+    """The host's end of another worker's link: runs the sessions that worker relays here."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.conns = {}       # {conn_id: RelayedConnection}
+        self.returned = set() # conn_ids handed back, until the worker's OP_CLOSE says nothing more is coming
+
+    def open(self, conn_id, payload):
+        info, _, frame = payload.partition(b"\n")
+        info = json.loads(info)
+        worker = server.room_broker
+        if info.get("declined"):
+            worker.arrive(info["match"], info["size"], info["options"], None, None)
+            return
+        conn = RelayedConnection(self, conn_id, info["addr"])
+        self.conns[conn_id] = conn
+        session = server.register_client(conn, conn.addr, relayed=True)
+        session.name = info["name"]
+        session.binary = info["binary"] # Wire format agreed with the worker
+        session.sentences_sent = set(info["sentences"]) or None # So the client isn't sent texts it has
+        session.rating = info["rating"]
+        session.last_seen = info["last_seen"]
+        if info["rtt"] is not False:
+            session.ping_id = info["ping_id"] # Don't reuse an ID the worker has in flight
+            server.start_pinging(session, info["rtt"])
+        if "match" in info:
+            session.state = State.MATCHMAKING
+            session.match_options = info["options"]
+            worker.arrive(info["match"], info["size"], info["options"], session, info["ticket"])
+        else:
+            session.state = State.MULTIPLAYER_MENU
+            if not server.process_frame(conn, conn.addr, frame):
+                self.close(conn_id)
+
+    def data(self, conn_id, frame):
+        conn = self.conns.get(conn_id)
+        if conn is None:
+            if conn_id in self.returned:
+                self.writer.write(pack_link_frame(OP_BOUNCE, conn_id, frame))
+        elif conn.session.state is State.MULTIPLAYER_MENU:
+            self.hand_back(conn, frame) # Between games a session belongs to its own worker
+        elif not server.process_frame(conn, conn.addr, frame):
+            self.close(conn_id)
+
+    def hand_back(self, conn, frame=b"", **extra):
+        """Returns a session to its worker with the frame it should handle next."""
+        session = conn.session
+        info = {"rating": session.rating, "binary": session.binary,
+                "sentences": sorted(session.sentences_sent or ()), "last_seen": session.last_seen,
+                "rtt": session.rtt.min_rtt if session.rtt is not None else False,
+                "ping_id": session.ping_id, **extra}
+        del self.conns[conn.conn_id]
+        self.returned.add(conn.conn_id)
+        conn.closed = True # Nothing more goes out for it from here
+        server.room_broker.forget(session)
+        self.writer.write(pack_link_frame(OP_RETURN, conn.conn_id, json.dumps(info).encode('utf-8') + b"\n" + frame))
+
+    def close(self, conn_id):
+        if conn_id in self.returned:
+            self.returned.discard(conn_id)
+            self.writer.write(pack_link_frame(OP_CLOSE, conn_id)) # Confirms the hand-back
+            return
+        conn = self.conns.pop(conn_id, None)
+        if conn is not None:
+            conn.closed = True # The worker closes the socket
+            server.cleanup_client(conn)
+
+async def handle_peer_link(reader, writer):
+    """Runs the sessions another worker relays to this one."""
+    link = PeerLink(writer)
+    try:
+        while True:
+            op, conn_id, payload = await read_link_frame(reader)
+            if op == OP_OPEN:
+                link.open(conn_id, payload)
+            elif op == OP_DATA:
+                link.data(conn_id, payload)
+            elif op == OP_CLOSE:
+                link.close(conn_id)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        log("WARN", "A worker disconnected from worker %s.", server.room_broker.index)
+    except asyncio.CancelledError:
+        pass # Shutting down; on Python 3.11 re-raising makes asyncio's stream callback log a traceback
+    finally:
+        link.returned.clear()
+        for conn_id in list(link.conns):
+            link.close(conn_id)
+        writer.close()
+
+def listen_reuseport(host, port):
+    """Binds a listening socket that other workers can bind to as well."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(server.LISTEN_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+def listen_unix(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(path):
+        os.unlink(path)
+    sock.bind(path)
+    sock.listen(server.LISTEN_BACKLOG)
+    return sock
+
+async def serve_worker(index, room_ids, broker_path, peer_socks):
+    interrupt_on_sigterm()
+    broker_reader, broker_writer = await asyncio.open_unix_connection(broker_path)
+    broker_writer.write(pack_link_frame(OP_HELLO, index))
+    worker = Worker(index, room_ids, broker_writer)
+    server.room_broker = worker
+    hosting = await asyncio.start_unix_server(handle_peer_link, sock=peer_socks[index])
+    links = [worker.run_broker_link(broker_reader)]
+    for other in range(len(peer_socks)):
+        if other != index:
+            # Every worker's socket was bound before any was started, so this doesn't wait for the others
+            reader, worker.peers[other] = await asyncio.open_unix_connection(peer_path(broker_path, other))
+            links.append(worker.run_peer_link(other, reader))
+    links = [asyncio.ensure_future(link) for link in links]
+    serving = asyncio.ensure_future(server.serve_async(listen_reuseport(server.HOST, server.PORT)))
+    log("INFO", "Worker %s (pid %s) started, hosting rooms %s-%s.", index, os.getpid(), *room_ids[index])
+    try:
+        done, _ = await asyncio.wait(links, return_when=asyncio.FIRST_COMPLETED)
+        for link in done:
+            link.result()
+    except (asyncio.IncompleteReadError, ConnectionError) as e:
+        log("FATAL", "Worker %s lost a cluster link: %r", index, e)
+    finally:
+        serving.cancel()
+        hosting.close()
+
+def run_worker(index, args, room_ids, broker_path, peer_socks):
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C reaches the whole process group; the supervisor handles it
+    server.configure(args)
+    server.rooms = RoomRegistry(*room_ids[index])
+    server.open_recorder(args, f"worker{index}") # The broker has no client sockets, so it records nothing
+    server.start_instrumentation(args, 1 + index, f"worker{index}")
+    try:
+        asyncio.run(serve_worker(index, room_ids, broker_path, peer_socks))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server.recorder is not None:
+            server.recorder.stop()
+        serverlog.stop()
+
+# --- Broker Side ---
+worker_links = {}           # {worker index: WorkerLink}
+match_ids = itertools.count(1)
+
+class WorkerLink:
+    """The broker's end of one worker's link."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.index = None  # Sent in OP_HELLO
+        self.tickets = {}  # {conn_id: RelayedConnection} for the worker's players in the match queue
+
+    def unqueue(self, conn_id):
+        conn = self.tickets.pop(conn_id, None)
+        if conn is not None:
+            server.matchmaker.remove(conn.session.id)
+            drop_session(conn.session)
+
+def place_match(live):
+    """server.match_placer in the broker: has the worker of the group's first player host the game."""
+    host = live[0][1].conn.link.index
+    match_id = next(match_ids)
+    options = live[0][1].match_options
+    for ticket, session in live:
+        conn = session.conn
+        del conn.link.tickets[conn.conn_id]
+        drop_session(session)
+        match = {"match": match_id, "host": host, "size": len(live), "options": options,
+                 "ticket": {"size": ticket.size, "queued_at": ticket.queued_at}}
+        conn.link.writer.write(pack_link_frame(OP_MATCHED, conn.conn_id, json.dumps(match).encode('utf-8')))
+    log("ROOM", "Matched %s players; worker %s hosts.", len(live), host)
+
+async def handle_worker_link(reader, writer):
+    """Serves one worker's match queue, leaderboard and rating traffic."""
+    link = WorkerLink(writer)
+    try:
+        while True:
+            op, conn_id, payload = await read_link_frame(reader)
+            if op == OP_HELLO:
+                link.index = conn_id
+                worker_links[conn_id] = link
+            elif op == OP_QUEUE:
+                ticket = json.loads(payload)
+                conn = RelayedConnection(link, conn_id, ticket["addr"])
+                link.tickets[conn_id] = conn
+                session = server.clients.add(conn, conn.addr) # Only ever queued here, so no idle timer
+                session.rating = ticket["rating"]
+                server.queue_for_match(session, ticket["size"], ticket["options"], ticket["queued_at"])
+            elif op == OP_CLOSE:
+                link.unqueue(conn_id)
+            elif op == OP_RESULT:
+                entry = json.loads(payload)
+                server.leaderboard.record(entry["player"], entry["sentence"], entry["wpm"], entry["accuracy"])
+            elif op == OP_QUERY:
+                reply = server.leaderboard_reply(json.loads(payload))
+                writer.write(pack_link_frame(OP_DATA, conn_id, server.encode_message(reply)))
+            elif op == OP_RATINGS:
+                for name, rating in json.loads(payload).items():
+                    server.ratings.set(name, rating)
+                for other in worker_links.values():
+                    if other is not link:
+                        other.writer.write(pack_link_frame(OP_RATINGS, 0, payload))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        log("WARN", "A worker disconnected from the broker.")
+    except asyncio.CancelledError:
+        pass # Shutting down, as in handle_peer_link
+    finally:
+        for conn_id in list(link.tickets):
+            link.unqueue(conn_id)
+        worker_links.pop(link.index, None)
+        writer.close()
+
+async def serve_broker(broker_path):
+    interrupt_on_sigterm()
+    broker = await asyncio.start_unix_server(handle_worker_link, broker_path)
+    log("INFO", "Broker listening on %s", broker_path)
+    server.match_placer = place_match
+    ticker = asyncio.ensure_future(server.timer_ticker_async()) # Match retries; keep a reference so it isn't collected
+    async with broker:
+        await broker.serve_forever()
+
+def run_broker(args, broker_path):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.configure(args)
+    server.open_leaderboard(args)
+    server.start_instrumentation(args, 0, "broker")
+    try:
+        asyncio.run(serve_broker(broker_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.leaderboard.close()
+        serverlog.stop()
+
+# --- Supervisor ---
+def wait_for_socket(path, process, timeout=BROKER_START_TIMEOUT):
+    """Blocks until the broker has created its socket. Returns False if it died or timed out."""
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if not process.is_alive() or time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def interrupt_on_sigterm():
+    """Turns the supervisor's SIGTERM into KeyboardInterrupt in a cluster process, so it runs its cleanup.
+
+    The event loop raises it between callbacks, never inside one that holds a lock.
+    """
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, _raise_keyboard_interrupt, signal.SIGTERM, None)
+
+def stop_processes(processes, timeout=SHUTDOWN_TIMEOUT):
+    """Asks processes to shut down (SIGTERM), waits up to timeout for their cleanup, then kills any left."""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+    for process in processes:
+        if process.is_alive():
+            log("WARN", "%s did not stop within %ss; killing it.", process.name, timeout)
+            process.kill()
+            process.join()
+
+def start_cluster(args):
+    """Starts the broker and args.workers workers, then waits until one of them exits."""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        log("FATAL", "SO_REUSEPORT is not available on this platform; use --workers 1.")
+        return
+    try:
+        room_ids = room_id_slices(*server.room_id_range(args.room_id_digits), args.workers)
+    except ValueError as e:
+        log("FATAL", "%s", e)
+        return
+
+    broker_path = args.broker_socket or os.path.join(tempfile.mkdtemp(prefix="typing-game-"), "broker.sock")
+    if os.path.exists(broker_path):
+        os.unlink(broker_path)
+    peer_paths = [peer_path(broker_path, i) for i in range(args.workers)]
+    peer_socks = [listen_unix(path) for path in peer_paths] # Bound up front so workers can connect in any order
+    context = multiprocessing.get_context("fork") if hasattr(os, "fork") else multiprocessing.get_context()
+
+    broker = context.Process(target=run_broker, args=(args, broker_path), name="broker", daemon=True)
+    broker.start()
+    if not wait_for_socket(broker_path, broker):
+        log("FATAL", "Broker failed to start.")
+        broker.terminate()
+        return
+
+    workers = [context.Process(target=run_worker, args=(i, args, room_ids, broker_path, peer_socks),
+                               name=f"worker-{i}", daemon=True)
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for sock in peer_socks:
+        sock.close() # The workers have their copies
+    log("INFO", "Cluster of %s workers listening on %s:%s", args.workers, args.host, args.port)
+
+    processes = [broker] + workers
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt) # After forking; children use interrupt_on_sigterm()
+    try:
+        multiprocessing.connection.wait([p.sentinel for p in processes])
+        log("FATAL", "A server process exited; shutting down the cluster.")
+    except KeyboardInterrupt:
+        log("INFO", "Server shutting down.")
+    finally:
+        stop_processes(workers) # First, so the results they still send reach the broker
+        stop_processes([broker])
+        for path in [broker_path] + peer_paths:
+            if os.path.exists(path):
+                os.unlink(path)
@@ -0,0 +1,200 @@
+# corpus.py
+"""Indexed, memory-mapped sentence corpus.
+
+A corpus file holds every passage's UTF-8 text in one blob, a fixed-size
+index record per passage, and per-bucket lists of passage IDs, where a bucket
+is one (language, difficulty, length class) combination. The server maps the
+file read-only, so startup reads only the small header and bucket table, and
+worker processes share the same page-cache pages. Sampling picks a bucket
+weighted by size and a random slot inside it, which costs the same no matter
+how many passages the corpus holds.
+
+Build one from plain text (one passage per line) or JSON lines with "text"
+and optional "difficulty" and "language" fields:
+
+    python corpus.py build passages.jsonl -o sentences.corpus
+    python corpus.py info sentences.corpus
+"""
+import argparse
+import bisect
+import json
+import mmap
+import random
+import struct
+
+# --- File Format ---
+MAGIC = b"TGCORP01"
+HEADER = struct.Struct("<8sIIQQQ")   # magic, passage count, bucket count, index, bucket table and bucket data offsets
+RECORD = struct.Struct("<QI2sBx")    # text offset, text length (bytes), language, difficulty
+BUCKET = struct.Struct("<2sBBII")    # language, difficulty, length class, first slot, slot count
+SLOT = struct.Struct("<I")           # passage ID
+
+LENGTH_CLASSES = ("short", "medium", "long")
+LENGTH_LIMITS = (40, 120)            # Characters; passages past the last limit are "long"
+DIFFICULTIES = (1, 2, 3)             # 1 = easy, 3 = hard
+DEFAULT_LANGUAGE = "en"
+
+def length_class(text):
+    """Index into LENGTH_CLASSES for a passage."""
+    return bisect.bisect_right(LENGTH_LIMITS, len(text))
+
+def estimate_difficulty(text):
+    """Rough 1-3 difficulty from word length and the share of shifted keys, digits and punctuation."""
+    words = text.split()
+    if not words:
+        return DIFFICULTIES[0]
+    mean_word = sum(len(w) for w in words) / len(words)
+    awkward = sum(1 for ch in text if not (ch.islower() or ch == " ")) / len(text)
+    score = (mean_word - 4) / 2 + awkward * 10
+    if score < 0.5:
+        return 1
+    return 2 if score < 1.5 else 3
+
+class CorpusError(ValueError):
+    """Raised for a malformed corpus file or a filter that matches nothing."""
+
+class Corpus:
+    """Read-only view of a corpus file. Passages are addressed by integer ID."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, bucket_count, self._index_at, table_at, self._slots_at = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise CorpusError(f"{path} is not a corpus file.")
+        self._text_at = HEADER.size
+        self._buckets = {} # {(language, difficulty, length class): (first slot, slot count)}
+        for i in range(bucket_count):
+            language, difficulty, length, first, count = BUCKET.unpack_from(self._map, table_at + i * BUCKET.size)
+            self._buckets[(language.decode('ascii'), difficulty, length)] = (first, count)
+        self._languages = {language for language, _, _ in self._buckets}
+        self._filters = {} # Cache: filter key -> (buckets, cumulative counts); sample() only lets valid keys in
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self.count
+
+    def buckets(self):
+        """Returns {(language, difficulty, length class name): passage count}."""
+        return {(language, difficulty, LENGTH_CLASSES[length]): count
+                for (language, difficulty, length), (_, count) in sorted(self._buckets.items())}
+
+    def text(self, sentence_id):
+        """Returns the text of one passage."""
+        if not 0 <= sentence_id < self.count:
+            raise IndexError(sentence_id)
+        offset, size, _, _ = RECORD.unpack_from(self._map, self._index_at + sentence_id * RECORD.size)
+        return self._map[self._text_at + offset:self._text_at + offset + size].decode('utf-8')
+
+    def tags(self, sentence_id):
+        """Returns {"language", "difficulty", "length"} for one passage."""
+        offset, size, language, difficulty = RECORD.unpack_from(self._map, self._index_at + sentence_id * RECORD.size)
+        return {"language": language.decode('ascii'), "difficulty": difficulty,
+                "length": LENGTH_CLASSES[length_class(self.text(sentence_id))]}
+
+    def _matching(self, language, difficulty, length):
+        key = (language, difficulty, length)
+        cached = self._filters.get(key)
+        if cached is None:
+            buckets, totals, total = [], [], 0
+            for (b_language, b_difficulty, b_length), (first, count) in sorted(self._buckets.items()):
+                if ((language is None or b_language == language)
+                        and (difficulty is None or b_difficulty == difficulty)
+                        and (length is None or b_length == length)):
+                    total += count
+                    buckets.append(first)
+                    totals.append(total)
+            cached = self._filters[key] = (buckets, totals)
+        return cached
+
+    def sample(self, language=None, difficulty=None, length=None, rng=random):
+        """Returns the ID of a random passage matching every given filter.
+
+        length is one of LENGTH_CLASSES. Raises CorpusError for a filter the
+        corpus doesn't have, or if nothing matches.
+        """
+        if language is not None and not (isinstance(language, str) and language in self._languages):
+            raise CorpusError(f"Unknown language {language!r}.")
+        if difficulty is not None and difficulty not in DIFFICULTIES:
+            raise CorpusError(f"Invalid difficulty {difficulty!r}.")
+        if length is not None and length not in LENGTH_CLASSES:
+            raise CorpusError(f"Unknown length class {length!r}.")
+        length_index = LENGTH_CLASSES.index(length) if length is not None else None
+        buckets, totals = self._matching(language, difficulty, length_index)
+        if not totals:
+            raise CorpusError("No passages match the requested filters.")
+        pick = rng.randrange(totals[-1])
+        i = bisect.bisect_right(totals, pick)
+        slot = buckets[i] + pick - (totals[i - 1] if i else 0)
+        return SLOT.unpack_from(self._map, self._slots_at + slot * SLOT.size)[0]
+
+# --- Build Tool ---
+def read_passages(path):
+    """Yields (text, language, difficulty) from a .jsonl or plain text file."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+                text = " ".join(entry["text"].split())
+                language = entry.get("language", DEFAULT_LANGUAGE)
+                difficulty = entry.get("difficulty") or estimate_difficulty(text)
+            else:
+                text = " ".join(line.split())
+                language, difficulty = DEFAULT_LANGUAGE, estimate_difficulty(text)
+            if len(language) != 2 or difficulty not in DIFFICULTIES:
+                raise CorpusError(f"Bad tags for passage {text[:30]!r}: {language!r}, {difficulty!r}")
+            yield text, language, difficulty
+
+def build(passages, out_path):
+    """Writes a corpus file from (text, language, difficulty) tuples. Returns the passage count."""
+    blob = bytearray()
+    records = []
+    buckets = {}
+    for text, language, difficulty in passages:
+        data = text.encode('utf-8')
+        buckets.setdefault((language, difficulty, length_class(text)), []).append(len(records))
+        records.append(RECORD.pack(len(blob), len(data), language.encode('ascii'), difficulty))
+        blob += data
+
+    index_at = HEADER.size + len(blob)
+    table_at = index_at + len(records) * RECORD.size
+    slots_at = table_at + len(buckets) * BUCKET.size
+    with open(out_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records), len(buckets), index_at, table_at, slots_at))
+        f.write(blob)
+        f.write(b"".join(records))
+        first = 0
+        for (language, difficulty, length), ids in sorted(buckets.items()):
+            f.write(BUCKET.pack(language.encode('ascii'), difficulty, length, first, len(ids)))
+            first += len(ids)
+        for key in sorted(buckets):
+            f.write(b"".join(SLOT.pack(i) for i in buckets[key]))
+    return len(records)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect sentence corpus files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="Build a corpus from .txt (one passage per line) or .jsonl")
+    build_cmd.add_argument("source")
+    build_cmd.add_argument("-o", "--output", default="sentences.corpus")
+    info_cmd = commands.add_parser("info", help="Show passage counts per bucket")
+    info_cmd.add_argument("corpus")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build(read_passages(args.source), args.output)
+        print(f"[INFO] Wrote {count} passages to {args.output}")
+    else:
+        corpus = Corpus(args.corpus)
+        print(f"{args.corpus}: {len(corpus)} passages")
+        for (language, difficulty, length), count in corpus.buckets().items():
+            print(f"  {language} difficulty={difficulty} length={length}: {count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# leaderboard.py
+"""Global and per-sentence leaderboards backed by an append-only result log.
+
+Each board keeps every player's best result (highest WPM, then accuracy).
+Results only ever replace a player's best with a better one, which keeps
+the indexes simple:
+- the top TOP_SIZE entries are a small sorted list, and a player who drops
+  out of it can only come back by improving, at which point they are
+  re-inserted;
+- ranks come from a Fenwick tree counting players per best WPM, plus a
+  sorted list of accuracies per WPM for ties, so rank is O(log n).
+
+record() updates the boards in memory and queues the result. A writer
+thread (writer.QueuedWriter) appends queued results to the log in batches,
+with one fsync per batch, so the game loop never waits on the disk. Every
+SNAPSHOT_INTERVAL seconds (or SNAPSHOT_RECORDS results) the writer saves the
+best result per player and sentence to a snapshot and truncates the log. A restart loads the
+snapshot and replays what is left of the log. Replaying a result that is
+already in the snapshot changes nothing, because only bests are kept.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from writer import QueuedWriter
+
+# --- Configuration ---
+TOP_SIZE = 100           # Entries kept in each board's top list; also the largest "limit" served
+MAX_WPM = 400            # WPM values are clamped to this for the rank index
+FSYNC_INTERVAL = 0.05    # Seconds between log writes; results arriving meanwhile share one fsync
+SNAPSHOT_INTERVAL = 60.0 # Seconds between snapshots while results keep arriving
+SNAPSHOT_RECORDS = 50000 # ...or this many logged results, whichever comes first
+GLOBAL = None            # Board key of the all-sentences leaderboard
+
+class Board:
+    """Best result per player, for one sentence or for all of them."""
+
+    __slots__ = ("best", "top", "_tree", "_ties")
+
+    def __init__(self):
+        self.best = {}  # {player: (wpm, accuracy)}
+        self.top = []   # [(-wpm, -accuracy, player)], best first, at most TOP_SIZE
+        self._tree = [0] * (MAX_WPM + 2) # Fenwick tree over WPM (1-based)
+        self._ties = {} # {wpm: sorted accuracies of players whose best has that WPM}
+
+    def _add(self, wpm, delta):
+        i = wpm + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _at_most(self, wpm):
+        """Players whose best WPM is <= wpm."""
+        i, total = wpm + 1, 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def update(self, player, wpm, accuracy):
+        """Records a result. Returns True if it is the player's new best."""
+        wpm = min(max(int(wpm), 0), MAX_WPM)
+        new = (wpm, accuracy)
+        old = self.best.get(player)
+        if old is not None and old >= new:
+            return False
+        if old is not None:
+            self._add(old[0], -1)
+            ties = self._ties[old[0]]
+            del ties[bisect.bisect_left(ties, old[1])]
+            try:
+                self.top.remove((-old[0], -old[1], player))
+            except ValueError:
+                pass # Had dropped out of the top list
+        self.best[player] = new
+        self._add(wpm, 1)
+        bisect.insort(self._ties.setdefault(wpm, []), accuracy)
+        entry = (-wpm, -accuracy, player)
+        if len(self.top) < TOP_SIZE or entry < self.top[-1]:
+            bisect.insort(self.top, entry)
+            del self.top[TOP_SIZE:]
+        return True
+
+    def rank(self, player):
+        """1-based rank of a player's best (ties share a rank), or None if they have no result."""
+        best = self.best.get(player)
+        if best is None:
+            return None
+        wpm, accuracy = best
+        faster = len(self.best) - self._at_most(wpm)
+        ties = self._ties[wpm]
+        more_accurate = len(ties) - bisect.bisect_right(ties, accuracy)
+        return 1 + faster + more_accurate
+
+    def leaders(self, limit):
+        """[(rank, player, wpm, accuracy)] for the best `limit` players."""
+        out = []
+        for position, (wpm, accuracy, player) in enumerate(self.top[:limit], start=1):
+            if out and (-wpm, -accuracy) == out[-1][2:]:
+                rank = out[-1][0]
+            else:
+                rank = position
+            out.append((rank, player, -wpm, -accuracy))
+        return out
+
+    def __len__(self):
+        return len(self.best)
+
+class Leaderboard:
+    """Every board, plus the log and snapshot that make them survive restarts.
+
+    With path None nothing is written and the boards last as long as the process.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.snapshot_path = path + ".snapshot" if path else None
+        self._boards = {GLOBAL: Board()}
+        self._lock = threading.Lock()
+        self._log = None
+        self._writer = None
+        self.loaded = (0, 0) # (snapshot entries, log entries replayed) at startup
+        if path:
+            self._load()
+            self._log = open(path, "a", encoding="utf-8")
+            self._logged = self.loaded[1] # Results in the log; replayed ones are still there
+            self._last_snapshot = time.monotonic()
+            self._writer = QueuedWriter(self._write, "leaderboard-writer", FSYNC_INTERVAL)
+
+    def _apply(self, player, sentence, wpm, accuracy):
+        """Updates the sentence's board and the global one. Call with the lock held."""
+        board = self._boards.get(sentence)
+        if board is None:
+            board = self._boards[sentence] = Board()
+        if board.update(player, wpm, accuracy):
+            self._boards[GLOBAL].update(player, wpm, accuracy)
+
+    def record(self, player, sentence, wpm, accuracy):
+        """Adds one result. Returns immediately; the disk write happens on the writer thread."""
+        sentence = str(sentence)
+        with self._lock:
+            self._apply(player, sentence, wpm, accuracy)
+        if self._writer is not None:
+            self._writer.put({"player": player, "sentence": sentence, "wpm": wpm, "accuracy": accuracy,
+                              "time": round(time.time(), 3)})
+
+    def leaders(self, sentence=GLOBAL, limit=10):
+        """Returns (entries, board size) for a sentence's board, or the global one."""
+        limit = min(max(int(limit), 1), TOP_SIZE)
+        with self._lock:
+            board = self._boards.get(sentence if sentence is GLOBAL else str(sentence))
+            if board is None:
+                return [], 0
+            return board.leaders(limit), len(board)
+
+    def rank(self, player, sentence=GLOBAL):
+        """Returns (rank, board size, (wpm, accuracy)); rank and best are None without a result."""
+        with self._lock:
+            board = self._boards.get(sentence if sentence is GLOBAL else str(sentence))
+            if board is None:
+                return None, 0, None
+            return board.rank(player), len(board), board.best.get(player)
+
+    # --- Persistence ---
+    def _load(self):
+        loaded = replayed = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            for sentence, players in snapshot["boards"].items():
+                for player, (wpm, accuracy) in players.items():
+                    self._apply(player, sentence, wpm, accuracy)
+                    loaded += 1
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._apply(entry["player"], entry["sentence"], entry["wpm"], entry["accuracy"])
+                        replayed += 1
+                    except (ValueError, KeyError, TypeError):
+                        continue # Torn final line from a crash; the rest of the log is intact
+        self.loaded = (loaded, replayed)
+
+    def _write(self, batch, stopping):
+        if batch:
+            self._log.write("".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in batch))
+            self._log.flush()
+            os.fsync(self._log.fileno()) # One fsync for the whole batch
+            self._logged += len(batch)
+        if self._logged and (stopping or self._logged >= SNAPSHOT_RECORDS
+                             or time.monotonic() - self._last_snapshot >= SNAPSHOT_INTERVAL):
+            self._snapshot()
+            self._logged, self._last_snapshot = 0, time.monotonic() # The snapshot emptied the log
+
+    def _snapshot(self):
+        """Writes every sentence board's bests atomically, then empties the log they cover.
+
+        Boards are copied one at a time, each under the lock only while it is
+        copied, so record() never waits for more than the largest board.
+        """
+        with self._lock:
+            sentences = [sentence for sentence in self._boards if sentence is not GLOBAL]
+        temp = self.snapshot_path + ".tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write('{"version":1,"boards":{')
+            for i, sentence in enumerate(sentences):
+                with self._lock:
+                    best = dict(self._boards[sentence].best) # Boards are never removed
+                f.write(("," if i else "") + json.dumps(sentence) + ":" + json.dumps(best, separators=(",", ":")))
+            f.write("}}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.snapshot_path)
+        # Everything logged so far is in the snapshot. Results still queued are
+        # too, and get logged after the truncate; replaying them is harmless.
+        self._log.truncate(0)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def close(self):
+        """Writes out queued results, takes a final snapshot and stops the writer."""
+        if self._writer is None:
+            return
+        self._writer.stop()
+        self._writer = None
+        self._log.close()
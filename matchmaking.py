@@ -0,0 +1,198 @@
+# matchmaking.py
+"""Skill-based matchmaking for quick_match, and the Elo ratings it uses.
+
+Players wait in one queue per key (the server uses group size plus challenge
+options). A queue keeps its players in rating buckets BUCKET_WIDTH points
+wide: a dict from bucket to the players in it, oldest first, and a sorted
+list of the buckets that are not empty. Finding opponents is a bisect into
+that list followed by a walk outwards, nearest bucket first, until enough
+players are within the searcher's range. A match therefore costs O(log n) in
+the number of buckets plus the players looked at, and joining or leaving a
+queue is O(1) apart from adding or dropping a bucket.
+
+A player's range starts at BASE_RANGE rating points and widens by
+WIDEN_PER_SECOND while they wait. After MAX_WAIT seconds it is unlimited and
+a group may start with as few as MIN_PLAYERS, so how long anyone waits is
+bounded by how soon someone else queues.
+"""
+import bisect
+import threading
+import time
+
+from rooms import MIN_PLAYERS
+
+# --- Configuration ---
+DEFAULT_RATING = 1500.0
+ELO_K = 32             # Most a rating moves in a two-player game
+BUCKET_WIDTH = 50      # Rating points per queue bucket
+BASE_RANGE = 100.0     # Rating difference accepted straight away
+WIDEN_PER_SECOND = 50.0 # ...growing by this much per second of waiting
+MAX_WAIT = 15.0        # Seconds after which any rating, and a smaller group, is accepted
+
+def search_range(waited):
+    """Largest rating difference a player who has waited this long accepts."""
+    if waited >= MAX_WAIT:
+        return float("inf")
+    return BASE_RANGE + WIDEN_PER_SECOND * waited
+
+def elo_update(ratings, ranks, k=ELO_K):
+    """New ratings after one game, treating it as every pair of players playing each other.
+
+    ratings and ranks are parallel lists; rank 1 is best and ties share a
+    rank. k is split over the n - 1 opponents so a game moves a rating by at
+    most k whatever the room size.
+    """
+    n = len(ratings)
+    if n < 2:
+        return list(ratings)
+    scale = k / (n - 1)
+    updated = []
+    for i in range(n):
+        delta = 0.0
+        for j in range(n):
+            if i == j:
+                continue
+            expected = 1 / (1 + 10 ** ((ratings[j] - ratings[i]) / 400))
+            actual = 1.0 if ranks[i] < ranks[j] else 0.5 if ranks[i] == ranks[j] else 0.0
+            delta += actual - expected
+        updated.append(ratings[i] + scale * delta)
+    return updated
+
+class RatingTable:
+    """Ratings of named players, kept for the life of the process."""
+
+    def __init__(self):
+        self._ratings = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            return self._ratings.get(name, DEFAULT_RATING)
+
+    def set(self, name, rating):
+        with self._lock:
+            self._ratings[name] = rating
+
+    def __len__(self):
+        return len(self._ratings)
+
+class Ticket:
+    """One queued player."""
+
+    __slots__ = ("player", "rating", "size", "key", "bucket", "queued_at")
+
+    def __init__(self, player, rating, size, key, queued_at):
+        self.player = player # Any hashable ID; the server uses session IDs
+        self.rating = rating
+        self.size = size
+        self.key = key
+        self.bucket = int(rating // BUCKET_WIDTH)
+        self.queued_at = queued_at
+
+class _Queue:
+    __slots__ = ("buckets", "keys")
+
+    def __init__(self):
+        self.buckets = {} # {bucket: {player: Ticket}}, oldest first
+        self.keys = []    # Sorted buckets that have players
+
+class Matchmaker:
+    """Queues of players waiting for a quick match, grouped by rating."""
+
+    def __init__(self):
+        self._queues = {}  # {key: _Queue}
+        self._tickets = {} # {player: Ticket}
+        self._lock = threading.Lock()
+
+    def add(self, player, rating, size=MIN_PLAYERS, key=None, queued_at=None):
+        """Queues a player for a group of `size` and tries to match them straight away.
+
+        Returns the matched group (a list of Tickets, this player's first),
+        or None if they are waiting. queued_at keeps an earlier place in
+        line when a player is put back after a match fell through.
+        """
+        now = time.monotonic()
+        ticket = Ticket(player, rating, size, (size, key), now if queued_at is None else queued_at)
+        with self._lock:
+            self._drop(self._tickets.get(player))
+            queue = self._queues.get(ticket.key)
+            if queue is None:
+                queue = self._queues[ticket.key] = _Queue()
+            players = queue.buckets.get(ticket.bucket)
+            if players is None:
+                players = queue.buckets[ticket.bucket] = {}
+                bisect.insort(queue.keys, ticket.bucket)
+            players[player] = ticket
+            self._tickets[player] = ticket
+            return self._match(queue, ticket, now)
+
+    def retry(self, player):
+        """Tries to match a waiting player again with their wider range.
+
+        Returns the group, or None if they are still waiting or no longer queued.
+        """
+        with self._lock:
+            ticket = self._tickets.get(player)
+            if ticket is None:
+                return None
+            return self._match(self._queues[ticket.key], ticket, time.monotonic())
+
+    def remove(self, player):
+        """Takes a player out of the queue. Returns their Ticket, or None if they weren't queued."""
+        with self._lock:
+            ticket = self._tickets.get(player)
+            self._drop(ticket)
+            return ticket
+
+    def _match(self, queue, ticket, now):
+        """Finds the nearest players within range; on success dequeues the group. Call with the lock held."""
+        waited = now - ticket.queued_at
+        span = search_range(waited)
+        wanted = ticket.size - 1
+        needed = wanted if waited < MAX_WAIT else MIN_PLAYERS - 1
+        keys = queue.keys
+        below = bisect.bisect_left(keys, ticket.bucket) - 1
+        above = below + 1
+        picked = []
+        while len(picked) < wanted:
+            if above < len(keys) and (below < 0 or keys[above] - ticket.bucket <= ticket.bucket - keys[below]):
+                bucket = keys[above]
+                above += 1
+            elif below >= 0:
+                bucket = keys[below]
+                below -= 1
+            else:
+                break
+            if (abs(bucket - ticket.bucket) - 1) * BUCKET_WIDTH > span:
+                break # Every rating from here on is out of range
+            for other in queue.buckets[bucket].values():
+                if other is not ticket and abs(other.rating - ticket.rating) <= span:
+                    picked.append(other)
+                    if len(picked) == wanted:
+                        break
+        if len(picked) < needed:
+            return None
+        group = [ticket] + picked
+        for member in group:
+            self._drop(member)
+        return group
+
+    def _drop(self, ticket):
+        """Removes a ticket from its queue. Call with the lock held."""
+        if ticket is None or self._tickets.get(ticket.player) is not ticket:
+            return
+        del self._tickets[ticket.player]
+        queue = self._queues[ticket.key]
+        players = queue.buckets[ticket.bucket]
+        del players[ticket.player]
+        if not players:
+            del queue.buckets[ticket.bucket]
+            del queue.keys[bisect.bisect_left(queue.keys, ticket.bucket)]
+            if not queue.keys:
+                del self._queues[ticket.key]
+
+    def __contains__(self, player):
+        return player in self._tickets
+
+    def __len__(self):
+        return len(self._tickets)
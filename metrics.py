@@ -0,0 +1,226 @@
+# metrics.py
+"""Counters, gauges and latency histograms, rendered as Prometheus text.
+
+Metrics are created once at module level by the code they measure and
+registered in REGISTRY by name (a later metric with the same name replaces
+the earlier one, which happens when server.py is both __main__ and imported). Updating one is a lock and an add, and histograms
+use fixed buckets, so instrumenting the per-message path is cheap. Each
+process keeps its own numbers; in cluster mode every process serves its own
+admin port.
+
+The admin server (serve_admin) answers on localhost:
+  GET /metrics            Prometheus text exposition format
+  GET /profile?seconds=N  profiles message dispatch for N seconds (see DispatchProfiler)
+"""
+import bisect
+import cProfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from serverlog import log
+
+# --- Configuration ---
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Seconds
+MAX_PROFILE_SECONDS = 600
+
+REGISTRY = {} # name -> metric, in registration order
+
+def _labels(label_name, label):
+    return f'{{{label_name}="{label}"}}' if label_name else ""
+
+class Counter:
+    """Monotonic count, optionally split by one label."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        self.name, self.help, self.label = name, help, label
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, label=None):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def value(self, label=None):
+        return self._values.get(label, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name + _labels(self.label, label), value) for label, value in sorted(values.items(), key=lambda kv: str(kv[0]))]
+
+class Gauge:
+    """Current value: either set directly or read from a callback when rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn=None):
+        self.name, self.help, self.fn = name, help, fn
+        self._value = 0
+        REGISTRY[name] = self
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+    def samples(self):
+        return [(self.name, self.value())]
+
+class Histogram:
+    """Distribution of observations (seconds by default) over fixed buckets, optionally split by one label."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self._series = {} # label -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, value, label=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, label=None):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, label)
+
+    def samples(self):
+        with self._lock:
+            series = {label: list(values) for label, values in self._series.items()}
+        out = []
+        for label, values in sorted(series.items(), key=lambda kv: str(kv[0])):
+            prefix = f'{self.label}="{label}",' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                out.append((f'{self.name}_bucket{{{prefix}le="{bound}"}}', cumulative))
+            out.append((self.name + "_sum" + _labels(self.label, label), round(values[-1], 9)))
+            out.append((self.name + "_count" + _labels(self.label, label), cumulative))
+        return out
+
+class _Timer:
+    __slots__ = ("histogram", "label", "started")
+
+    def __init__(self, histogram, label):
+        self.histogram, self.label = histogram, label
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, self.label)
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, value in metric.samples():
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- Profiling ---
+class DispatchProfiler:
+    """Runs message dispatch under cProfile for a fixed window, then writes the stats to a file.
+
+    cProfile follows one thread at a time, so while a window is open the
+    dispatch calls that go through call() take turns; outside a window call()
+    is a plain function call.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._profile = None
+        self._lock = threading.Lock()
+
+    def start(self, seconds, path):
+        """Opens a profiling window. Returns False if one is already running."""
+        with self._lock:
+            if self._profile is not None:
+                return False
+            self.path = path
+            self._profile = cProfile.Profile()
+        timer = threading.Timer(min(seconds, MAX_PROFILE_SECONDS), self.stop)
+        timer.daemon = True
+        timer.start()
+        log("INFO", "Profiling message dispatch for %ss.", seconds)
+        return True
+
+    def stop(self):
+        """Closes the window and writes the stats."""
+        with self._lock:
+            profile, self._profile = self._profile, None
+            if profile is None:
+                return
+            profile.create_stats()
+            if not profile.stats:
+                log("INFO", "No messages were dispatched while profiling; nothing written.")
+                return
+            profile.dump_stats(self.path)
+            log("INFO", "Dispatch profile written to %s", self.path)
+
+    def call(self, fn, *args):
+        if self._profile is None:
+            return fn(*args)
+        with self._lock:
+            profile = self._profile
+            if profile is None:
+                return fn(*args)
+            return profile.runcall(fn, *args)
+
+# --- Admin Server ---
+class AdminHandler(BaseHTTPRequestHandler):
+    profiler = None
+    profile_path = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self._reply(200, render(), "text/plain; version=0.0.4")
+        elif url.path == "/profile" and self.profiler is not None:
+            try:
+                seconds = float(parse_qs(url.query).get("seconds", ["10"])[0])
+            except ValueError:
+                self._reply(400, "seconds must be a number\n")
+                return
+            if self.profiler.start(seconds, self.profile_path):
+                self._reply(200, f"Profiling dispatch for {seconds:g}s into {self.profile_path}\n")
+            else:
+                self._reply(409, "A profile is already running\n")
+        else:
+            self._reply(404, "Not found\n")
+
+    def _reply(self, status, body, content_type="text/plain"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the server log
+
+def serve_admin(host, port, profiler=None, profile_path=None):
+    """Starts the admin HTTP server on a daemon thread and returns it."""
+    handler = type("BoundAdminHandler", (AdminHandler,), {"profiler": profiler, "profile_path": profile_path})
+    admin = ThreadingHTTPServer((host, port), handler)
+    admin.daemon_threads = True
+    threading.Thread(target=admin.serve_forever, daemon=True).start()
+    return admin
@@ -0,0 +1,77 @@
+# progress.py
+"""Server-side tracking of a player's typing while a challenge is in progress.
+
+Clients stream keystroke deltas as {"type": "progress", "payload": {"del": n,
+"add": "text"}}: delete n characters from the end, then append text. The
+tracker keeps the typed characters, so each update costs O(size of the
+delta). Live accuracy comes from the same edit distance as the final score,
+taken against the closest prefix of the sentence, and only when a snapshot
+is asked for after new keystrokes, so it is paid at most once per progress
+broadcast. Time is measured on the server from the moment the challenge was
+sent.
+"""
+import time
+
+import scoring
+
+# --- Configuration ---
+MAX_OVERTYPE = 2 # Typed text is capped at this multiple of the sentence length
+
+class ProgressTracker:
+    """Running state of one player's attempt at one sentence."""
+
+    __slots__ = ("sentence", "started_at", "typed", "keystrokes", "finished_at", "_scored")
+
+    def __init__(self, sentence, started_at=None):
+        self.sentence = sentence
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.typed = []
+        self.keystrokes = 0
+        self.finished_at = None
+        self._scored = None # (keystrokes, accuracy) as of the last snapshot
+
+    def apply(self, delete=0, add=""):
+        """Applies one delta: remove `delete` characters from the end, then append `add`."""
+        if self.finished_at is not None:
+            return
+        typed = self.typed
+        delete = min(max(0, int(delete)), len(typed))
+        if delete:
+            del typed[-delete:]
+        room = MAX_OVERTYPE * len(self.sentence) - len(typed)
+        typed.extend(add[:max(0, room)])
+        self.keystrokes += delete + len(add)
+
+    def finish(self, now=None):
+        """Stops the clock. Later deltas are ignored."""
+        if self.finished_at is None:
+            self.finished_at = time.monotonic() if now is None else now
+
+    def elapsed(self, now=None):
+        if self.finished_at is not None:
+            return self.finished_at - self.started_at
+        return (time.monotonic() if now is None else now) - self.started_at
+
+    def text(self):
+        return "".join(self.typed)
+
+    def accuracy(self):
+        """Accuracy so far: 1 - edit distance / length of the sentence prefix the typed text is closest to."""
+        if self._scored is None or self._scored[0] != self.keystrokes:
+            if not self.typed:
+                accuracy = 100.0
+            else:
+                distance, end = scoring.Pattern(self.text()).prefix_distance(self.sentence)
+                accuracy = round(max(0.0, (1 - distance / end) * 100), 2) if end else 0.0
+            self._scored = (self.keystrokes, accuracy)
+        return self._scored[1]
+
+    def snapshot(self, now=None):
+        """Live stats for broadcasting: position, WPM and accuracy, worked out as for the final score."""
+        return {
+            "position": min(len(self.typed), len(self.sentence)),
+            "length": len(self.sentence),
+            "wpm": scoring.wpm(self.text(), self.elapsed(now)),
+            "accuracy": self.accuracy(),
+            "done": self.finished_at is not None,
+        }
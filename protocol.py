@@ -0,0 +1,271 @@
+# protocol.py
+"""Wire framing shared by the server and the client.
+
+Every message is a JSON object followed by a newline. json.dumps never emits a
+raw newline, so the delimiter can't appear inside a frame. Older clients send
+bare JSON objects with no delimiter; the decoder still picks those out of the
+stream, parsing each as they go, and they read our frames fine because
+json.loads ignores the trailing newline.
+
+Peers that say so in a hello handshake also exchange binary frames for the
+busiest message types: a magic byte, a message tag and a body length
+(BINARY_HEADER), then a fixed struct layout. The magic byte can never start
+a JSON frame, so both kinds share one stream and any message without a
+binary layout (or that doesn't fit one) still goes out as JSON. A binary
+challenge or game_start carries its sentence text only the first time that
+sentence ID goes out on a connection; after that the receiver supplies it
+(fill_sentence).
+"""
+import json
+import struct
+
+# --- Configuration ---
+DELIMITER = b"\n"
+MAX_FRAME_SIZE = 64 * 1024 # Largest frame a peer may send, delimiter excluded
+WIRE_FORMATS = ("binary1", "json") # Formats the server accepts in a hello, most preferred first
+
+# --- Binary Format ---
+BINARY_MAGIC = 0xB1 # A UTF-8 continuation byte, so never the first byte of a JSON frame
+BINARY_HEADER = struct.Struct("!BBH") # magic, message tag, body length
+NO_SENTENCE = 0xFFFFFFFF
+
+TAG_PROGRESS = 1        # client: "!H" characters deleted, then the added text
+TAG_SUBMIT = 2          # client: "!I" sentence ID, then the typed text; the server times the attempt
+TAG_CHALLENGE = 3       # server: "!I" sentence ID, then the sentence, left out if already sent on this connection
+TAG_GAME_START = 4      # server: as TAG_CHALLENGE
+TAG_GAME_RESULT = 5     # server: "!HHIII" wpm, accuracy x100, insertions, deletions, substitutions
+TAG_PROGRESS_UPDATE = 6 # server: "!H" player count, then per player a "!B"-prefixed label and PLAYER_PROGRESS
+
+SUBMIT = struct.Struct("!I")
+SENTENCE = struct.Struct("!I")
+GAME_RESULT = struct.Struct("!HHIII")
+PLAYER_PROGRESS = struct.Struct("!IIHHB") # position, length, wpm, accuracy x100, done
+
+class FrameTooLarge(ValueError):
+    """Raised when a peer sends more than max_frame_size bytes without a delimiter."""
+
+class MalformedFrame(ValueError):
+    """Raised for a binary frame with an unknown tag or a body that doesn't match its layout."""
+
+def _centi(value):
+    return int(round(value * 100))
+
+def _encode_progress(message):
+    payload = message["payload"]
+    return struct.pack("!H", payload["del"]) + payload["add"].encode('utf-8')
+
+def _encode_submit(message):
+    payload = message["payload"]
+    sentence_id = payload.get("sentence_id")
+    return SUBMIT.pack(NO_SENTENCE if sentence_id is None else sentence_id) + payload["text"].encode('utf-8')
+
+def _encode_sentence(message):
+    return SENTENCE.pack(message["sentence_id"]) + message.get("sentence", "").encode('utf-8')
+
+def _encode_game_result(message):
+    results = message["results"]
+    errors = results["errors"]
+    return GAME_RESULT.pack(results["wpm"], _centi(results["accuracy"]),
+                            errors["insertions"], errors["deletions"], errors["substitutions"])
+
+def _encode_progress_update(message):
+    players = message["players"]
+    parts = [struct.pack("!H", len(players))]
+    for label, stats in players.items():
+        label = label.encode('utf-8')
+        parts.append(struct.pack("!B", len(label)) + label)
+        parts.append(PLAYER_PROGRESS.pack(stats["position"], stats["length"], stats["wpm"],
+                                          _centi(stats["accuracy"]), stats["done"]))
+    return b"".join(parts)
+
+def _decode_progress(body):
+    (delete,) = struct.unpack_from("!H", body)
+    return {"type": "progress", "payload": {"del": delete, "add": body[2:].decode('utf-8')}}
+
+def _decode_submit(body):
+    (sentence_id,) = SUBMIT.unpack_from(body)
+    payload = {"text": body[SUBMIT.size:].decode('utf-8')}
+    if sentence_id != NO_SENTENCE:
+        payload["sentence_id"] = sentence_id
+    return {"type": "submit_result", "payload": payload}
+
+def _decode_sentence(message_type):
+    def decode(body):
+        (sentence_id,) = SENTENCE.unpack_from(body)
+        message = {"type": message_type, "sentence_id": sentence_id}
+        if len(body) > SENTENCE.size: # No text: the receiver has it from an earlier frame with this ID
+            message["sentence"] = body[SENTENCE.size:].decode('utf-8')
+        return message
+    return decode
+
+def _decode_game_result(body):
+    wpm, accuracy, insertions, deletions, substitutions = GAME_RESULT.unpack(body)
+    return {"type": "game_result", "results": {
+        "wpm": wpm, "accuracy": accuracy / 100,
+        "errors": {"insertions": insertions, "deletions": deletions, "substitutions": substitutions}}}
+
+def _decode_progress_update(body):
+    (count,) = struct.unpack_from("!H", body)
+    pos, players = 2, {}
+    for _ in range(count):
+        size = body[pos]
+        label = body[pos + 1:pos + 1 + size].decode('utf-8')
+        pos += 1 + size
+        position, length, wpm, accuracy, done = PLAYER_PROGRESS.unpack_from(body, pos)
+        pos += PLAYER_PROGRESS.size
+        players[label] = {"position": position, "length": length, "wpm": wpm, "accuracy": accuracy / 100, "done": bool(done)}
+    return {"type": "progress_update", "players": players}
+
+BINARY_ENCODERS = { # message type -> (tag, encoder)
+    "progress": (TAG_PROGRESS, _encode_progress),
+    "submit_result": (TAG_SUBMIT, _encode_submit),
+    "challenge": (TAG_CHALLENGE, _encode_sentence),
+    "game_start": (TAG_GAME_START, _encode_sentence),
+    "game_result": (TAG_GAME_RESULT, _encode_game_result),
+    "progress_update": (TAG_PROGRESS_UPDATE, _encode_progress_update),
+}
+BINARY_DECODERS = {
+    TAG_PROGRESS: _decode_progress,
+    TAG_SUBMIT: _decode_submit,
+    TAG_CHALLENGE: _decode_sentence("challenge"),
+    TAG_GAME_START: _decode_sentence("game_start"),
+    TAG_GAME_RESULT: _decode_game_result,
+    TAG_PROGRESS_UPDATE: _decode_progress_update,
+}
+
+def encode_message(message, binary=False):
+    """Serializes one message dict into a frame: binary if asked for and the type has a layout, else JSON."""
+    if binary:
+        encoder = BINARY_ENCODERS.get(message.get("type"))
+        if encoder is not None:
+            try:
+                body = encoder[1](message)
+                return BINARY_HEADER.pack(BINARY_MAGIC, encoder[0], len(body)) + body
+            except (KeyError, TypeError, ValueError, AttributeError, struct.error):
+                pass # Missing fields or values out of range for the layout; JSON carries anything
+    return json.dumps(message, separators=(",", ":")).encode('utf-8') + DELIMITER
+
+def decode_frame(frame):
+    """Parses one frame produced by MessageDecoder.
+
+    Raises json.JSONDecodeError or UnicodeDecodeError for bad JSON and
+    MalformedFrame for a bad binary frame.
+    """
+    if frame[0] == BINARY_MAGIC:
+        decoder = BINARY_DECODERS.get(frame[1])
+        if decoder is None:
+            raise MalformedFrame(f"Unknown binary message tag {frame[1]}.")
+        try:
+            return decoder(frame[BINARY_HEADER.size:])
+        except (struct.error, IndexError) as e:
+            raise MalformedFrame(f"Bad binary message body: {e}")
+    if isinstance(frame, LegacyFrame):
+        return frame.message # Already parsed to find where it ended
+    return json.loads(frame.decode('utf-8'))
+
+class LegacyFrame(bytes):
+    """An undelimited JSON frame, with the object the decoder parsed to split it off (`message`)."""
+
+def fill_sentence(message, sentences):
+    """Completes a challenge or game_start from sentences, the receiver's dict of sentence ID -> text.
+
+    Binary frames leave the text out for an ID already sent on the same
+    connection, so every text that does arrive is remembered here.
+    """
+    sentence_id = message.get("sentence_id")
+    if sentence_id is not None:
+        if "sentence" in message:
+            sentences[sentence_id] = message["sentence"]
+        elif sentence_id in sentences:
+            message["sentence"] = sentences[sentence_id]
+    return message
+
+class MessageDecoder:
+    """Incremental decoder for a byte stream of frames.
+
+    feed() buffers partial reads and returns every complete frame found so
+    far, so one recv() that carries several messages (or a piece of one)
+    is handled correctly.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, legacy=True):
+        self.max_frame_size = max_frame_size
+        self.legacy = legacy # Also accept undelimited JSON objects from old clients
+        self._buffer = bytearray()
+        self._scan_from = 0 # Bytes before this offset are known to hold no delimiter
+        self._json = json.JSONDecoder()
+
+    def feed(self, data, admit=None):
+        """Adds received bytes and returns a list of complete frames (bytes).
+
+        Binary frames are returned whole, header included, for decode_frame.
+        Undelimited JSON objects can only be split off by parsing them, so
+        `admit`, if given, is called before each one is parsed; once it returns
+        False the rest of the undelimited bytes buffered so far are dropped
+        unparsed. Those objects come back as LegacyFrames.
+        """
+        self._buffer += data
+        frames = []
+        start = 0
+        while True:
+            if start < len(self._buffer) and self._buffer[start] == BINARY_MAGIC:
+                if len(self._buffer) - start < BINARY_HEADER.size:
+                    break
+                _, _, length = BINARY_HEADER.unpack_from(self._buffer, start)
+                if length > self.max_frame_size:
+                    raise FrameTooLarge(f"Frame of {length} bytes exceeds {self.max_frame_size}.")
+                end = start + BINARY_HEADER.size + length
+                if end > len(self._buffer):
+                    break
+                frames.append(bytes(self._buffer[start:end]))
+                start = end
+                continue
+            end = self._buffer.find(DELIMITER, max(start, self._scan_from))
+            if end == -1:
+                break
+            if end - start > self.max_frame_size:
+                raise FrameTooLarge(f"Frame of {end - start} bytes exceeds {self.max_frame_size}.")
+            if end > start: # Skip empty lines
+                frames.append(bytes(self._buffer[start:end]))
+            start = end + 1
+        del self._buffer[:start]
+        self._scan_from = len(self._buffer)
+
+        if self.legacy and self._buffer[:1] != bytes([BINARY_MAGIC]) and self._buffer.rstrip().endswith(b"}"):
+            frames.extend(self._take_legacy_frames(admit))
+        if len(self._buffer) > self.max_frame_size + BINARY_HEADER.size:
+            raise FrameTooLarge(f"Partial frame of {len(self._buffer)} bytes exceeds {self.max_frame_size}.")
+        return frames
+
+    def _take_legacy_frames(self, admit=None):
+        """Splits undelimited JSON objects off the front of the buffer."""
+        try:
+            text = self._buffer.decode('utf-8')
+        except UnicodeDecodeError:
+            return [] # Multi-byte character cut in half; wait for more data
+        frames = []
+        pos = 0
+        while True:
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos == len(text):
+                break
+            if admit is not None and not admit():
+                pos = len(text) # Finding where this one ends would cost as much as accepting it
+                break
+            try:
+                message, end = self._json.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                break
+            frame = LegacyFrame(text[pos:end].encode('utf-8'))
+            frame.message = message
+            frames.append(frame)
+            pos = end
+        if pos:
+            del self._buffer[:len(text[:pos].encode('utf-8'))]
+            self._scan_from = len(self._buffer)
+        return frames
+
+    def buffered(self):
+        """Number of bytes held back waiting for the rest of a frame."""
+        return len(self._buffer)
@@ -0,0 +1,68 @@
+# ratelimit.py
+"""Token buckets for admission control.
+
+A bucket holds up to `burst` tokens and gains `rate` tokens a second; each
+message or new connection spends one and is refused when the bucket is
+empty. So a client may send `burst` messages at once, but no more than
+`rate` a second over time. The refill is worked out from the time since the
+last take, so a bucket costs nothing while its owner is quiet.
+
+The server gives every connection a bucket for its messages. An
+AddressLimiter keeps one bucket per source IP, shared by all of that
+address's connections, for messages or for new connections.
+"""
+import threading
+import time
+
+# --- Configuration ---
+PRUNE_INTERVAL = 60.0 # Seconds between sweeps that forget full per-address buckets
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now # Monotonic time tokens was last worked out
+
+    def take(self, now):
+        """Spends one token. Returns False, spending nothing, when there isn't a whole one."""
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class AddressLimiter:
+    """A TokenBucket per source IP. Safe to share between client threads."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {} # {ip: TokenBucket}
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, ip, now):
+        with self._lock:
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                bucket = self._buckets[ip] = TokenBucket(self.rate, self.burst, now)
+            allowed = bucket.take(now)
+            if now - self._pruned >= PRUNE_INTERVAL:
+                self._prune(now)
+            return allowed
+
+    def _prune(self, now):
+        """Drops buckets that have refilled; a fresh one would be the same."""
+        self._buckets = {ip: bucket for ip, bucket in self._buckets.items() if not bucket.full(now)}
+        self._pruned = now
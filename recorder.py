@@ -0,0 +1,141 @@
+# recorder.py
+"""Traffic recorder: every message to and from every client, for replaying later.
+
+A record is a fixed header (kind, connection ID, microseconds since the
+recorder started, payload length) followed by the payload. An OPEN record
+carries the client's address, IN records one frame as MessageDecoder
+returned it (JSON frames without their newline), OUT records the framed
+bytes sent, and CLOSE records nothing. Each file starts with a header
+holding the wall-clock time the recorder started, so recordings from
+several processes can be lined up.
+
+Callers only timestamp the message and queue it. A writer thread
+(writer.QueuedWriter) appends queued records in batches. When the file reaches max_bytes it is rotated
+like a log: path becomes path.1, path.1 becomes path.2, and so on, keeping
+`backups` old files. An existing file is rotated away at startup, so
+connection IDs (the server's session IDs) are never reused within a file.
+"""
+import os
+import struct
+import time
+
+from writer import QueuedWriter
+
+# --- Format ---
+FILE_HEADER = struct.Struct("!6sd") # magic, wall-clock start time
+RECORD_HEADER = struct.Struct("!BIQI") # kind, conn_id, microseconds since start, payload length
+MAGIC = b"TGREC1"
+OPEN, IN, OUT, CLOSE = 1, 2, 3, 4
+
+# --- Configuration ---
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024 # Rotate the file at this size
+DEFAULT_BACKUPS = 5                  # Rotated files kept
+WRITE_INTERVAL = 0.05                # Seconds between writes to the file
+
+class Recorder:
+    """Writes a connection-tagged record of every message to a rotating binary log."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._live = set() # Connection IDs between their OPEN and CLOSE records
+        self._started = time.monotonic_ns()
+        self._started_wall = time.time()
+        self.records = 0
+        if os.path.exists(path) and os.path.getsize(path):
+            self._rotate()
+        self._file = self._open()
+        self._writer = QueuedWriter(self._write, "recorder-writer", WRITE_INTERVAL)
+
+    def _put(self, kind, conn_id, payload):
+        self._writer.put((kind, conn_id, (time.monotonic_ns() - self._started) // 1000, payload))
+
+    def open(self, conn_id, addr):
+        """Starts recording a new connection; conn_id is the server's session ID."""
+        self._live.add(conn_id)
+        self._put(OPEN, conn_id, str(addr).encode('utf-8'))
+
+    def inbound(self, conn_id, frame):
+        if conn_id in self._live:
+            self._put(IN, conn_id, frame)
+
+    def outbound(self, conn_id, data):
+        if conn_id in self._live:
+            self._put(OUT, conn_id, data)
+
+    def close(self, conn_id):
+        if conn_id in self._live:
+            self._live.discard(conn_id)
+            self._put(CLOSE, conn_id, b"")
+
+    # --- Writer ---
+    def _open(self):
+        f = open(self.path, "wb")
+        f.write(FILE_HEADER.pack(MAGIC, self._started_wall))
+        return f
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write(self, batch, stopping):
+        chunks = []
+        for kind, conn_id, elapsed, payload in batch:
+            chunks.append(RECORD_HEADER.pack(kind, conn_id, elapsed, len(payload)))
+            chunks.append(payload)
+        if chunks:
+            self._file.write(b"".join(chunks))
+            self._file.flush()
+            self.records += len(batch)
+            if self._file.tell() >= self.max_bytes:
+                self._file.close()
+                self._rotate()
+                self._file = self._open()
+        if stopping:
+            self._file.close()
+
+    def stop(self):
+        """Writes out queued records and closes the file."""
+        self._writer.stop()
+
+# --- Reading ---
+def recording_files(path):
+    """The files of one recording that still exist, oldest first: path.N, ..., path.1, path."""
+    files = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        files.append(f"{path}.{index}")
+        index += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def read_records(path):
+    """Yields (run, kind, conn_id, wall-clock seconds, payload) for every record in one file.
+
+    run is the recorder's start time; it tells apart connection IDs from
+    different server runs. A record cut short by a crash ends the file quietly.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        return
+    magic, started = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a recording.")
+    pos = FILE_HEADER.size
+    while pos + RECORD_HEADER.size <= len(data):
+        kind, conn_id, elapsed, length = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        if pos + length > len(data):
+            return
+        yield started, kind, conn_id, started + elapsed / 1e6, data[pos:pos + length]
+        pos += length
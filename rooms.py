@@ -0,0 +1,343 @@
+# rooms.py
+"""Room and client registries shared by the server's handler threads.
+
+Both tables are split into shards, each with its own lock, so handlers
+touching different rooms or clients never wait on each other. Every room
+state change (join, submit, remove) happens under its shard lock, which makes
+it atomic from the point of view of the other handlers.
+
+Both hold players as session IDs (small integers), not socket objects.
+
+A room is deleted, and its ID freed, as soon as its game is over. The server
+hangs each room's expiry or deadline timer on room.timer; deleting the room
+cancels it.
+"""
+import itertools
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from progress import ProgressTracker
+from session import Session
+
+# --- Configuration ---
+DEFAULT_SHARDS = 64
+ROOM_ID_MIN = 1000
+ROOM_ID_MAX = 9999
+MIN_PLAYERS = 2
+MAX_ROOM_SIZE = 100
+
+class RoomIdsExhausted(RuntimeError):
+    """Raised when every ID in the configured space is held by a live room."""
+
+class RoomIdAllocator:
+    """Hands out unique room IDs from [low, high] in constant time.
+
+    Fresh IDs come from a counter pushed through an affine permutation of the
+    ID space, so they don't look sequential. Released IDs queue up and are
+    only reused, oldest first, once the counter has used up the space. So an
+    ID stays retired for as long as possible, and a player holding a stale
+    one finds nothing rather than a stranger's new room.
+    """
+
+    def __init__(self, low=ROOM_ID_MIN, high=ROOM_ID_MAX, seed=None):
+        if high < low:
+            raise ValueError("Room ID space is empty.")
+        self.low = low
+        self.size = high - low + 1
+        rng = random.Random(seed)
+        self._step = self._pick_step(self.size, rng)
+        self._offset = rng.randrange(self.size)
+        self._next = 0
+        self._free = deque()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pick_step(size, rng):
+        """Picks a multiplier coprime with size so index -> ID is a bijection."""
+        if size == 1:
+            return 1
+        while True:
+            step = rng.randrange(size // 3 or 1, size)
+            if math.gcd(step, size) == 1:
+                return step
+
+    def allocate(self):
+        with self._lock:
+            if self._next >= self.size:
+                if not self._free:
+                    raise RoomIdsExhausted(f"All {self.size} room IDs are in use.")
+                return self._free.popleft()
+            index = self._next
+            self._next += 1
+        return str(self.low + (index * self._step + self._offset) % self.size)
+
+    def release(self, room_id):
+        with self._lock:
+            self._free.append(room_id)
+
+    def in_use(self):
+        with self._lock:
+            return self._next - len(self._free)
+
+class _Shard:
+    __slots__ = ("lock", "items")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+
+class ClientRegistry:
+    """Sharded table of connected clients: {session ID: Session}.
+
+    IDs count up from 1 and are never reused, so a timer or room that
+    outlives its player finds nothing rather than a stranger.
+    """
+
+    def __init__(self, shard_count=DEFAULT_SHARDS):
+        self._shards = [_Shard() for _ in range(shard_count)]
+        self._ids = itertools.count(1)
+
+    def _shard(self, session_id):
+        return self._shards[session_id % len(self._shards)]
+
+    def add(self, conn, addr):
+        """Registers a connection and returns its new Session, also reachable as conn.session."""
+        session = Session(next(self._ids), conn, addr)
+        conn.session = session
+        shard = self._shard(session.id)
+        with shard.lock:
+            shard.items[session.id] = session
+        return session
+
+    def remove(self, session_id):
+        """Drops a client and returns its Session, or None if it was not registered."""
+        shard = self._shard(session_id)
+        with shard.lock:
+            return shard.items.pop(session_id, None)
+
+    def get(self, session_id, default=None):
+        return self._shard(session_id).items.get(session_id, default)
+
+    def __getitem__(self, session_id):
+        return self._shard(session_id).items[session_id]
+
+    def __contains__(self, session_id):
+        return session_id in self._shard(session_id).items
+
+    def __len__(self):
+        return sum(len(shard.items) for shard in self._shards)
+
+class Room:
+    """One room. players[0] is the host.
+
+    options holds the creator's challenge filters (language, difficulty,
+    length); results has a slot per player, None until they submit; progress
+    is filled in when the game starts. status is "waiting", "playing" or
+    "finished". timer is whatever the server scheduled for the room
+    (anything with a cancel() method).
+    """
+
+    __slots__ = ("players", "size", "sentence", "sentence_id", "options", "results", "progress", "status", "timer")
+
+    def __init__(self, host, size, options):
+        self.players = [host] # Session IDs
+        self.size = size
+        self.sentence = None
+        self.sentence_id = None
+        self.options = options
+        self.results = {host: None} # {session ID: results or None}
+        self.progress = {}          # {session ID: ProgressTracker}
+        self.status = "waiting"
+        self.timer = None
+
+class RoomSnapshot:
+    """A room's players, results and status, copied under its shard lock for the caller to act on."""
+
+    __slots__ = ("players", "results", "status")
+
+    def __init__(self, room):
+        self.players = list(room.players)
+        self.results = dict(room.results) # {session ID: results or None}
+        self.status = room.status
+
+class RoomRegistry:
+    """Sharded table of Rooms with atomic create/join/submit/remove transitions."""
+
+    def __init__(self, id_low=ROOM_ID_MIN, id_high=ROOM_ID_MAX, shard_count=DEFAULT_SHARDS, seed=None):
+        self._ids = RoomIdAllocator(id_low, id_high, seed=seed)
+        self._shards = [_Shard() for _ in range(shard_count)]
+
+    def _shard(self, room_id):
+        return self._shards[hash(room_id) % len(self._shards)]
+
+    @staticmethod
+    def _delete(shard, room_id):
+        """Drops a room and cancels its timer. Call with the shard lock held, then release the ID."""
+        room = shard.items.pop(room_id)
+        room.status = "finished" # Anyone still holding the room sees it is over
+        if room.timer is not None:
+            room.timer.cancel()
+            room.timer = None
+        return room
+
+    def create(self, host, options=None, size=MIN_PLAYERS):
+        """Opens a waiting room for `size` players with the host's session ID and returns the new room ID."""
+        if not MIN_PLAYERS <= size <= MAX_ROOM_SIZE:
+            raise ValueError(f"Room size must be between {MIN_PLAYERS} and {MAX_ROOM_SIZE}.")
+        room_id = self._ids.allocate()
+        shard = self._shard(room_id)
+        with shard.lock:
+            shard.items[room_id] = Room(host, size, options or {})
+        return room_id
+
+    def join(self, room_id, player):
+        """Adds a player to a waiting room.
+
+        Returns the players now in the room, or None if the room is missing,
+        full or already playing.
+        """
+        if not isinstance(room_id, str):
+            return None
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.items.get(room_id)
+            if room is None or room.status != "waiting" or len(room.players) >= room.size or player in room.results:
+                return None
+            room.players.append(player)
+            room.results[player] = None # Add player result slot
+            return list(room.players)
+
+    def start(self, room_id, sentence, sentence_id=None, by=None):
+        """Moves a waiting room with at least MIN_PLAYERS players to playing.
+
+        When `by` is given it must be the host. Returns the players to notify,
+        or None if the room can't start.
+        """
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.items.get(room_id)
+            if room is None or room.status != "waiting" or len(room.players) < MIN_PLAYERS:
+                return None
+            if by is not None and room.players[0] != by:
+                return None
+            room.sentence = sentence
+            room.sentence_id = sentence_id
+            room.status = "playing"
+            if room.timer is not None:
+                room.timer.cancel() # No longer waiting to expire; the server sets the round deadline
+                room.timer = None
+            started_at = time.monotonic() # Server-side start of the race for every player
+            room.progress = {player: ProgressTracker(sentence, started_at) for player in room.players}
+            return list(room.players)
+
+    def sentence(self, room_id):
+        """Sentence of a playing room, or None if there is no such game."""
+        room = self.get(room_id)
+        if room is None or room.status != "playing":
+            return None
+        return room.sentence
+
+    def submit_result(self, room_id, player, results):
+        """Stores one player's results.
+
+        Returns (outcome, room) where outcome is "invalid" (no playing room),
+        "duplicate" (already submitted), "recorded" (others still typing) or
+        "finished" (this was the last result). For "finished", room is a
+        RoomSnapshot of the players and their results, and the room is deleted.
+        """
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.items.get(room_id)
+            if room is None or room.status != "playing" or player not in room.results:
+                return "invalid", None
+            if room.results[player] is not None:
+                return "duplicate", None
+            room.results[player] = results
+            if any(res is None for res in room.results.values()):
+                return "recorded", None
+            snapshot = RoomSnapshot(room)
+            self._delete(shard, room_id)
+        self._ids.release(room_id)
+        return "finished", snapshot
+
+    def end_round(self, room_id, room):
+        """Ends a round at its deadline, deleting the room.
+
+        `room` is the Room the deadline was set for, so a timer that fires
+        after its room is gone (and the ID reused) does nothing. Returns a
+        RoomSnapshot, where players who never submitted have None results,
+        or None if that round already ended.
+        """
+        shard = self._shard(room_id)
+        with shard.lock:
+            if shard.items.get(room_id) is not room or room.status != "playing":
+                return None
+            snapshot = RoomSnapshot(room)
+            self._delete(shard, room_id)
+        self._ids.release(room_id)
+        return snapshot
+
+    def expire(self, room_id, room):
+        """Deletes `room` if it is still waiting to start. Returns its players, or None if it started or is gone."""
+        shard = self._shard(room_id)
+        with shard.lock:
+            if shard.items.get(room_id) is not room or room.status != "waiting":
+                return None
+            self._delete(shard, room_id)
+        self._ids.release(room_id)
+        return list(room.players)
+
+    def leave(self, room_id, player):
+        """Takes a disconnecting player out of their room.
+
+        Returns (outcome, room), where room is a RoomSnapshot of the players
+        still in it, taken before any deletion:
+        "gone"     - no such room or player; room is None.
+        "left"     - others carry on.
+        "finished" - everyone left has submitted, so the game is over and the
+                     room is deleted.
+        "closed"   - the room was deleted (empty, or a game without enough
+                     players to continue).
+        """
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.items.get(room_id)
+            if room is None or player not in room.results:
+                return "gone", None
+            room.players.remove(player)
+            del room.results[player]
+            room.progress.pop(player, None)
+            snapshot = RoomSnapshot(room)
+            if not room.players or (room.status == "playing" and len(room.players) < MIN_PLAYERS):
+                outcome = "closed"
+            elif room.status == "playing" and all(res is not None for res in room.results.values()):
+                outcome = "finished"
+            else:
+                return "left", snapshot
+            self._delete(shard, room_id)
+        self._ids.release(room_id)
+        return outcome, snapshot
+
+    def remove(self, room_id):
+        """Deletes a room, frees its ID and returns its players, or None if it was already gone."""
+        shard = self._shard(room_id)
+        with shard.lock:
+            if room_id not in shard.items:
+                return None
+            room = self._delete(shard, room_id)
+        self._ids.release(room_id)
+        return list(room.players)
+
+    def get(self, room_id):
+        if not isinstance(room_id, str):
+            return None
+        return self._shard(room_id).items.get(room_id)
+
+    def __contains__(self, room_id):
+        return self.get(room_id) is not None
+
+    def __len__(self):
+        return sum(len(shard.items) for shard in self._shards)
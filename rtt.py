@@ -0,0 +1,40 @@
+# rtt.py
+"""Round-trip time estimation from ping/pong samples.
+
+The smoothed RTT and its variation follow TCP's estimator (RFC 6298): each
+sample moves srtt by 1/8 and rttvar by 1/4 of the difference. The lowest
+sample seen is kept as well. It is the best guess at the path's delay
+without queueing, and it is what the server takes off a player's measured
+time: a challenge travels one way and the submission the other, so together
+they cost one round trip.
+"""
+
+# --- Configuration ---
+SRTT_GAIN = 1 / 8
+RTTVAR_GAIN = 1 / 4
+
+class RttEstimator:
+    __slots__ = ("srtt", "rttvar", "min_rtt", "samples")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None
+        self.samples = 0
+
+    def update(self, sample):
+        """Adds one round-trip sample, in seconds."""
+        if sample < 0:
+            return
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar += RTTVAR_GAIN * (abs(self.srtt - sample) - self.rttvar)
+            self.srtt += SRTT_GAIN * (sample - self.srtt)
+        self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+        self.samples += 1
+
+    def delay(self):
+        """Network time in one request/response exchange: the lowest RTT seen, or 0 before any sample."""
+        return self.min_rtt or 0.0
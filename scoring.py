@@ -0,0 +1,270 @@
+# scoring.py
+"""Alignment-based accuracy scoring.
+
+Accuracy is 1 - edit_distance / len(original), so a dropped character costs
+one error instead of shifting every later character out of place.
+
+The distance and the error classes (insertions, deletions, substitutions)
+come from Landau-Vishkin's diagonal search. Its cost grows with the square of
+the number of edits, plus matching runs compared a slice at a time, so it is
+fast for real typing. Submissions too far off to be worth aligning (more
+than max_edits edits) fall back to Myers' bit-parallel algorithm (Hyyrö's
+formulation for whole-string distance) and an estimated breakdown. There the
+original is compiled into per-character bitmasks held in Python ints, and
+each typed character costs a handful of operations on ints as wide as the
+sentence, so O(len(typed) * len(original) / 64) word operations in all.
+Both are several times slower than the positional comparison they replaced.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+# --- Configuration ---
+PATTERN_CACHE_SIZE = 4096 # Compiled sentences kept around; challenges repeat a lot
+ALIGN_MAX_EDITS = 128     # Beyond this many edits the error breakdown is estimated
+
+Alignment = namedtuple("Alignment", "distance insertions deletions substitutions ops")
+Alignment.__doc__ = """Result of aligning typed text against the original.
+
+ops has one code per aligned column: '=' match, 'S' substitution,
+'D' deletion (original character missing from the typed text) and
+'I' insertion (extra typed character). ops is None when the breakdown
+was estimated rather than aligned.
+"""
+
+class Pattern:
+    """An original sentence compiled for repeated scoring."""
+
+    __slots__ = ("text", "length", "_masks", "_full", "_last")
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        masks = {}
+        for i, ch in enumerate(text):
+            masks[ch] = masks.get(ch, 0) | (1 << i)
+        self._masks = masks
+        self._full = (1 << self.length) - 1
+        self._last = 1 << (self.length - 1) if self.length else 0
+
+    def distance(self, typed):
+        """Levenshtein distance by the bit-parallel algorithm; steady cost, whatever the number of edits."""
+        if not self.length:
+            return len(typed)
+        masks, full, last = self._masks, self._full, self._last
+        pv, mv, score = full, 0, self.length
+        for ch in typed:
+            eq = masks.get(ch, 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & full)
+            mh = pv & xh
+            if ph & last:
+                score += 1
+            elif mh & last:
+                score -= 1
+            ph = ((ph << 1) | 1) & full
+            mh = (mh << 1) & full
+            pv = mh | (~(xv | ph) & full)
+            mv = ph & xv
+        return score
+
+    def prefix_distance(self, text):
+        """Returns (distance, end): the smallest distance between this pattern and any prefix of text, and that prefix's length.
+
+        Scores text typed so far against the sentence it is heading for:
+        compile the typed text and pass the sentence. Ties go to the longest
+        prefix. Stops as soon as no longer prefix could do as well.
+        """
+        if not self.length:
+            return 0, 0
+        masks, full, last = self._masks, self._full, self._last
+        pv, mv, score = full, 0, self.length
+        best, end = score, 0
+        for j, ch in enumerate(text, 1):
+            if j - self.length > best:
+                break # Every longer prefix needs at least j - length deletions
+            eq = masks.get(ch, 0)
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & full)
+            mh = pv & xh
+            if ph & last:
+                score += 1
+            elif mh & last:
+                score -= 1
+            if score <= best:
+                best, end = score, j
+            ph = ((ph << 1) | 1) & full
+            mh = (mh << 1) & full
+            pv = mh | (~(xv | ph) & full)
+            mv = ph & xv
+        return best, end
+
+    def accuracy(self, typed, distance=None):
+        """Percentage of the original typed correctly, from the edit distance."""
+        if not self.length:
+            return 0.0
+        if distance is None:
+            distance = self.distance(typed)
+        return max(0.0, (1 - distance / self.length) * 100)
+
+    def edit_distance(self, typed, max_edits=ALIGN_MAX_EDITS):
+        """Levenshtein distance: the diagonal search without its traceback, or the bit-parallel one past max_edits."""
+        found = self._search(typed, max_edits, trace=False)
+        return self.distance(typed) if found is None else found[0]
+
+    def _search(self, typed, max_edits, trace):
+        """Landau-Vishkin: returns (d, furthest, origin), or None past max_edits.
+
+        furthest[d][diag + d + 2] is the furthest row reachable on diagonal
+        diag (j - i) with d edits, -1 for none; each level has two -1s at
+        either end so neighbours never need a bounds check. origin records
+        the edit taken before sliding. Without trace only the last level of
+        furthest is kept.
+        """
+        a, b = self.text, typed
+        m, n = len(a), len(b)
+        target = n - m # Diagonal of the bottom-right corner
+        if abs(target) > max_edits:
+            return None
+        level = [-1, -1, _slide(a, b, 0, 0), -1, -1]
+        furthest, origin = [level], [[None, None, (None, 0), None, None]]
+        d = 0
+        while not (-d <= target <= d and level[target + d + 2] >= m):
+            d += 1
+            if d > max_edits:
+                return None
+            prev = level # Diagonal diag is at prev[diag + d + 1]
+            level = [-1] * (2 * d + 5)
+            level_origin = [None] * (2 * d + 5) if trace else None
+            for diag in range(max(-d, -m), min(d, n) + 1):
+                k = diag + d + 1
+                best, op = -1, None
+                i = prev[k]
+                if 0 <= i < m and i + diag < n:
+                    best, op = i + 1, "S"
+                i = prev[k + 1]
+                if 0 <= i < m and i + 1 > best:
+                    best, op = i + 1, "D"
+                i = prev[k - 1]
+                if i >= 0 and i + diag <= n and i > best:
+                    best, op = i, "I"
+                if op is None:
+                    continue
+                j = best + diag
+                level[k + 1] = _slide(a, b, best, j) if best < m and j < n and a[best] == b[j] else best
+                if trace:
+                    level_origin[k + 1] = (op, best)
+            if trace:
+                furthest.append(level)
+                origin.append(level_origin)
+        return d, furthest, origin
+
+    def align(self, typed, max_edits=ALIGN_MAX_EDITS):
+        """Returns an Alignment with per-class error counts."""
+        found = self._search(typed, max_edits, trace=True)
+        if found is None:
+            return self._estimate(typed)
+        d, furthest, origin = found
+
+        ops = []
+        insertions = deletions = substitutions = 0
+        diag = len(typed) - self.length # Back from the bottom-right corner
+        for level in range(d, -1, -1):
+            op, start = origin[level][diag + level + 2]
+            ops.append("=" * (furthest[level][diag + level + 2] - start))
+            if op == "S":
+                substitutions += 1
+            elif op == "D":
+                deletions += 1
+                diag += 1
+            elif op == "I":
+                insertions += 1
+                diag -= 1
+            if op is not None:
+                ops.append(op)
+        return Alignment(d, insertions, deletions, substitutions, "".join(reversed(ops)))
+
+    def _estimate(self, typed):
+        """Exact distance, with the length difference counted as indels and the rest as substitutions."""
+        m, n = self.length, len(typed)
+        # Past 2x the original the accuracy is 0 whatever the distance; skip the work.
+        distance = n if n >= 2 * m else self.distance(typed)
+        indels = abs(n - m)
+        return Alignment(distance, max(0, n - m), max(0, m - n), distance - indels, None)
+
+def _slide(a, b, i, j):
+    """Advances along a diagonal while the characters match and returns the new row.
+
+    Compares slices that double in size until one differs, then halves
+    them back down, so a run of k matches costs O(log k) comparisons.
+    """
+    m, n = len(a), len(b)
+    step = 1
+    while i + step <= m and j + step <= n and a[i:i + step] == b[j:j + step]:
+        i += step
+        j += step
+        step *= 2
+    while step > 1:
+        step //= 2
+        if i + step <= m and j + step <= n and a[i:i + step] == b[j:j + step]:
+            i += step
+            j += step
+    return i
+
+def wpm(typed, seconds):
+    """Words typed per minute, counting whitespace-separated words."""
+    return int(len(typed.split()) / seconds * 60) if seconds > 0 else 0
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(original):
+    """Returns a (cached) Pattern for an original sentence."""
+    return Pattern(original)
+
+def score(original, typed):
+    """Returns {"accuracy", "errors"} for one submission."""
+    pattern = compile_pattern(original)
+    alignment = pattern.align(typed)
+    return {
+        "accuracy": round(pattern.accuracy(typed, alignment.distance), 2),
+        "errors": {
+            "insertions": alignment.insertions,
+            "deletions": alignment.deletions,
+            "substitutions": alignment.substitutions,
+        },
+    }
+
+def score_batch(submissions, details=False):
+    """Scores many (original, typed) pairs at once and returns a list of results in order.
+
+    Each distinct original is compiled once for the whole batch, and a pair
+    that repeats (every perfect submission of a sentence, for one) is scored
+    once. Without details only the distance is found, giving {"accuracy",
+    "distance"}; with details each result also carries the error classes.
+    """
+    patterns = {}
+    scored = {} # {(original, typed): result}
+    results = []
+    for original, typed in submissions:
+        result = scored.get((original, typed))
+        if result is None:
+            pattern = patterns.get(original)
+            if pattern is None:
+                pattern = patterns[original] = compile_pattern(original)
+            if details:
+                alignment = pattern.align(typed)
+                result = {
+                    "accuracy": round(pattern.accuracy(typed, alignment.distance), 2),
+                    "distance": alignment.distance,
+                    "errors": {
+                        "insertions": alignment.insertions,
+                        "deletions": alignment.deletions,
+                        "substitutions": alignment.substitutions,
+                    },
+                }
+            else:
+                distance = pattern.edit_distance(typed)
+                result = {"accuracy": round(pattern.accuracy(typed, distance), 2), "distance": distance}
+            scored[original, typed] = result
+        results.append(dict(result, errors=dict(result["errors"])) if details else dict(result))
+    return results
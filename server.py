@@ -1,262 +1,1218 @@
-# server.py 
-import socket
-import threading
-import random
-import time
-import json
-
-# --- Configuration ---
-HOST = '0.0.0.0'
-PORT = 65432
-BUFFER_SIZE = 1024
-SENTENCES = [
-    "The quick brown fox jumps over the lazy dog.",
-    "Practice makes perfect.",
-    "Keep your friends close.",
-    "Simplicity is key.",
-    "Hello world example."
-]
-
-# --- Server State ---
-clients = {} # {conn: {"addr": addr, "room_id": None}}
-rooms = {}   # {room_id: {"players": [conn1, conn2], "sentence": None, "results": {conn1: None, conn2: None}, "status": "waiting"}}
-
-# --- Helper Functions ---
-def generate_room_id():
-    """Generates a simple unique room ID."""
-    while True:
-        room_id = str(random.randint(1000, 9999))
-        if room_id not in rooms:
-            return room_id
-
-def calculate_results(original_sentence, typed_text, time_taken):
-    """Calculates WPM and Accuracy."""
-    if not original_sentence or time_taken <= 0:
-        return {"wpm": 0, "accuracy": 0.0}
-
-    typed_words = typed_text.split()
-    word_count = len(typed_words)
-    wpm = int((word_count / time_taken) * 60) if time_taken > 0 else 0
-
-    correct_chars = 0
-    min_len = min(len(original_sentence), len(typed_text))
-    for i in range(min_len):
-        if original_sentence[i] == typed_text[i]:
-            correct_chars += 1
-    accuracy = (correct_chars / len(original_sentence)) * 100 if len(original_sentence) > 0 else 0.0
-
-    return {"wpm": wpm, "accuracy": round(accuracy, 2)}
-
-def cleanup_client(conn):
-    """Removes client data and cleans up their room if necessary."""
-    print(f"[DISCONNECT] Client {clients.get(conn, {}).get('addr')} disconnected.")
-    if conn in clients:
-        room_id = clients[conn].get("room_id")
-        if room_id and room_id in rooms:
-            print(f"[ROOM] Removing room {room_id} due to player disconnect.")
-            # Notify other player if they exist
-            other_player = None
-            if room_id in rooms: # Check if room still exists
-                for player_conn in rooms[room_id]["players"]:
-                    if player_conn != conn and player_conn in clients: # Make sure other player still connected
-                         other_player = player_conn
-                         break
-                if other_player:
-                    try:
-                        other_player.sendall(json.dumps({"type": "opponent_left"}).encode('utf-8'))
-                    except socket.error:
-                        print(f"[WARN] Could not notify other player in room {room_id} about disconnect.")
-
-                del rooms[room_id] # Delete the room
-
-        del clients[conn] # Remove client from main list
-    try:
-        conn.close()
-    except socket.error:
-        pass # Ignore errors on closing
-
-# --- Client Handling Logic ---
-def handle_client(conn, addr):
-    """Handles communication with a single client."""
-    print(f"[CONNECT] New connection from {addr}")
-    clients[conn] = {"addr": addr, "room_id": None}
-    current_state = "connected" 
-
-    try:
-        while True:
-            data = conn.recv(BUFFER_SIZE)
-            if not data:
-                break # Connection closed
-
-            try:
-                message = json.loads(data.decode('utf-8'))
-                print(f"[RECV] From {addr}: {message}")
-                msg_type = message.get("type")
-                payload = message.get("payload", {})
-
-                # --- Mode Selection ---
-                if current_state == "connected" and msg_type == "choose_mode":
-                    mode = payload.get("mode")
-                    if mode == "single":
-                        current_state = "single_player"
-                        sentence = random.choice(SENTENCES)
-                        conn.sendall(json.dumps({"type": "challenge", "sentence": sentence}).encode('utf-8'))
-                    elif mode == "multiplayer":
-                        current_state = "multiplayer_menu"
-                        
-                    else:
-                         conn.sendall(json.dumps({"type": "error", "message": "Invalid mode."}).encode('utf-8'))
-
-                # --- Single Player Result ---
-                elif current_state == "single_player" and msg_type == "submit_result":
-                    typed_text = payload.get("text", "")
-                    time_taken = payload.get("time", 0)
-                    original_sentence = payload.get("original", "")
-                    results = calculate_results(original_sentence, typed_text, time_taken)
-                    conn.sendall(json.dumps({"type": "game_result", "results": results}).encode('utf-8'))
-                    break # End single player session
-
-                # --- Multiplayer Actions ---
-                elif current_state == "multiplayer_menu" and msg_type == "multiplayer_action":
-                    action = payload.get("action")
-                    if action == "create":
-                        room_id = generate_room_id()
-                        rooms[room_id] = {"players": [conn], "sentence": None, "results": {conn: None}, "status": "waiting"}
-                        clients[conn]["room_id"] = room_id
-                        current_state = "in_room_waiting"
-                        conn.sendall(json.dumps({"type": "room_created", "room_id": room_id}).encode('utf-8'))
-                        print(f"[ROOM] Client {addr} created room {room_id}")
-                    elif action == "join":
-                        room_id = payload.get("room_id")
-                        if room_id in rooms and rooms[room_id]["status"] == "waiting" and len(rooms[room_id]["players"]) == 1:
-                            # Join the room
-                            clients[conn]["room_id"] = room_id
-                            rooms[room_id]["players"].append(conn)
-                            rooms[room_id]["results"][conn] = None # Add player result slot
-                            rooms[room_id]["status"] = "playing"
-                            current_state = "in_room_playing" # Update state for joining player
-
-                            # Start game for both
-                            sentence = random.choice(SENTENCES)
-                            rooms[room_id]["sentence"] = sentence
-                            start_message = json.dumps({"type": "game_start", "sentence": sentence}).encode('utf-8')
-
-                            # Update state for the waiting player too
-                            waiting_player_conn = rooms[room_id]["players"][0]
-                            # Find the handle_client thread for the waiting player is hard,
-                            # so we rely on the client receiving game_start to know it's playing.
-
-                            for player_conn in rooms[room_id]["players"]:
-                                player_conn.sendall(start_message)
-                            print(f"[ROOM] Client {addr} joined room {room_id}. Game starting.")
-                        else:
-                            conn.sendall(json.dumps({"type": "error", "message": f"Cannot join room {room_id} (Not found, full, or already playing)."}).encode('utf-8'))
-                            # Keep state as multiplayer_menu to allow retry
-                    else:
-                        conn.sendall(json.dumps({"type": "error", "message": "Invalid multiplayer action."}).encode('utf-8'))
-
-                # --- Multiplayer Game Result Submission ---
-                # This state check assumes the client knows it's playing after receiving game_start
-                elif msg_type == "submit_result": 
-                    room_id = clients[conn].get("room_id")
-                    if room_id and room_id in rooms and rooms[room_id]["status"] == "playing":
-                        # Check if this player already submitted (basic prevention)
-                        if conn in rooms[room_id]["results"] and rooms[room_id]["results"][conn] is not None:
-                            print(f"[WARN] Player {addr} tried to submit results twice for room {room_id}.")
-                            continue # Ignore second submission
-
-                        typed_text = payload.get("text", "")
-                        time_taken = payload.get("time", 0)
-                        original_sentence = rooms[room_id]["sentence"] # Get sentence from room
-                        results = calculate_results(original_sentence, typed_text, time_taken)
-                        rooms[room_id]["results"][conn] = results # Store result
-                        print(f"[GAME] Received results from {addr} in room {room_id}")
-
-                        # Check if all results are in
-                        all_results_in = all(res is not None for res in rooms[room_id]["results"].values())
-                        if all_results_in and len(rooms[room_id]["players"]) == 2:
-                            rooms[room_id]["status"] = "finished" # Mark room as finished internally
-                            player_conns = rooms[room_id]["players"]
-                            results1 = rooms[room_id]["results"][player_conns[0]]
-                            results2 = rooms[room_id]["results"][player_conns[1]]
-
-                            # Determine winner (simple WPM comparison)
-                            winner_addr_str = "Draw"
-                            if results1["wpm"] > results2["wpm"]:
-                                winner_addr_str = str(clients[player_conns[0]]["addr"])
-                            elif results2["wpm"] > results1["wpm"]:
-                                winner_addr_str = str(clients[player_conns[1]]["addr"])
-                            # Ignoring accuracy tie-breaker for simplicity
-
-                            print(f"[GAME] Room {room_id} finished. Winner: {winner_addr_str}")
-
-                            # Prepare results message
-                            final_results_payload = {
-                                str(clients[p]["addr"]): rooms[room_id]["results"][p] for p in player_conns
-                            }
-                            final_message = json.dumps({
-                                "type": "game_over",
-                                "results": final_results_payload,
-                                "winner": winner_addr_str
-                            }).encode('utf-8')
-
-                            # Send to both players
-                            for p_conn in player_conns:
-                                try:
-                                    p_conn.sendall(final_message)
-                                except socket.error:
-                                    print(f"[WARN] Could not send final results to a player in room {room_id}.")
-                            # Room will be cleaned up when players disconnect
-
-                        elif not all_results_in:
-                             pass
-
-                    else:
-                        print(f"[WARN] Received result from {addr} but not in a valid playing room.")
-
-                else:
-                    print(f"[WARN] Unhandled message type '{msg_type}' or state '{current_state}' from {addr}")
-
-
-            except json.JSONDecodeError:
-                print(f"[ERROR] Invalid JSON received from {addr}")
-            except Exception as e:
-                 print(f"[ERROR] Error processing message from {addr}: {e}")
-                 # Basic error feedback
-                 try:
-                     conn.sendall(json.dumps({"type": "error", "message": "Server error occurred."}).encode('utf-8'))
-                 except socket.error:
-                     pass # Client might be disconnected
-
-    except socket.error as e:
-        print(f"[ERROR] Socket error with client {addr}: {e}")
-    except Exception as e:
-        print(f"[ERROR] Unexpected error with client {addr}: {e}")
-    finally:
-        cleanup_client(conn) # Ensure cleanup happens
-
-# --- Main Server Execution ---
-def start_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
-        print(f"[INFO] Simplified Server listening on {HOST}:{PORT}")
-
-        while True:
-            conn, addr = server_socket.accept()
-            client_thread = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-            client_thread.start()
-
-    except socket.error as e:
-        print(f"[FATAL] Socket error on startup: {e}")
-    except KeyboardInterrupt:
-        print("\n[INFO] Server shutting down.")
-    finally:
-        print("[INFO] Closing server socket.")
-        
-        server_socket.close()
-
-if __name__ == "__main__":
-    start_server()
+# server.py
+import argparse
+import asyncio
+import errno
+import socket
+import threading
+import random
+import time
+import json
+import os
+
+from protocol import LegacyFrame, MessageDecoder, FrameTooLarge, MalformedFrame, WIRE_FORMATS, encode_message, decode_frame
+from rooms import ClientRegistry, RoomRegistry, RoomIdsExhausted, MIN_PLAYERS, MAX_ROOM_SIZE
+from transport import QueuedConnection, StreamConnection
+from session import State
+from corpus import Corpus, CorpusError
+import scoring
+from progress import ProgressTracker
+from leaderboard import Leaderboard
+from timers import TimerWheel
+from matchmaking import Matchmaker, RatingTable, elo_update
+from rtt import RttEstimator
+from ratelimit import TokenBucket, AddressLimiter
+from recorder import Recorder, DEFAULT_MAX_BYTES as RECORD_MAX_BYTES, DEFAULT_BACKUPS as RECORD_BACKUPS
+import serverlog
+from serverlog import log
+import metrics
+
+# --- Configuration ---
+HOST = '0.0.0.0'
+PORT = 65432
+BUFFER_SIZE = 1024
+LISTEN_BACKLOG = 4096 # Pending connections the kernel may queue before accept()
+ENGINES = ("threads", "asyncio")
+ROOM_ID_DIGITS = 4 # Room IDs are 1000-9999; raise for more concurrent rooms
+PROGRESS_TICK_RATE = 10 # Opponent progress broadcasts per second, per room, at most
+CHALLENGE_OPTIONS = ("language", "difficulty", "length") # Corpus filters a client may ask for
+PIN_SENTENCES = False # --pin-sentences: also honour a "sentence_id" option, so replayed sessions get their recorded sentence
+ADMIN_HOST = '127.0.0.1' # The admin port is only reachable locally
+MESSAGE_TYPES = ("hello", "choose_mode", "multiplayer_action", "progress", "submit_result", "leaderboard", "rank", "ping", "pong") # Metric labels; anything else is "other"
+ACTIVITY_TYPES = ("choose_mode", "multiplayer_action", "progress", "submit_result", "leaderboard", "rank") # Messages that hold off the idle timeout; pings, pongs and hellos don't
+MAX_NAME_LENGTH = 24 # Leaderboard names
+SENT_SENTENCES = 1024 # Sentence IDs remembered per binary connection; later ones always carry their text
+IDLE_TIMEOUT = 300.0 # Seconds a connection may stay silent (outside a round) before it is closed; 0 disables
+ROOM_WAIT_TIMEOUT = 180.0 # Seconds a room may wait for players before it expires
+ROUND_BASE_SECONDS = 30.0 # Every round's submission deadline starts here...
+ROUND_SECONDS_PER_CHAR = 0.6 # ...plus this per character of the sentence (about 20 WPM)
+PING_INTERVAL = 2.0 # Seconds between RTT pings to clients that asked for them in hello
+MAX_RTT_CORRECTION = 0.25 # Most network time taken off an attempt, so holding back pongs can't buy a client time
+MAX_PLAUSIBLE_WPM = 400 # Submissions timed faster than this (5 characters a word) are rejected; 0 disables
+MAX_QUICK_MATCH_SIZE = 8 # Largest group quick_match will assemble
+MATCH_RETRY_INTERVAL = 1.0 # Seconds between matching attempts for a waiting player, as their range widens
+MAX_CONNECTIONS = 0 # Concurrent clients; at the cap, accepting waits until one leaves. 0 disables
+MSG_RATE = 50.0 # Messages a second one connection may send over time; 0 disables
+MSG_BURST = 100 # Messages one connection may send at once
+IP_MSG_RATE = 0.0 # Messages a second summed over all connections from one IP; 0 disables
+IP_CONNECT_RATE = 0.0 # New connections a second from one IP; 0 disables
+IP_BURST_SECONDS = 2.0 # Per-address buckets hold this many seconds of their rate
+FLOOD_DROPS = 200 # A connection with this many messages in a row over its rate limit is disconnected
+ACCEPT_RETRY_DELAY = 0.1 # Seconds to back off when accept() fails for one of these:
+ACCEPT_RETRY_ERRNOS = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.ECONNABORTED)
+MATCH_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 15.0, 20.0, 30.0, 60.0, 120.0) # Seconds
+SENTENCES = [ # Used when no --corpus file is given
+    "The quick brown fox jumps over the lazy dog.",
+    "Practice makes perfect.",
+    "Keep your friends close.",
+    "Simplicity is key.",
+    "Hello world example."
+]
+
+# --- Server State ---
+clients = ClientRegistry() # {session ID: session.Session}
+rooms = RoomRegistry()     # {room_id: rooms.Room}, players held as session IDs
+corpus = None              # corpus.Corpus when started with --corpus
+room_broker = None         # cluster.Worker in cluster workers: reaches rooms on other workers, the match queue and the leaderboard
+match_placer = None        # Set in the cluster's broker: hands each matched group to a worker to host
+leaderboard = None         # leaderboard.Leaderboard in the process that owns results (cluster workers send theirs to the broker)
+progress_dirty = set()     # Room IDs with progress not yet broadcast; flushed every tick
+progress_lock = threading.Lock()
+profiler = metrics.DispatchProfiler()
+timer_wheel = TimerWheel()  # Idle checks, room expiry and round deadlines
+matchmaker = Matchmaker()  # Players waiting for a quick match, by rating
+ratings = RatingTable()    # Elo ratings of named players; anonymous players keep theirs per connection
+recorder = None            # recorder.Recorder when started with --record, in the processes that own client sockets
+ip_messages = None         # ratelimit.AddressLimiter when --ip-msg-rate is set
+ip_connects = None         # ratelimit.AddressLimiter when --ip-connect-rate is set
+
+# --- Metrics ---
+CONNECTIONS_TOTAL = metrics.Counter("typing_connections_total", "Connections accepted.")
+MESSAGES = metrics.Counter("typing_messages_total", "Messages received, by type.", label="type")
+ERRORS = metrics.Counter("typing_errors_total", "Errors, by kind.", label="kind")
+DISPATCH_SECONDS = metrics.Histogram("typing_dispatch_seconds", "Time to handle one message, by type.", label="type")
+SCORING_SECONDS = metrics.Histogram("typing_scoring_seconds", "Time to score one submission.")
+SEND_SECONDS = metrics.Histogram("typing_send_seconds", "Time to hand one outgoing message to its connection.")
+MESSAGES_SENT = metrics.Counter("typing_messages_sent_total", "Messages sent; a broadcast counts once per player.")
+BYTES_SENT = metrics.Counter("typing_bytes_sent_total", "Bytes sent to clients.")
+MATCH_WAIT_SECONDS = metrics.Histogram("typing_match_wait_seconds", "Time from quick_match to match_found.",
+                                       buckets=MATCH_WAIT_BUCKETS)
+THROTTLED = metrics.Counter("typing_throttled_total", "Messages and connections refused by rate limits, by limit.",
+                            label="limit")
+ACCEPT_WAITS = metrics.Counter("typing_accept_waits_total", "Times accepting paused at --max-connections.")
+TIMEOUTS = metrics.Counter("typing_timeouts_total", "Connections and rooms expired, by kind.", label="kind")
+metrics.Gauge("typing_connections", "Connected clients.", fn=lambda: len(clients))
+metrics.Gauge("typing_rooms", "Live rooms.", fn=lambda: len(rooms))
+metrics.Gauge("typing_matchmaking_queue", "Players waiting for a quick match.", fn=lambda: len(matchmaker))
+metrics.Gauge("typing_timers", "Timers waiting in the timer wheel.", fn=lambda: timer_wheel.pending)
+
+# --- Helper Functions ---
+def send_bytes(conn, data):
+    """Writes already framed bytes to one client, counting them."""
+    started = time.perf_counter()
+    conn.sendall(data)
+    SEND_SECONDS.observe(time.perf_counter() - started)
+    MESSAGES_SENT.inc()
+    BYTES_SENT.inc(len(data))
+    if recorder is not None and conn.session is not None:
+        recorder.outbound(conn.session.id, data)
+
+def wire_format(session, message):
+    """How a message is framed for one session: "json", "binary", or "known" (binary without the
+    sentence text, which the session was sent with an earlier frame for the same sentence ID)."""
+    if session is None or not session.binary:
+        return "json"
+    sentence_id = message.get("sentence_id")
+    if "sentence" not in message or sentence_id is None:
+        return "binary"
+    sent = session.sentences_sent
+    if sent is None:
+        sent = session.sentences_sent = set()
+    if sentence_id in sent:
+        return "known"
+    if len(sent) < SENT_SENTENCES:
+        sent.add(sentence_id)
+    return "binary"
+
+def encode_for(message, form):
+    """Frames a message in a form from wire_format."""
+    if form == "known":
+        message = {key: value for key, value in message.items() if key != "sentence"}
+    return encode_message(message, form != "json")
+
+def send_message(conn, message):
+    """Frames a message dict in the client's wire format and writes it to one client."""
+    send_bytes(conn, encode_for(message, wire_format(conn.session, message)))
+
+def broadcast(players, message):
+    """Encodes a message once per wire format and queues the same bytes for every player (session IDs)."""
+    encoded = {}
+    for player in players:
+        session = clients.get(player)
+        if session is None:
+            continue # Disconnected; their handler is cleaning up
+        form = wire_format(session, message)
+        data = encoded.get(form)
+        if data is None:
+            data = encoded[form] = encode_for(message, form)
+        send_bytes(session.conn, data)
+
+def player_name(player):
+    """How a player (session ID) is shown to others: their chosen name, or their address."""
+    session = clients.get(player)
+    if not session:
+        return "unknown"
+    return session.name or str(session.addr)
+
+def player_labels(players):
+    """{player: label} for a room's players: their player_name, with "#<session ID>" added where two share one.
+
+    Names aren't unique, so anything keyed by player on the wire uses these labels.
+    """
+    names = {player: player_name(player) for player in players}
+    taken = list(names.values()) # Rooms are small
+    return {player: f"{name}#{player}" if taken.count(name) > 1 else name for player, name in names.items()}
+
+def clean_name(name):
+    """A usable leaderboard name from client input, or None."""
+    if not isinstance(name, str):
+        return None
+    name = " ".join(name.split())[:MAX_NAME_LENGTH]
+    return name if name and name.isprintable() else None
+
+def rank_results(results):
+    """Orders {conn: results} by WPM with accuracy as the tie-breaker.
+
+    Returns [(rank, conn, results)]; players tied on both share a rank.
+    """
+    ordered = sorted(results.items(), key=lambda item: (item[1]["wpm"], item[1]["accuracy"]), reverse=True)
+    ranking = []
+    for position, (conn, res) in enumerate(ordered, start=1):
+        if ranking and (res["wpm"], res["accuracy"]) == (ranking[-1][2]["wpm"], ranking[-1][2]["accuracy"]):
+            rank = ranking[-1][0]
+        else:
+            rank = position
+        ranking.append((rank, conn, res))
+    return ranking
+
+def room_id_range(digits):
+    """Returns the (low, high) room ID bounds for IDs with the given number of digits."""
+    return 10 ** (digits - 1), 10 ** digits - 1
+
+def challenge_options(payload):
+    """Extracts the corpus filters a client asked for from a message payload."""
+    options = {key: payload[key] for key in CHALLENGE_OPTIONS if payload.get(key) is not None}
+    if PIN_SENTENCES and payload.get("sentence_id") is not None:
+        options["sentence_id"] = payload["sentence_id"]
+    return options
+
+def pick_sentence(options):
+    """Returns (sentence_id, text) for a new challenge. Raises CorpusError if the filters match nothing."""
+    if "sentence_id" in options: # Only present with --pin-sentences
+        try:
+            sentence_id = int(options["sentence_id"])
+            if sentence_id < 0:
+                raise IndexError(sentence_id)
+            return sentence_id, corpus.text(sentence_id) if corpus is not None else SENTENCES[sentence_id]
+        except (TypeError, ValueError, IndexError):
+            raise CorpusError(f"Unknown sentence_id {options['sentence_id']!r}.")
+    if corpus is None:
+        sentence_id = random.randrange(len(SENTENCES))
+        return sentence_id, SENTENCES[sentence_id]
+    try:
+        difficulty = int(options["difficulty"]) if "difficulty" in options else None
+    except (TypeError, ValueError):
+        raise CorpusError(f"Invalid difficulty {options['difficulty']!r}.")
+    sentence_id = corpus.sample(language=options.get("language"), difficulty=difficulty, length=options.get("length"))
+    return sentence_id, corpus.text(sentence_id)
+
+def calculate_results(original_sentence, typed_text, time_taken):
+    """Calculates WPM, alignment-based Accuracy and the error breakdown."""
+    with SCORING_SECONDS.time():
+        scored = scoring.score(original_sentence, typed_text)
+    return {"wpm": scoring.wpm(typed_text, time_taken), "accuracy": scored["accuracy"], "errors": scored["errors"]}
+
+def submitted_attempt(tracker, payload, delay=0.0):
+    """Returns (typed_text, time_taken) for a submission, or None if it can't be accepted.
+
+    Time is the server's: from sending the challenge to receiving the
+    submission, less `delay`, the measured network round trip. When the
+    client streamed its keystrokes, the text the server rebuilt also wins
+    over the one submitted. An attempt faster than MAX_PLAUSIBLE_WPM is
+    refused and its clock keeps running, so it can only be resubmitted later.
+    """
+    if tracker is None:
+        return None # Nothing was timed
+    now = time.monotonic()
+    text = tracker.text() if tracker.keystrokes else payload.get("text", "")
+    time_taken = tracker.elapsed(now) - delay
+    fastest = max(len(text), 1) * 12 / MAX_PLAUSIBLE_WPM if MAX_PLAUSIBLE_WPM > 0 else 0.0 # 60 seconds / 5 characters a word
+    if time_taken < fastest or time_taken <= 0:
+        return None
+    tracker.finish(now)
+    return text, time_taken
+
+def reject_submission(conn, addr):
+    """Tells a client its submission came in faster than anyone types."""
+    log("WARN", "Rejected a submission from %s faster than %s WPM.", addr, MAX_PLAUSIBLE_WPM)
+    ERRORS.inc(label="implausible")
+    send_message(conn, {"type": "error", "message": "Submission rejected: faster than anyone types."})
+
+def network_delay(session):
+    """Round-trip time to take off a player's measured time, at most MAX_RTT_CORRECTION; 0 for clients that don't answer pings."""
+    return min(session.rtt.delay(), MAX_RTT_CORRECTION) if session.rtt is not None else 0.0
+
+def record_result(session, sentence_id, results):
+    """Adds a finished attempt to the leaderboard. Only players who chose a name are ranked."""
+    name = session.name
+    if name is None or sentence_id is None:
+        return
+    if room_broker is not None:
+        room_broker.record(name, sentence_id, results["wpm"], results["accuracy"])
+    elif leaderboard is not None:
+        leaderboard.record(name, sentence_id, results["wpm"], results["accuracy"])
+
+def leaderboard_reply(message, asker=None):
+    """Answers a "leaderboard" (top N) or "rank" query; rank defaults to the asker's own."""
+    payload = message.get("payload", {})
+    sentence = payload.get("sentence") # None: the global board
+    if message.get("type") == "leaderboard":
+        try:
+            entries, size = leaderboard.leaders(sentence, payload.get("limit", 10))
+        except (TypeError, ValueError):
+            return {"type": "error", "message": "Invalid leaderboard limit."}
+        return {"type": "leaderboard", "sentence": sentence, "players": size,
+                "top": [{"rank": rank, "player": player, "wpm": wpm, "accuracy": accuracy}
+                        for rank, player, wpm, accuracy in entries]}
+    player = clean_name(payload.get("player")) or asker
+    rank, size, best = leaderboard.rank(player, sentence)
+    return {"type": "rank", "sentence": sentence, "player": player, "rank": rank, "players": size,
+            "wpm": best[0] if best else None, "accuracy": best[1] if best else None}
+
+def mark_progress(room_id):
+    """Queues a room's progress for the next broadcast tick."""
+    with progress_lock:
+        progress_dirty.add(room_id)
+
+def flush_progress():
+    """Broadcasts one progress_update per room that changed since the last tick."""
+    global progress_dirty
+    with progress_lock:
+        room_ids, progress_dirty = progress_dirty, set()
+    now = time.monotonic()
+    for room_id in room_ids:
+        room = rooms.get(room_id)
+        if room is None or room.status != "playing":
+            continue
+        labels = player_labels(room.players)
+        players = {}
+        for player, tracker in list(room.progress.items()):
+            if player in clients and player in labels:
+                players[labels[player]] = tracker.snapshot(now) # Same keys as game_over
+        try:
+            broadcast(room.players, {"type": "progress_update", "players": players})
+        except socket.error:
+            pass # Disconnects are handled by the player's own handler
+
+def run_progress_ticker():
+    """Thread body for the threads engine: flushes progress PROGRESS_TICK_RATE times a second."""
+    while True:
+        time.sleep(1 / PROGRESS_TICK_RATE)
+        flush_progress()
+
+async def progress_ticker_async():
+    while True:
+        await asyncio.sleep(1 / PROGRESS_TICK_RATE)
+        flush_progress()
+
+# --- Timeouts ---
+def round_seconds(sentence):
+    """Submission deadline for a round on this sentence."""
+    return ROUND_BASE_SECONDS + ROUND_SECONDS_PER_CHAR * len(sentence)
+
+def run_timer_ticker():
+    """Thread body for the threads engine: fires due timers every tick."""
+    while True:
+        time.sleep(timer_wheel.tick)
+        timer_wheel.advance()
+
+async def timer_ticker_async():
+    while True:
+        await asyncio.sleep(timer_wheel.tick)
+        timer_wheel.advance()
+
+def send_ping(session_id):
+    """Timer callback: pings a client for an RTT sample, then schedules the next ping."""
+    session = clients.get(session_id)
+    if session is None or (room_broker is not None and session.state is State.RELAYED):
+        return # Gone, or the worker hosting its room pings it now
+    session.ping_id += 1
+    session.ping_sent = (session.ping_id, time.monotonic()) # An unanswered ping is simply replaced
+    try:
+        send_message(session.conn, {"type": "ping", "id": session.ping_id})
+    except socket.error:
+        return
+    session.ping_timer = timer_wheel.schedule(PING_INTERVAL, send_ping, session_id)
+
+def start_pinging(session, min_rtt=None):
+    """Starts measuring a client's RTT; min_rtt seeds it with a sample taken elsewhere."""
+    if session.rtt is None:
+        session.rtt = RttEstimator()
+        if min_rtt is not None:
+            session.rtt.update(min_rtt)
+        send_ping(session.id)
+
+def check_idle(session_id):
+    """Timer callback: closes a connection silent for IDLE_TIMEOUT, or checks again when it could be."""
+    session = clients.get(session_id)
+    if session is None:
+        return # Already disconnected
+    if session.state is State.RELAYED:
+        return # The worker hosting its room sees the session's frames and times it out there
+    quiet_since = max(session.last_seen, session.busy_until) # Typing a round counts as activity
+    remaining = quiet_since + IDLE_TIMEOUT - time.monotonic()
+    if remaining > 0:
+        session.idle_timer = timer_wheel.schedule(remaining, check_idle, session_id)
+        return
+    log("DISCONNECT", "Closing %s after %ss without activity.", session.addr, IDLE_TIMEOUT)
+    TIMEOUTS.inc(label="idle")
+    try:
+        send_message(session.conn, {"type": "error", "message": "Disconnected for inactivity."})
+        session.conn.close() # The handler sees the disconnect and cleans up
+    except socket.error:
+        pass
+
+def release_players(players):
+    """Sends the players of a deleted room back to the multiplayer menu."""
+    for player in players:
+        session = clients.get(player)
+        if session:
+            session.room_id = None
+            session.state = State.MULTIPLAYER_MENU
+            session.busy_until = 0.0
+
+def expire_room(room_id, room):
+    """Timer callback: deletes a room that is still waiting for players."""
+    players = rooms.expire(room_id, room)
+    if players is None:
+        return # Started or closed in the meantime
+    log("ROOM", "Room %s expired after %ss without starting.", room_id, ROOM_WAIT_TIMEOUT)
+    TIMEOUTS.inc(label="room_wait")
+    release_players(players)
+    broadcast(players, {"type": "room_expired", "room_id": room_id})
+
+def end_round(room_id, room):
+    """Timer callback: ends a round at its deadline with the results that are in."""
+    snapshot = rooms.end_round(room_id, room)
+    if snapshot is None:
+        return # Everyone submitted or left in time
+    log("GAME", "Room %s ran out of time.", room_id)
+    TIMEOUTS.inc(label="round")
+    finish_game(room_id, snapshot)
+
+# --- Matchmaking ---
+def player_rating(session):
+    """A player's Elo rating: kept on the session once set, else the named player's, else the default."""
+    if session.rating is None:
+        session.rating = ratings.get(session.name)
+    return session.rating
+
+def update_ratings(players, ranks):
+    """Applies one game's Elo changes. Returns {session ID: new rating}."""
+    sessions = [clients.get(player) for player in players]
+    new = elo_update([player_rating(session) if session else ratings.get(None) for session in sessions], ranks)
+    named = {}
+    for session, rating in zip(sessions, new):
+        if session:
+            session.rating = rating
+            if session.name:
+                ratings.set(session.name, rating)
+                named[session.name] = rating
+    if room_broker is not None and named:
+        room_broker.share_ratings(named) # Their next game may be on another worker
+    return dict(zip(players, new))
+
+def queue_for_match(session, size, options, queued_at=None):
+    """Puts a player in the matchmaking queue, starting a game if that completes a group."""
+    session.state = State.MATCHMAKING
+    session.match_options = options
+    group = matchmaker.add(session.id, player_rating(session), size, json.dumps(options, sort_keys=True), queued_at)
+    if group:
+        start_match(group)
+    else:
+        session.match_timer = timer_wheel.schedule(MATCH_RETRY_INTERVAL, retry_match, session.id)
+
+def retry_match(session_id):
+    """Timer callback: tries to match a waiting player again now their range is wider."""
+    group = matchmaker.retry(session_id)
+    if group:
+        start_match(group)
+    elif session_id in matchmaker:
+        session = clients.get(session_id)
+        if session:
+            session.match_timer = timer_wheel.schedule(MATCH_RETRY_INTERVAL, retry_match, session_id)
+
+def start_match(group):
+    """Puts a matched group (matchmaking Tickets) in a new room and starts the game."""
+    now = time.monotonic()
+    live = []
+    for ticket in group:
+        session = clients.get(ticket.player)
+        if session is None:
+            continue # Disconnected while being matched
+        if session.match_timer is not None:
+            session.match_timer.cancel()
+            session.match_timer = None
+        live.append((ticket, session))
+    if len(live) < MIN_PLAYERS:
+        for ticket, session in live: # Back in line, keeping their place
+            queue_for_match(session, ticket.size, session.match_options, ticket.queued_at)
+        return
+    for ticket, _ in live:
+        MATCH_WAIT_SECONDS.observe(now - ticket.queued_at)
+    if match_placer is not None:
+        match_placer(live) # The cluster broker: a worker hosts the game
+        return
+    open_match([session for _, session in live], live[0][1].match_options)
+
+def open_match(sessions, options):
+    """Puts matched players in a new room and starts the game."""
+    players = [session.id for session in sessions]
+    try:
+        room_id = rooms.create(players[0], options, len(players))
+    except RoomIdsExhausted:
+        release_players(players)
+        broadcast(players, {"type": "error", "message": "No rooms available, try again later."})
+        return
+    for player in players[1:]:
+        rooms.join(room_id, player)
+    for session in sessions:
+        session.room_id = room_id
+        session.state = State.IN_ROOM_WAITING
+    broadcast(players, {"type": "match_found", "room_id": room_id, "players": list(player_labels(players).values())})
+    log("ROOM", "Matched %s players into room %s.", len(players), room_id)
+    if not start_game(room_id):
+        rooms.remove(room_id)
+        release_players(players)
+
+def start_game(room_id, by=None):
+    """Picks the sentence and starts a waiting room. Returns False if it can't start."""
+    room = rooms.get(room_id)
+    if room is None:
+        return False
+    try:
+        sentence_id, sentence = pick_sentence(room.options)
+    except CorpusError as e:
+        broadcast(room.players, {"type": "error", "message": str(e)})
+        return False
+    players = rooms.start(room_id, sentence, sentence_id, by)
+    if players is None:
+        return False
+    deadline = round_seconds(sentence)
+    room.timer = timer_wheel.schedule(deadline, end_round, room_id, room)
+    busy_until = time.monotonic() + deadline
+    # Player states live in the shared client table, so they can all be moved to playing from here.
+    for player in players:
+        session = clients.get(player)
+        if session:
+            session.state = State.IN_ROOM_PLAYING
+            session.busy_until = busy_until
+    broadcast(players, {"type": "game_start", "sentence": sentence, "sentence_id": sentence_id})
+    log("ROOM", "Room %s started with %s players.", room_id, len(players))
+    return True
+
+def finish_game(room_id, room):
+    """Ranks a finished room (a rooms.RoomSnapshot), sends everyone game_over and returns the players to the menu.
+
+    After a round deadline only the players who submitted are ranked; the
+    rest are listed as timed_out.
+    """
+    ranking = rank_results({p: res for p, res in room.results.items() if res is not None})
+    labels = player_labels(room.players)
+    ranks = {p: rank for rank, p, _ in ranking}
+    new_ratings = update_ratings(room.players, [ranks.get(p, len(ranking) + 1) for p in room.players]) # Timed out: last
+    # A tie on both WPM and accuracy at the top is a draw
+    if len(ranking) > 1 and ranking[1][0] == 1:
+        winner_addr_str = "Draw"
+    else:
+        winner_addr_str = labels[ranking[0][1]] if ranking else "Draw"
+    log("GAME", "Room %s finished. Winner: %s", room_id, winner_addr_str)
+
+    game_over = {
+        "type": "game_over",
+        "results": {labels[p]: res for _, p, res in ranking},
+        "ranking": [{"rank": rank, "player": labels[p], "wpm": res["wpm"], "accuracy": res["accuracy"]}
+                    for rank, p, res in ranking],
+        "winner": winner_addr_str,
+        "ratings": {labels[p]: round(rating) for p, rating in new_ratings.items()}
+    }
+    timed_out = [labels[p] for p, res in room.results.items() if res is None]
+    if timed_out:
+        game_over["timed_out"] = timed_out
+    broadcast(room.players, game_over)
+    release_players(room.players) # The room itself was deleted when it finished
+
+def cleanup_client(conn):
+    """Removes client data and cleans up their room if necessary."""
+    session = conn.session
+    log("DISCONNECT", "Client %s disconnected.", session.addr)
+    if session.idle_timer is not None:
+        session.idle_timer.cancel()
+    if session.ping_timer is not None:
+        session.ping_timer.cancel()
+    if session.state is State.MATCHMAKING:
+        matchmaker.remove(session.id)
+        if session.match_timer is not None:
+            session.match_timer.cancel()
+    if room_broker is not None:
+        room_broker.close(conn) # Ends any relayed session, queued match or pending leaderboard query
+    if session.state is not State.RELAYED and session.room_id:
+        room_id = session.room_id
+        outcome, room = rooms.leave(room_id, session.id)
+        if outcome == "closed" and room.players:
+            log("ROOM", "Removing room %s due to player disconnect.", room_id)
+            # Not enough players left to race; tell whoever is still here
+            broadcast(room.players, {"type": "opponent_left"})
+            release_players(room.players)
+        elif outcome == "left":
+            name = player_labels(room.players + [session.id])[session.id] # As the room knew them
+            broadcast(room.players, {"type": "player_left", "player": name, "players": len(room.players)})
+        elif outcome == "finished":
+            finish_game(room_id, room) # The leaver was the last one still typing
+    clients.remove(session.id)
+    if recorder is not None:
+        recorder.close(session.id)
+    try:
+        conn.close()
+    except socket.error:
+        pass # Ignore errors on closing
+
+# --- Client Handling Logic ---
+def register_client(conn, addr, relayed=False):
+    """Adds a freshly accepted connection to the client table and starts its idle timer. Returns its Session.
+
+    relayed: a cluster stand-in for a client that another worker accepted, counts and records.
+    """
+    if not relayed:
+        log("CONNECT", "New connection from %s", addr)
+        CONNECTIONS_TOTAL.inc()
+    session = clients.add(conn, addr)
+    session.last_seen = time.monotonic()
+    if recorder is not None and not relayed:
+        recorder.open(session.id, addr)
+    if IDLE_TIMEOUT > 0:
+        session.idle_timer = timer_wheel.schedule(IDLE_TIMEOUT, check_idle, session.id)
+    return session
+
+def admit_connection(addr):
+    """Checks a just accepted connection against --ip-connect-rate, before it gets a thread or task."""
+    if ip_connects is None or ip_connects.take(addr[0], time.monotonic()):
+        return True
+    THROTTLED.inc(label="connect")
+    return False
+
+def admit_message(session, addr, now):
+    """Spends a token for one frame, before it is decoded. Returns False if the frame must be dropped."""
+    if MSG_RATE > 0:
+        if session.bucket is None:
+            session.bucket = TokenBucket(MSG_RATE, MSG_BURST, now)
+        if not session.bucket.take(now):
+            session.dropped += 1
+            THROTTLED.inc(label="connection")
+            return False
+        session.dropped = 0
+    if ip_messages is not None and not ip_messages.take(addr[0], now):
+        THROTTLED.inc(label="address") # Not the connection's own fault, so it doesn't count towards FLOOD_DROPS
+        return False
+    return True
+
+def handle_message(conn, addr, message):
+    """Runs one decoded message through the client state machine.
+
+    Returns False when the session is over and the connection should close.
+    """
+    session = conn.session
+    current_state = session.state
+    msg_type = message.get("type")
+    payload = message.get("payload", {})
+    if msg_type in ACTIVITY_TYPES:
+        session.last_seen = time.monotonic()
+
+    # --- Leaderboard Queries (any state) ---
+    if msg_type in ("leaderboard", "rank"):
+        if room_broker is not None:
+            room_broker.query(conn, message) # The broker owns the leaderboard and replies directly
+        else:
+            send_message(conn, leaderboard_reply(message, session.name))
+
+    # --- Wire Format Handshake (any state) ---
+    elif msg_type == "hello":
+        offered = payload.get("formats", [])
+        chosen = next((fmt for fmt in WIRE_FORMATS if fmt in offered), "json")
+        send_message(conn, {"type": "hello", "format": chosen, "ping": bool(payload.get("ping"))}) # Still in the old format
+        session.binary = chosen == "binary1"
+        if payload.get("ping"):
+            start_pinging(session)
+
+    # --- RTT Measurement (any state) ---
+    elif msg_type == "ping":
+        send_message(conn, {"type": "pong", "id": payload.get("id")}) # Lets the client measure its own RTT
+    elif msg_type == "pong":
+        sent = session.ping_sent
+        if sent is not None and payload.get("id") == sent[0]:
+            session.ping_sent = None
+            session.rtt.update(time.monotonic() - sent[1])
+
+    # --- Mode Selection ---
+    elif current_state is State.CONNECTED and msg_type == "choose_mode":
+        mode = payload.get("mode")
+        session.name = clean_name(payload.get("name"))
+        if mode == "single":
+            try:
+                sentence_id, sentence = pick_sentence(challenge_options(payload))
+            except CorpusError as e:
+                send_message(conn, {"type": "error", "message": str(e)})
+                return True
+            session.state = State.SINGLE_PLAYER
+            session.sentence = sentence
+            session.sentence_id = sentence_id
+            session.progress = ProgressTracker(sentence)
+            session.busy_until = time.monotonic() + round_seconds(sentence)
+            send_message(conn, {"type": "challenge", "sentence": sentence, "sentence_id": sentence_id})
+        elif mode == "multiplayer":
+            session.state = State.MULTIPLAYER_MENU
+
+        else:
+             send_message(conn, {"type": "error", "message": "Invalid mode."})
+
+    # --- Single Player Result ---
+    elif current_state is State.SINGLE_PLAYER and msg_type == "submit_result":
+        attempt = submitted_attempt(session.progress, payload, network_delay(session))
+        if attempt is None:
+            reject_submission(conn, addr)
+            return True # The clock is still running; they may submit again
+        typed_text, time_taken = attempt
+        original_sentence = session.sentence # The challenge we sent, not the client's copy
+        results = calculate_results(original_sentence, typed_text, time_taken)
+        send_message(conn, {"type": "game_result", "results": results})
+        record_result(session, session.sentence_id, results)
+        return False # End single player session
+
+    # --- Multiplayer Actions ---
+    elif current_state is State.MULTIPLAYER_MENU and msg_type == "multiplayer_action":
+        action = payload.get("action")
+        if action == "create":
+            options = challenge_options(payload)
+            try:
+                pick_sentence(options) # Fail now rather than when the room fills
+            except CorpusError as e:
+                send_message(conn, {"type": "error", "message": str(e)})
+                return True
+            try:
+                size = int(payload.get("size", MIN_PLAYERS))
+                room_id = rooms.create(session.id, options, size)
+            except (TypeError, ValueError):
+                send_message(conn, {"type": "error", "message": f"Room size must be between {MIN_PLAYERS} and {MAX_ROOM_SIZE}."})
+                return True
+            except RoomIdsExhausted:
+                send_message(conn, {"type": "error", "message": "No rooms available, try again later."})
+                return True
+            room = rooms.get(room_id)
+            room.timer = timer_wheel.schedule(ROOM_WAIT_TIMEOUT, expire_room, room_id, room)
+            session.room_id = room_id
+            session.state = State.IN_ROOM_WAITING
+            send_message(conn, {"type": "room_created", "room_id": room_id, "size": size})
+            log("ROOM", "Client %s created room %s for %s players", addr, room_id, size)
+        elif action == "join":
+            room_id = payload.get("room_id")
+            host = room_broker.host_of(room_id) if room_broker is not None else None
+            if host is not None:
+                room_broker.relay(conn, host, encode_message(message)) # The room is on another worker; play there
+                return True
+            players = rooms.join(room_id, session.id)
+            if players is not None:
+                session.room_id = room_id
+                session.state = State.IN_ROOM_WAITING
+                size = rooms.get(room_id).size
+                broadcast(players, {"type": "room_update", "room_id": room_id, "players": len(players), "size": size})
+                log("ROOM", "Client %s joined room %s (%s/%s).", addr, room_id, len(players), size)
+                if len(players) >= size:
+                    start_game(room_id) # Full rooms start by themselves
+            else:
+                send_message(conn, {"type": "error", "message": f"Cannot join room {room_id} (Not found, full, or already playing)."})
+                # Keep state as multiplayer_menu to allow retry
+        elif action == "quick_match":
+            try:
+                size = int(payload.get("size", MIN_PLAYERS))
+                if not MIN_PLAYERS <= size <= MAX_QUICK_MATCH_SIZE:
+                    raise ValueError(size)
+            except (TypeError, ValueError):
+                send_message(conn, {"type": "error", "message": f"Quick match size must be between {MIN_PLAYERS} and {MAX_QUICK_MATCH_SIZE}."})
+                return True
+            options = challenge_options(payload)
+            try:
+                pick_sentence(options) # Fail now rather than after finding a group
+            except CorpusError as e:
+                send_message(conn, {"type": "error", "message": str(e)})
+                return True
+            send_message(conn, {"type": "queued", "size": size, "rating": round(player_rating(session))})
+            if room_broker is not None:
+                room_broker.queue(session, size, options) # One queue for the players of every worker
+            else:
+                queue_for_match(session, size, options)
+        else:
+            send_message(conn, {"type": "error", "message": "Invalid multiplayer action."})
+
+    # --- Leave the Matchmaking Queue ---
+    elif current_state is State.MATCHMAKING and msg_type == "multiplayer_action" and payload.get("action") == "cancel":
+        if room_broker is not None:
+            room_broker.unqueue(session) # If the broker already matched them, the game goes ahead without them
+        elif matchmaker.remove(session.id) is None:
+            return True
+        session.state = State.MULTIPLAYER_MENU
+        if session.match_timer is not None:
+            session.match_timer.cancel()
+            session.match_timer = None
+        send_message(conn, {"type": "match_cancelled"})
+
+    # --- Host Starts Early ---
+    elif current_state is State.IN_ROOM_WAITING and msg_type == "multiplayer_action" and payload.get("action") == "start":
+        if not start_game(session.room_id, by=session.id):
+            send_message(conn, {"type": "error", "message": f"Only the host can start, with at least {MIN_PLAYERS} players."})
+
+    # --- Live Progress ---
+    elif msg_type == "progress" and current_state in (State.SINGLE_PLAYER, State.IN_ROOM_PLAYING):
+        if current_state is State.SINGLE_PLAYER:
+            tracker = session.progress
+        else:
+            room_id = session.room_id
+            room = rooms.get(room_id)
+            tracker = room.progress.get(session.id) if room and room.status == "playing" else None
+        if tracker is not None:
+            tracker.apply(payload.get("del", 0), str(payload.get("add", "")))
+            if current_state is State.IN_ROOM_PLAYING:
+                mark_progress(room_id)
+
+    # --- Multiplayer Game Result Submission ---
+    # This state check assumes the client knows it's playing after receiving game_start
+    elif msg_type == "submit_result":
+        room_id = session.room_id
+        original_sentence = rooms.sentence(room_id) # Get sentence from room
+        if original_sentence is None:
+            log("WARN", "Received result from %s but not in a valid playing room.", addr)
+            return True
+
+        room = rooms.get(room_id)
+        sentence_id = room.sentence_id if room else None
+        attempt = submitted_attempt(room.progress.get(session.id) if room else None, payload, network_delay(session))
+        if attempt is None:
+            reject_submission(conn, addr)
+            return True # Unless they submit again, they time out at the round's deadline
+        typed_text, time_taken = attempt
+        results = calculate_results(original_sentence, typed_text, time_taken)
+        outcome, room = rooms.submit_result(room_id, session.id, results) # Store result
+        if outcome == "duplicate":
+            log("WARN", "Player %s tried to submit results twice for room %s.", addr, room_id)
+            return True # Ignore second submission
+        if outcome == "invalid":
+            log("WARN", "Received result from %s but not in a valid playing room.", addr)
+            return True
+        log("GAME", "Received results from %s in room %s", addr, room_id)
+        record_result(session, sentence_id, results)
+        mark_progress(room_id) # Let the others see this player finish
+
+        if outcome == "finished":
+            finish_game(room_id, room)
+
+    else:
+        log("WARN", "Unhandled message type '%s' or state '%s' from %s", msg_type, current_state, addr)
+
+    return True
+
+def process_data(conn, addr, decoder, data):
+    """Feeds one chunk from the wire to the connection's decoder and dispatches every complete message.
+
+    Shared by every server engine. Returns False when the connection should close.
+    """
+    session = conn.session
+    now = time.monotonic()
+    try:
+        frames = decoder.feed(data, lambda: admit_message(session, addr, now))
+    except FrameTooLarge as e:
+        log("ERROR", "Dropping client %s: %s", addr, e)
+        ERRORS.inc(label="frame_too_large")
+        try:
+            send_message(conn, {"type": "error", "message": "Message too large."})
+        except socket.error:
+            pass
+        return False
+
+    for frame in frames:
+        if recorder is not None:
+            recorder.inbound(session.id, frame)
+        if not isinstance(frame, LegacyFrame) and not admit_message(session, addr, now): # The decoder admitted legacy frames
+            if flooding(conn, addr):
+                return False
+            continue
+        if room_broker is not None and room_broker.route(conn, frame): # Undecoded; the host parses it
+            MESSAGES.inc(label="relayed")
+        elif not process_frame(conn, addr, frame):
+            return False
+    return not flooding(conn, addr) # The decoder may have dropped legacy frames too
+
+def flooding(conn, addr):
+    """Tells a connection over FLOOD_DROPS why it is being closed. Returns True if it is."""
+    if conn.session.dropped < FLOOD_DROPS:
+        return False
+    log("WARN", "Dropping client %s: %s messages in a row over the rate limit.", addr, conn.session.dropped)
+    ERRORS.inc(label="flood")
+    try:
+        send_message(conn, {"type": "error", "message": "Too many messages."})
+    except socket.error:
+        pass
+    return True
+
+def process_frame(conn, addr, frame):
+    """Decodes and dispatches a single frame. Returns False when the connection should close."""
+    try:
+        message = decode_frame(frame)
+        msg_type = message.get("type") if isinstance(message, dict) else None
+        label = msg_type if msg_type in MESSAGE_TYPES else "other"
+        MESSAGES.inc(label=label)
+        log("RECV", "From %s: %s", addr, message)
+        started = time.perf_counter()
+        try:
+            return profiler.call(handle_message, conn, addr, message)
+        finally:
+            DISPATCH_SECONDS.observe(time.perf_counter() - started, label)
+
+    except (json.JSONDecodeError, UnicodeDecodeError, MalformedFrame):
+        log("ERROR", "Invalid message received from %s", addr)
+        ERRORS.inc(label="malformed")
+    except Exception as e:
+         log("ERROR", "Error processing message from %s: %s", addr, e)
+         ERRORS.inc(label="handler")
+         # Basic error feedback
+         try:
+             send_message(conn, {"type": "error", "message": "Server error occurred."})
+         except socket.error:
+             pass # Client might be disconnected
+    return True
+
+def handle_client(sock, addr, slots=None):
+    """Handles communication with a single client (one thread per connection).
+
+    Releases `slots`, the accept loop's connection semaphore, when done.
+    """
+    conn = QueuedConnection(sock) # Replies go through a bounded queue and a writer thread
+    register_client(conn, addr)
+    decoder = MessageDecoder()
+
+    try:
+        while True:
+            data = conn.recv(BUFFER_SIZE)
+            if not data:
+                break # Connection closed
+            if not process_data(conn, addr, decoder, data):
+                break
+
+    except socket.error as e:
+        log("ERROR", "Socket error with client %s: %s", addr, e)
+        ERRORS.inc(label="socket")
+    except Exception as e:
+        log("ERROR", "Unexpected error with client %s: %s", addr, e)
+    finally:
+        if conn.evicted:
+            log("WARN", "Evicted slow client %s: send queue full.", addr)
+            ERRORS.inc(label="evicted")
+        cleanup_client(conn) # Ensure cleanup happens
+        if slots is not None:
+            slots.release()
+
+# --- Asyncio Engine ---
+async def handle_client_async(reader, writer):
+    """Handles communication with a single client as a coroutine on the event loop."""
+    addr = writer.get_extra_info("peername")
+    conn = StreamConnection(writer)
+    register_client(conn, addr)
+    decoder = MessageDecoder()
+
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                break # Connection closed
+            if not process_data(conn, addr, decoder, data):
+                await conn.drain() # Flush the final reply before closing
+                break
+            await conn.drain()
+            if room_broker is not None:
+                await room_broker.drain() # Stop reading while a cluster link is backed up
+
+    except (ConnectionError, OSError) as e:
+        log("ERROR", "Socket error with client %s: %s", addr, e)
+        ERRORS.inc(label="socket")
+    except Exception as e:
+        log("ERROR", "Unexpected error with client %s: %s", addr, e)
+    finally:
+        if conn.evicted:
+            log("WARN", "Evicted slow client %s: send queue full.", addr)
+            ERRORS.inc(label="evicted")
+        cleanup_client(conn) # Ensure cleanup happens
+
+async def run_client_async(sock, slots):
+    """Wraps an accepted socket in streams and serves it, then frees its connection slot."""
+    try:
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await handle_client_async(reader, writer)
+    finally:
+        if slots is not None:
+            slots.release()
+
+async def accept_async(sock):
+    """Accepts clients until cancelled. At --max-connections it stops calling accept() until one
+    leaves, so new clients wait in the listen backlog instead of loading the event loop."""
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(MAX_CONNECTIONS) if MAX_CONNECTIONS > 0 else None
+    tasks = set() # Keep references so the tasks aren't collected
+    while True:
+        if slots is not None:
+            if slots.locked():
+                ACCEPT_WAITS.inc()
+            await slots.acquire()
+        try:
+            conn, addr = await loop.sock_accept(sock)
+        except OSError as e:
+            if slots is not None:
+                slots.release()
+            if e.errno not in ACCEPT_RETRY_ERRNOS:
+                raise
+            log("ERROR", "Accept failed: %s", e)
+            ERRORS.inc(label="accept")
+            await asyncio.sleep(ACCEPT_RETRY_DELAY)
+            continue
+        if not admit_connection(addr):
+            conn.close()
+            if slots is not None:
+                slots.release()
+            continue
+        task = asyncio.ensure_future(run_client_async(conn, slots))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+async def serve_async(sock=None):
+    """Serves clients on HOST:PORT, or on an already bound, non-blocking listening socket."""
+    if sock is None:
+        sock = socket.create_server((HOST, PORT), backlog=LISTEN_BACKLOG) # Sets SO_REUSEADDR
+        sock.setblocking(False)
+    log("INFO", "Asyncio Server listening on %s:%s", HOST, PORT)
+    tickers = [asyncio.ensure_future(progress_ticker_async()), # Keep references so the tasks aren't collected
+               asyncio.ensure_future(timer_ticker_async())]
+    with sock:
+        await accept_async(sock)
+
+# --- Main Server Execution ---
+def start_server():
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        server_socket.bind((HOST, PORT))
+        server_socket.listen()
+        log("INFO", "Simplified Server listening on %s:%s", HOST, PORT)
+        threading.Thread(target=run_progress_ticker, daemon=True).start()
+        threading.Thread(target=run_timer_ticker, daemon=True).start()
+
+        # At --max-connections, stop calling accept() until a client leaves; new ones wait in the listen backlog
+        slots = threading.BoundedSemaphore(MAX_CONNECTIONS) if MAX_CONNECTIONS > 0 else None
+        while True:
+            if slots is not None and not slots.acquire(blocking=False):
+                ACCEPT_WAITS.inc()
+                slots.acquire()
+            try:
+                conn, addr = server_socket.accept()
+            except OSError as e:
+                if slots is not None:
+                    slots.release()
+                if e.errno not in ACCEPT_RETRY_ERRNOS:
+                    raise
+                log("ERROR", "Accept failed: %s", e)
+                ERRORS.inc(label="accept")
+                time.sleep(ACCEPT_RETRY_DELAY)
+                continue
+            if not admit_connection(addr):
+                conn.close()
+                if slots is not None:
+                    slots.release()
+                continue
+            client_thread = threading.Thread(target=handle_client, args=(conn, addr, slots), daemon=True)
+            client_thread.start()
+
+    except socket.error as e:
+        log("FATAL", "Socket error on startup: %s", e)
+    except KeyboardInterrupt:
+        log("INFO", "Server shutting down.")
+    finally:
+        log("INFO", "Closing server socket.")
+
+        server_socket.close()
+
+def start_async_server():
+    """Runs every connection on a single asyncio event loop."""
+    try:
+        asyncio.run(serve_async())
+    except OSError as e:
+        log("FATAL", "Socket error on startup: %s", e)
+    except KeyboardInterrupt:
+        log("INFO", "Server shutting down.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Typing game server.")
+    parser.add_argument("--host", default=HOST, help="Interface to bind (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--engine", choices=ENGINES, default="threads",
+                        help="threads: one thread per connection; asyncio: single event loop "
+                             "for large numbers of mostly idle connections (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port via SO_REUSEPORT; more than 1 "
+                             "runs each worker on the asyncio engine plus a match and leaderboard broker (default: %(default)s)")
+    parser.add_argument("--broker-socket", default=None,
+                        help="Unix socket path for the broker; worker i listens on PATH.i (default: a temporary path)")
+    parser.add_argument("--corpus", default=None,
+                        help="Sentence corpus built with `python corpus.py build` (default: built-in sentences)")
+    parser.add_argument("--progress-rate", type=float, default=PROGRESS_TICK_RATE,
+                        help="Max opponent progress broadcasts per second per room (default: %(default)s)")
+    parser.add_argument("--room-id-digits", type=int, default=ROOM_ID_DIGITS,
+                        help="Digits per room ID; the ID space caps concurrent rooms (default: %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="Close connections silent for this many seconds; a round in progress "
+                             "extends it to the round's deadline; 0 disables (default: %(default)s)")
+    parser.add_argument("--room-wait-timeout", type=float, default=ROOM_WAIT_TIMEOUT,
+                        help="Seconds a room may wait for players before it expires (default: %(default)s)")
+    parser.add_argument("--round-time", type=float, default=ROUND_BASE_SECONDS,
+                        help=f"Base submission deadline per round, in seconds, plus {ROUND_SECONDS_PER_CHAR}s "
+                             "per character of the sentence (default: %(default)s)")
+    parser.add_argument("--log-level", choices=serverlog.LEVELS, default="info",
+                        help="debug also logs every received message (default: %(default)s)")
+    parser.add_argument("--log-format", choices=serverlog.FORMATS, default="text",
+                        help="text: [TAG] lines; json: one JSON object per line (default: %(default)s)")
+    parser.add_argument("--log-sample", type=int, default=1,
+                        help="Log only one in N received messages at debug level (default: %(default)s)")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="Most clients connected at once; at the cap new ones wait in the listen "
+                             "backlog. Per worker with --workers; 0 disables (default: off)")
+    parser.add_argument("--msg-rate", type=float, default=MSG_RATE,
+                        help="Messages per second each connection may send; extra ones are dropped "
+                             "before decoding; 0 disables (default: %(default)s)")
+    parser.add_argument("--msg-burst", type=int, default=MSG_BURST,
+                        help="Messages a connection may send at once above --msg-rate (default: %(default)s)")
+    parser.add_argument("--max-wpm", type=int, default=MAX_PLAUSIBLE_WPM,
+                        help="Reject submissions timed faster than this; 0 disables, e.g. for load tests "
+                             "with --wpm 0 (default: %(default)s)")
+    parser.add_argument("--ip-msg-rate", type=float, default=IP_MSG_RATE,
+                        help="Messages per second from all connections of one IP; 0 disables (default: off)")
+    parser.add_argument("--ip-connect-rate", type=float, default=IP_CONNECT_RATE,
+                        help="New connections per second from one IP; extra ones are closed at once; "
+                             "0 disables (default: off)")
+    parser.add_argument("--leaderboard", default=None,
+                        help="Result log for persistent leaderboards; a snapshot is kept next to it "
+                             "(default: leaderboards are kept in memory only)")
+    parser.add_argument("--record", default=None,
+                        help="Record every message to and from clients in this binary log, for "
+                             "`python -m benchmarks.replay`. With --workers each worker writes PATH "
+                             "with .workerN before the extension (default: off)")
+    parser.add_argument("--record-max-bytes", type=int, default=RECORD_MAX_BYTES,
+                        help="Rotate the recording when it reaches this size (default: %(default)s)")
+    parser.add_argument("--record-backups", type=int, default=RECORD_BACKUPS,
+                        help="Rotated recordings kept, as PATH.1 (newest) to PATH.N (default: %(default)s)")
+    parser.add_argument("--pin-sentences", action="store_true",
+                        help="Let clients choose the sentence with a \"sentence_id\" option; needed to replay "
+                             "recordings faithfully, so only use it on test servers")
+    parser.add_argument("--admin-port", type=int, default=0,
+                        help="Serve /metrics (Prometheus text) and /profile on this localhost port; 0 disables. "
+                             "With --workers the broker uses this port and worker i uses port+1+i (default: off)")
+    parser.add_argument("--profile-seconds", type=float, default=0,
+                        help="Profile message dispatch for the first N seconds after startup (default: off)")
+    parser.add_argument("--profile-output", default="dispatch.prof",
+                        help="Where dispatch profiles are written, for pstats or snakeviz (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def configure(args):
+    """Applies command line settings to the module-level configuration and state."""
+    global HOST, PORT, PROGRESS_TICK_RATE, IDLE_TIMEOUT, ROOM_WAIT_TIMEOUT, ROUND_BASE_SECONDS, PIN_SENTENCES, rooms, corpus
+    global MAX_CONNECTIONS, MSG_RATE, MSG_BURST, MAX_PLAUSIBLE_WPM, ip_messages, ip_connects
+    HOST, PORT = args.host, args.port
+    serverlog.setup(args.log_level, args.log_format, args.log_sample) # Also run by each forked cluster process
+    PROGRESS_TICK_RATE = args.progress_rate
+    IDLE_TIMEOUT, ROOM_WAIT_TIMEOUT, ROUND_BASE_SECONDS = args.idle_timeout, args.room_wait_timeout, args.round_time
+    PIN_SENTENCES = args.pin_sentences
+    MAX_CONNECTIONS, MSG_RATE, MSG_BURST = args.max_connections, args.msg_rate, args.msg_burst
+    MAX_PLAUSIBLE_WPM = args.max_wpm
+    if args.ip_msg_rate > 0:
+        ip_messages = AddressLimiter(args.ip_msg_rate, max(1, args.ip_msg_rate * IP_BURST_SECONDS))
+    if args.ip_connect_rate > 0:
+        ip_connects = AddressLimiter(args.ip_connect_rate, max(1, args.ip_connect_rate * IP_BURST_SECONDS))
+    rooms = RoomRegistry(*room_id_range(args.room_id_digits))
+    if args.corpus:
+        corpus = Corpus(args.corpus) # Memory-mapped; forked workers share the pages
+
+def open_leaderboard(args):
+    """Loads the leaderboard in the process that owns it: the server, or the cluster's broker."""
+    global leaderboard
+    leaderboard = Leaderboard(args.leaderboard)
+    if args.leaderboard:
+        log("INFO", "Leaderboard %s: %s snapshot entries, %s log entries replayed.", args.leaderboard, *leaderboard.loaded)
+
+def process_path(path, name=None):
+    """A per-process output file: path with .name before the extension, so cluster processes don't collide."""
+    if not name:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+def open_recorder(args, name=None):
+    """Starts recording client traffic in a process that owns client sockets, if requested."""
+    global recorder
+    if args.record:
+        path = process_path(args.record, name)
+        recorder = Recorder(path, args.record_max_bytes, args.record_backups)
+        log("INFO", "Recording client traffic to %s", path)
+
+def start_instrumentation(args, port_offset=0, name=None):
+    """Starts this process's admin port and startup profile, if requested.
+
+    Cluster processes pass a port offset and a name so they don't collide.
+    """
+    profile_path = process_path(args.profile_output, name)
+    if args.admin_port:
+        port = args.admin_port + port_offset
+        try:
+            metrics.serve_admin(ADMIN_HOST, port, profiler, profile_path)
+            log("INFO", "Admin port: http://%s:%s/metrics", ADMIN_HOST, port)
+        except OSError as e:
+            log("ERROR", "Could not open admin port %s: %s", port, e)
+    if args.profile_seconds > 0:
+        profiler.start(args.profile_seconds, profile_path)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    try:
+        if args.workers > 1:
+            import cluster # Imports this module as `server`, so the processes share one copy of the state
+            cluster.start_cluster(args)
+            return
+        open_leaderboard(args)
+        open_recorder(args)
+        start_instrumentation(args)
+        if args.engine == "asyncio":
+            start_async_server()
+        else:
+            start_server()
+    finally:
+        if leaderboard is not None:
+            leaderboard.close() # Write out queued results and take a final snapshot
+        if recorder is not None:
+            recorder.stop()
+        serverlog.stop() # Flush queued log lines before exiting
+
+if __name__ == "__main__":
+    main()
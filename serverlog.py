@@ -0,0 +1,114 @@
+# serverlog.py
+"""Server logging: levels, a background writer and sampling of hot events.
+
+Handlers call log("ROOM", "Client %s joined room %s", addr, room_id). The
+tag picks the level: RECV is debug, WARN warning, ERROR error, FATAL
+critical, anything else info. Events below the configured level return
+before any formatting happens. The rest are queued as-is and a writer
+thread (writer.QueuedWriter) formats and writes them, so a slow terminal or pipe never blocks a
+handler; if the writer falls LOG_QUEUE_SIZE records behind, new records are
+dropped and counted instead. Hot tags can be sampled: with a sample of 100
+only one in 100 RECV events is kept.
+
+Text output keeps the "[TAG] message" lines; json output writes one object
+per line with time, level, tag, pid and message.
+"""
+import itertools
+import json
+import logging
+import os
+import sys
+
+from writer import QueuedWriter
+
+# --- Configuration ---
+LOGGER_NAME = "typing_game"
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+FORMATS = ("text", "json")
+LOG_QUEUE_SIZE = 10000
+TAG_LEVELS = {
+    "RECV": logging.DEBUG,
+    "WARN": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "FATAL": logging.CRITICAL,
+}
+SAMPLED_TAGS = ("RECV",) # One event per message; sampled when --log-sample > 1
+
+# --- Global State ---
+logger = logging.getLogger(LOGGER_NAME)
+logger.propagate = False
+listener = None # QueuedWriter feeding the output handler
+_listener_pid = None
+_sample_every = 1
+_counters = {tag: itertools.count() for tag in SAMPLED_TAGS}
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"[{record.tag}] {record.getMessage()}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "tag": record.tag,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class QueuedHandler(logging.Handler):
+    """Hands records, unformatted, to the writer thread; never blocks when it falls behind."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        self.writer.put(record) # Same process; the writer thread does all the formatting
+
+def _write_records(output):
+    def write(records, stopping):
+        for record in records:
+            output.handle(record)
+    return write
+
+def setup(level="info", fmt="text", sample=1, stream=None):
+    """(Re)starts logging for this process. Call again after fork; threads don't survive it."""
+    global listener, _listener_pid, _sample_every
+    if listener is not None and _listener_pid == os.getpid():
+        stop() # A listener inherited through fork has no thread here and is just dropped
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    listener = QueuedWriter(_write_records(output), "log-writer", maxsize=LOG_QUEUE_SIZE)
+    logger.addHandler(QueuedHandler(listener))
+    logger.setLevel(LEVELS[level])
+    _sample_every = max(1, int(sample))
+    _listener_pid = os.getpid()
+
+def stop():
+    """Writes out whatever is still queued and stops the writer thread."""
+    global listener
+    if listener is None:
+        return
+    if listener.dropped:
+        listener.maxsize = 0 # The queue may still be full; this one mustn't be dropped too
+        log("WARN", "%s log records were dropped because the writer fell behind.", listener.dropped)
+    listener.stop()
+    listener = None
+
+def log(tag, message, *args):
+    """Logs one event. args are only merged into message if the event is actually written."""
+    level = TAG_LEVELS.get(tag, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return
+    if _sample_every > 1 and tag in _counters and next(_counters[tag]) % _sample_every:
+        return
+    logger.log(level, message, *args, extra={"tag": tag})
@@ -0,0 +1,53 @@
+# session.py
+"""Per-connection state.
+
+A Session keeps what the server knows about one connection in fixed slots
+rather than a dict, which makes an idle connection cheap and turns a
+misspelt field into an AttributeError instead of a silent new key. Sessions
+are numbered from 1 by the ClientRegistry; rooms, timers and the matchmaking
+queue refer to players by that number, never by their socket object.
+"""
+import enum
+
+class State(enum.Enum):
+    """Where a connection is in the protocol."""
+    CONNECTED = "connected"               # Waiting for choose_mode
+    SINGLE_PLAYER = "single_player"       # Typing a challenge alone
+    MULTIPLAYER_MENU = "multiplayer_menu" # Can create, join or quick_match
+    MATCHMAKING = "matchmaking"           # Queued for a quick match
+    IN_ROOM_WAITING = "in_room_waiting"
+    IN_ROOM_PLAYING = "in_room_playing"
+    RELAYED = "relayed"                   # Cluster worker: another worker hosts its room and runs the session
+
+    def __str__(self):
+        return self.value
+
+class Session:
+    __slots__ = ("id", "conn", "addr", "name", "state", "room_id", "binary", "sentences_sent", "last_seen",
+                 "busy_until", "idle_timer", "ping_timer", "ping_id", "ping_sent", "rtt", "rating",
+                 "match_timer", "match_options", "sentence", "sentence_id", "progress", "bucket", "dropped")
+
+    def __init__(self, session_id, conn, addr):
+        self.id = session_id
+        self.conn = conn
+        self.addr = addr
+        self.name = None          # Leaderboard name from choose_mode
+        self.state = State.CONNECTED
+        self.room_id = None
+        self.binary = False       # Agreed to binary frames in hello
+        self.sentences_sent = None # Sentence IDs whose text went out in binary frames (server.wire_format)
+        self.last_seen = 0.0      # Monotonic time of the last game message (server.ACTIVITY_TYPES)
+        self.busy_until = 0.0     # End of the round being typed; counts as activity for the idle timeout
+        self.idle_timer = None
+        self.ping_timer = None
+        self.ping_id = 0          # Last ping sent
+        self.ping_sent = None     # (ping ID, monotonic send time) of the ping awaiting its pong
+        self.rtt = None           # rtt.RttEstimator once the client answers pings
+        self.rating = None        # Elo rating, once looked up
+        self.match_timer = None
+        self.match_options = None # Challenge options asked for in quick_match
+        self.sentence = None      # Single player challenge
+        self.sentence_id = None
+        self.progress = None      # progress.ProgressTracker for the single player challenge
+        self.bucket = None        # ratelimit.TokenBucket for its messages, from the first one on
+        self.dropped = 0          # Messages dropped in a row by that bucket
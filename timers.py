@@ -0,0 +1,97 @@
+# timers.py
+"""Hierarchical timer wheel for the server's timeouts.
+
+Time advances in ticks of `tick` seconds. Level 0 has one slot per tick;
+each higher level has slots `slots` times wider than the level below. A
+timer goes into the lowest level whose span covers its delay. When the wheel
+reaches a higher-level slot, that slot's timers are moved down. Scheduling
+and cancelling are O(1), and each timer is moved at most once per level, so
+thousands of idle-connection and room timers cost next to nothing between
+expiries.
+
+Cancelling only marks the timer. It is dropped when its slot comes up.
+Callbacks run on whichever thread or task calls advance(), outside the
+wheel's lock, so they may schedule new timers.
+"""
+import math
+import threading
+import time
+
+from serverlog import log
+
+# --- Configuration ---
+TIMER_TICK = 0.1  # Seconds per tick; timers fire up to one tick late
+WHEEL_SLOTS = 64  # Slots per level
+WHEEL_LEVELS = 4  # 64^4 ticks of 0.1s is about 19 days; longer timers just cascade again
+
+class Timer:
+    __slots__ = ("expires", "callback", "args", "cancelled")
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires # Tick number
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        self.callback, self.args = None, () # Don't keep rooms or connections alive until the slot comes up
+
+class TimerWheel:
+    def __init__(self, tick=TIMER_TICK, slots=WHEEL_SLOTS, levels=WHEEL_LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self._spans = [slots ** level for level in range(levels)] # Ticks per slot at each level
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._now = 0 # Ticks processed so far
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self.pending = 0 # Timers scheduled and not yet fired or dropped
+
+    def schedule(self, delay, callback, *args):
+        """Calls callback(*args) after at least `delay` seconds. Returns a Timer that can be cancelled."""
+        with self._lock:
+            timer = Timer(self._now + max(1, math.ceil(delay / self.tick)), callback, args)
+            self._place(timer)
+            self.pending += 1
+        return timer
+
+    def _place(self, timer):
+        """Puts a timer in the lowest level that covers its remaining time. Call with the lock held."""
+        remaining = timer.expires - self._now
+        level = 0
+        while level + 1 < len(self._spans) and remaining >= self._spans[level + 1]:
+            level += 1
+        self._wheels[level][(timer.expires // self._spans[level]) % self.slots].append(timer)
+
+    def advance(self, now=None):
+        """Processes every tick up to `now` (monotonic seconds) and runs the timers that are due."""
+        target = int(((time.monotonic() if now is None else now) - self._started) / self.tick)
+        due = []
+        with self._lock:
+            while self._now < target:
+                self._now += 1
+                # Move timers down from every higher level whose slot boundary we just crossed, top first.
+                for level in range(len(self._spans) - 1, 0, -1):
+                    span = self._spans[level]
+                    if self._now % span:
+                        continue
+                    index = (self._now // span) % self.slots
+                    bucket, self._wheels[level][index] = self._wheels[level][index], []
+                    for timer in bucket:
+                        if timer.cancelled:
+                            self.pending -= 1
+                        else:
+                            self._place(timer)
+                index = self._now % self.slots
+                bucket, self._wheels[0][index] = self._wheels[0][index], []
+                for timer in bucket:
+                    self.pending -= 1
+                    if not timer.cancelled:
+                        due.append(timer)
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                log("ERROR", "Timer callback %s failed: %r", getattr(timer.callback, "__name__", timer.callback), e)
+        return len(due)
@@ -0,0 +1,223 @@
+# transport.py
+"""Connection wrappers with bounded outgoing queues.
+
+Handlers only call sendall() and close(). sendall() never blocks: bytes the
+socket can't take at once go onto a per-connection queue capped at
+SEND_QUEUE_BYTES. A client that lets its queue fill up (it stopped reading,
+or can't keep up with broadcasts) is evicted, because it would otherwise hold
+memory and stall everyone else in its room. Eviction closes the socket, and the connection's handler then
+cleans it up like any other disconnect.
+"""
+import asyncio
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+# --- Configuration ---
+SEND_QUEUE_BYTES = 256 * 1024 # Unsent bytes allowed per connection before it is evicted
+SEND_TIMEOUT = 10.0           # Seconds a client may leave queued bytes unread before it is evicted
+STALL_CHECK_INTERVAL = 1.0    # Seconds between the send pump's checks for stalled clients
+NONBLOCKING = getattr(socket, "MSG_DONTWAIT", 0) # Not on Windows, where SO_SNDTIMEO bounds each write instead
+
+class QueuedConnection:
+    """Socket wrapper for the threads engine.
+
+    sendall() writes straight to the socket without blocking. Whatever the
+    socket won't take yet is queued, and the shared SendPump thread writes it
+    out as the client reads, so there is no writer thread per connection.
+    """
+
+    def __init__(self, sock, limit=SEND_QUEUE_BYTES):
+        self.sock = sock
+        self.limit = limit
+        self.evicted = False
+        self.session = None # Set when the server registers the connection
+        self._queue = deque()
+        self._queued = 0          # Bytes in the queue
+        self._closed = False      # No more sends; the socket closes once the queue is written
+        self._pumped = False      # Registered with the send pump, which then does all the writing
+        self._progress_at = 0.0   # Monotonic time the queue last shrank
+        self._lock = threading.Lock()
+        if not NONBLOCKING:
+            try:
+                seconds = int(SEND_TIMEOUT)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", seconds, int((SEND_TIMEOUT - seconds) * 1e6)))
+            except (OSError, AttributeError, struct.error):
+                pass # Not supported here; the queue limit still applies
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def sendall(self, data):
+        with self._lock:
+            if self._closed:
+                return
+            if not self._queue:
+                try:
+                    sent = self.sock.send(data, NONBLOCKING)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    self._closed = True
+                    self._shutdown() # Broken; make sure the reading handler notices
+                    return
+                if sent == len(data):
+                    return
+                data = data[sent:]
+            if self._queued + len(data) > self.limit:
+                self._evict()
+                return
+            self._queue.append(data)
+            self._queued += len(data)
+            if not self._pumped:
+                self._pumped = True
+                self._progress_at = time.monotonic()
+                send_pump.add(self)
+
+    def _evict(self):
+        """Drops the queue and shuts the socket so the reading handler sees a disconnect. Call with the lock held."""
+        self.evicted = True
+        self._closed = True
+        self._queue.clear()
+        self._queued = 0
+        self._shutdown()
+
+    def _shutdown(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # Also wakes the handler's recv() when another thread closed us
+        except OSError:
+            pass
+
+    def _finish(self):
+        self._shutdown()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _pump(self, now, writable, release):
+        """Called by the send pump: writes what the socket will take, or evicts a client that has
+        read nothing for SEND_TIMEOUT. Once the queue is empty, calls release() with the lock
+        held, so the pump lets go of the socket before it can be closed."""
+        with self._lock:
+            if writable and self._queue:
+                data = b"".join(self._queue) # Coalesce everything queued into one write
+                self._queue.clear()
+                try:
+                    sent = self.sock.send(data, NONBLOCKING)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    sent, data = 0, b""
+                    self._closed = True
+                if sent:
+                    self._progress_at = now
+                if sent < len(data):
+                    self._queue.append(data[sent:])
+                self._queued = len(data) - sent
+            elif self._queue and now - self._progress_at > SEND_TIMEOUT:
+                self._evict()
+            if self._queue:
+                return
+            release(self)
+            self._pumped = False
+            if self._closed:
+                self._finish()
+
+    def close(self):
+        """Closes once everything already queued has been written."""
+        with self._lock:
+            self._closed = True
+            if not self._pumped:
+                self._finish()
+
+class SendPump:
+    """One thread that writes out the queued bytes of every QueuedConnection as its socket becomes writable."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._added = [] # Connections to register, handed over from sending threads
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, conn):
+        with self._lock:
+            self._added.append(conn)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="send-pump", daemon=True)
+                self._thread.start()
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass # Already has a wake-up pending
+
+    def _release(self, conn):
+        self._selector.unregister(conn.sock)
+        self._conns.discard(conn)
+
+    def _run(self):
+        self._conns = set()
+        checked = time.monotonic()
+        while True:
+            events = self._selector.select(STALL_CHECK_INTERVAL)
+            now = time.monotonic()
+            for key, _ in events:
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    with self._lock:
+                        added, self._added = self._added, []
+                    for conn in added:
+                        self._selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+                        self._conns.add(conn)
+                else:
+                    key.data._pump(now, True, self._release)
+            if now - checked >= STALL_CHECK_INTERVAL:
+                checked = now
+                for conn in list(self._conns):
+                    conn._pump(now, False, self._release)
+
+send_pump = SendPump()
+
+class StreamConnection:
+    """Gives an asyncio stream writer the socket methods the handlers use.
+
+    The transport's own buffer is the send queue; writes never block the event loop.
+    """
+
+    def __init__(self, writer, limit=SEND_QUEUE_BYTES):
+        self.writer = writer
+        self.limit = limit
+        self.evicted = False
+        self.session = None # Set when the server registers the connection
+
+    def sendall(self, data):
+        transport = self.writer.transport
+        if self.evicted or transport.is_closing():
+            return
+        if transport.get_write_buffer_size() + len(data) > self.limit:
+            self.evicted = True
+            transport.abort() # Drop unsent data; the read loop then ends and cleans up
+            return
+        self.writer.write(data)
+
+    async def drain(self):
+        """Waits for the transport buffer to drain; a client that won't read for SEND_TIMEOUT is evicted."""
+        try:
+            await asyncio.wait_for(self.writer.drain(), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.evicted = True
+            self.writer.transport.abort()
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,59 @@
+# writer.py
+"""Background writer shared by the log, the leaderboard and the recorder.
+
+Callers put() items and return at once; one thread takes everything queued
+so far and hands it to write(batch, stopping) in a single call, so a disk
+or pipe that is slow costs batch size, never caller time. After each batch
+the thread can wait `interval` seconds, letting the next one grow (one
+flush or fsync then covers more items). With a maxsize, items that arrive
+while the writer is that far behind are dropped and counted in `dropped`.
+"""
+import queue
+import threading
+import time
+
+_STOP = object() # Queued by stop(); everything put before it is still written
+
+class QueuedWriter:
+    """One writer thread draining a queue in batches."""
+
+    def __init__(self, write, name, interval=0.0, maxsize=0):
+        self._write = write # Called as write(items, stopping); stopping is True for the last batch, even if empty
+        self.interval = interval
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """Queues one item. Never blocks."""
+        if self.maxsize and self._queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self._queue.put(item)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = any(item is _STOP for item in batch)
+            if stopping:
+                batch = [item for item in batch if item is not _STOP]
+            self._write(batch, stopping)
+            if stopping:
+                return
+            if self.interval:
+                time.sleep(self.interval)
+
+    def stop(self):
+        """Writes out everything queued, then ends the thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None